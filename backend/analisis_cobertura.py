@@ -0,0 +1,422 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import eventos
+from cobertura import Grilla, _torre_valida
+from database import execute_query, run_in_db_thread
+from geo import KM_PER_DEGREE_LAT, bbox_for_radius
+
+# Región analizable (lat_min, lat_max, lon_min, lon_max); por defecto la provincia del Chaco
+ANALISIS_REGION = tuple(
+    float(valor) for valor in os.getenv('ANALISIS_REGION', '-28.2,-23.9,-63.5,-58.2').split(',')
+)
+# Lado de cada tesela en grados: unidad de caché y de invalidación
+ANALISIS_TESELA_GRADOS = float(os.getenv('ANALISIS_TESELA_GRADOS', '0.5'))
+# Tope de celdas por pedido y de teselas guardadas en caché
+ANALISIS_MAX_CELDAS = int(os.getenv('ANALISIS_MAX_CELDAS', '2000000'))
+ANALISIS_CACHE_TESELAS = int(os.getenv('ANALISIS_CACHE_TESELAS', '1024'))
+ANALISIS_WORKERS = int(os.getenv('ANALISIS_WORKERS', str(os.cpu_count() or 1)))
+
+# Niveles de redundancia que se informan por separado; los mayores se agrupan
+REDUNDANCIA_MAX = 5
+
+
+class AnalisisError(ValueError):
+    """Pedido de análisis fuera de la región o demasiado grande"""
+
+
+def teselas_de(lat_min, lat_max, lon_min, lon_max, region=ANALISIS_REGION,
+               tesela_grados=ANALISIS_TESELA_GRADOS):
+    """Rango de teselas (ty0, ty1, tx0, tx1) inclusive que tocan el rectángulo"""
+    return (
+        math.floor((lat_min - region[0]) / tesela_grados),
+        math.floor((lat_max - region[0]) / tesela_grados),
+        math.floor((lon_min - region[2]) / tesela_grados),
+        math.floor((lon_max - region[2]) / tesela_grados),
+    )
+
+
+class Malla:
+    """Grilla global de la región para un tamaño de celda, dividida en teselas
+
+    El paso en latitud y longitud se ajusta para que cada tesela tenga un
+    número entero de celdas: así las teselas calculadas por separado encajan
+    sin solaparse y se pueden cachear e invalidar de a una.
+    """
+
+    def __init__(self, celda_km, region=ANALISIS_REGION, tesela_grados=ANALISIS_TESELA_GRADOS):
+        self.lat_min, self.lat_max, self.lon_min, self.lon_max = region
+        self.tesela = tesela_grados
+        lat_centro = math.radians((self.lat_min + self.lat_max) / 2)
+        self.filas_tesela = max(1, round(tesela_grados * KM_PER_DEGREE_LAT / celda_km))
+        self.columnas_tesela = max(1, round(
+            tesela_grados * KM_PER_DEGREE_LAT * math.cos(lat_centro) / celda_km
+        ))
+        self.dlat = tesela_grados / self.filas_tesela
+        self.dlon = tesela_grados / self.columnas_tesela
+        self.clave = (self.filas_tesela, self.columnas_tesela)
+
+    def grilla_tesela(self, ty, tx):
+        return (
+            self.lat_min + ty * self.tesela, self.lon_min + tx * self.tesela,
+            self.dlat, self.dlon, self.filas_tesela, self.columnas_tesela,
+        )
+
+
+def _rasterizar_tesela(lat_min, lon_min, dlat, dlon, filas, columnas, lat, lon, alcance_km):
+    """Raster de conteo de una tesela (corre en el pool de procesos)"""
+    grilla = Grilla.alineada(lat_min, lon_min, dlat, dlon, filas, columnas)
+    return grilla.rasterizar(lat, lon, alcance_km).astype(np.uint16)
+
+
+class AnalisisCobertura:
+    """Rasters de cobertura por teselas con caché e invalidación por torre
+
+    Guarda su propia copia de (latitud, longitud, alcance_km) por torre; al
+    cambiar una torre se descartan sólo las teselas que tocaba su disco
+    anterior y el nuevo. Las torres de cada tesela faltante se filtran en un
+    hilo y el raster se calcula en el pool de procesos, así que el event loop
+    sólo consulta la caché y arma el mosaico.
+    """
+
+    def __init__(self, max_teselas=ANALISIS_CACHE_TESELAS):
+        self.max_teselas = max_teselas
+        self._lock = threading.Lock()
+        self._torres = {}  # id -> (latitud, longitud, alcance_km)
+        self._arrays = None
+        # Cambios de torres: los arrays armados fuera del lock sólo se guardan si no hubo otro
+        self._cambios = 0
+        self._tareas = set()
+        self._cache = OrderedDict()  # (clave de malla, ty, tx) -> raster uint16
+        # Versión por tesela (ty, tx): sólo se cachea lo calculado sin cambios en el medio
+        self._versiones = {}
+        self._epoca = 0
+        # Teselas que se están calculando, para no repetir el trabajo entre pedidos
+        self._en_curso = {}
+        self.aciertos = 0
+        self.calculadas = 0
+
+    # --------- torres ---------
+
+    def build(self, torres):
+        with self._lock:
+            self._torres = {
+                torre_id: (float(lat), float(lon), float(alcance))
+                for torre_id, lat, lon, alcance in torres
+                if _torre_valida(lat, lon, alcance)
+            }
+            self._arrays = None
+            self._cambios += 1
+            self._cache.clear()
+            self._epoca += 1
+
+    def _invalidar_disco(self, torre):
+        ty0, ty1, tx0, tx1 = teselas_de(*bbox_for_radius(*torre))
+        tocadas = {(ty, tx) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)}
+        for tesela in tocadas:
+            self._versiones[tesela] = self._versiones.get(tesela, 0) + 1
+        for clave in [clave for clave in self._cache if clave[1:] in tocadas]:
+            del self._cache[clave]
+
+    def upsert(self, torre_id, lat, lon, alcance_km):
+        with self._lock:
+            anterior = self._torres.pop(torre_id, None)
+            nueva = None
+            if _torre_valida(lat, lon, alcance_km):
+                nueva = (float(lat), float(lon), float(alcance_km))
+                self._torres[torre_id] = nueva
+            if anterior == nueva:
+                return
+            self._arrays = None
+            self._cambios += 1
+            for torre in (anterior, nueva):
+                if torre is not None:
+                    self._invalidar_disco(torre)
+
+    def remove(self, torre_id):
+        self.upsert(torre_id, None, None, None)
+
+    def _arrays_torres(self):
+        """(lat, lon, alcance, dlat, dlon) de todas las torres
+
+        Se arman fuera del lock: las escrituras, que llegan desde el event
+        loop, sólo esperan la copia de los valores.
+        """
+        with self._lock:
+            if self._arrays is not None:
+                return self._arrays
+            cambios = self._cambios
+            valores = list(self._torres.values())
+        if valores:
+            lat, lon, alcance = (np.array(v, dtype=np.float64) for v in zip(*valores))
+        else:
+            lat = lon = alcance = np.empty(0, dtype=np.float64)
+        dlat = alcance / KM_PER_DEGREE_LAT
+        dlon = alcance / (KM_PER_DEGREE_LAT * np.maximum(np.cos(np.radians(lat)), 1e-6))
+        arrays = (lat, lon, alcance, dlat, dlon)
+        with self._lock:
+            if self._cambios == cambios:
+                self._arrays = arrays
+        return arrays
+
+    def _preparar(self, malla, teselas):
+        """(parámetros de grilla, torres cuyo disco la toca) por tesela (corre en un hilo)"""
+        lat, lon, alcance, dlat, dlon = self._arrays_torres()
+        trabajos = []
+        for ty, tx in teselas:
+            parametros = malla.grilla_tesela(ty, tx)
+            lat_min, lon_min = parametros[:2]
+            tocan = (
+                (lat + dlat >= lat_min) & (lat - dlat <= lat_min + malla.tesela)
+                & (lon + dlon >= lon_min) & (lon - dlon <= lon_min + malla.tesela)
+            )
+            trabajos.append((parametros, (lat[tocan], lon[tocan], alcance[tocan])))
+        return trabajos
+
+    # --------- rasters ---------
+
+    async def _calcular(self, malla, nuevas, executor):
+        """Calcular las teselas nuevas y resolver sus futuros
+
+        Corre como tarea aparte: si se cancela el pedido que la lanzó, los
+        demás pedidos que esperan las mismas teselas igual reciben el raster.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            trabajos = await run_in_db_thread(self._preparar, malla, [(ty, tx) for ty, tx, *_ in nuevas])
+            resultados = await asyncio.gather(*(
+                loop.run_in_executor(executor, _rasterizar_tesela, *parametros, *torres)
+                for parametros, torres in trabajos
+            ), return_exceptions=True)
+        except Exception as e:
+            resultados = [e] * len(nuevas)
+        for (ty, tx, clave, version, futuro), raster in zip(nuevas, resultados):
+            del self._en_curso[(clave, version)]
+            if futuro.done():
+                continue
+            if isinstance(raster, BaseException):
+                futuro.set_exception(raster)
+                continue
+            with self._lock:
+                self.calculadas += 1
+                if (self._epoca, self._versiones.get((ty, tx), 0)) == version:
+                    self._cache[clave] = raster
+                    while len(self._cache) > self.max_teselas:
+                        self._cache.popitem(last=False)
+            futuro.set_result(raster)
+
+    async def _teselas(self, malla, teselas, executor):
+        """Rasters de las teselas: de la caché, de un cálculo en curso o calculados ahora"""
+        loop = asyncio.get_running_loop()
+        rasters, esperas, nuevas = {}, {}, []
+        with self._lock:
+            for ty, tx in teselas:
+                clave = (malla.clave, ty, tx)
+                raster = self._cache.get(clave)
+                if raster is not None:
+                    self._cache.move_to_end(clave)
+                    self.aciertos += 1
+                    rasters[(ty, tx)] = raster
+                    continue
+                version = (self._epoca, self._versiones.get((ty, tx), 0))
+                futuro = self._en_curso.get((clave, version))
+                if futuro is None:
+                    futuro = self._en_curso[(clave, version)] = loop.create_future()
+                    nuevas.append((ty, tx, clave, version, futuro))
+                esperas[(ty, tx)] = futuro
+        if nuevas:
+            # Referencia fuerte mientras corre: el loop sólo guarda una débil
+            tarea = asyncio.ensure_future(self._calcular(malla, nuevas, executor))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._tareas.discard)
+        if esperas:
+            # shield: cancelar este pedido no cancela el futuro que comparten otros
+            calculados = await asyncio.gather(*(asyncio.shield(f) for f in esperas.values()))
+            rasters.update(zip(esperas.keys(), calculados))
+        return [rasters[tesela] for tesela in teselas]
+
+    async def raster(self, lat_min, lat_max, lon_min, lon_max, celda_km, executor):
+        """(Grilla, conteo) del rectángulo pedido, recortado a celdas de la malla"""
+        malla = Malla(celda_km)
+        lat_min, lat_max = max(lat_min, malla.lat_min), min(lat_max, malla.lat_max)
+        lon_min, lon_max = max(lon_min, malla.lon_min), min(lon_max, malla.lon_max)
+        if lat_min >= lat_max or lon_min >= lon_max:
+            raise AnalisisError("El rectángulo no se superpone con la región analizada")
+
+        # Celdas globales del recorte (fila 0 = sur de la región)
+        f0 = math.floor((lat_min - malla.lat_min) / malla.dlat)
+        f1 = math.ceil((lat_max - malla.lat_min) / malla.dlat)
+        c0 = math.floor((lon_min - malla.lon_min) / malla.dlon)
+        c1 = math.ceil((lon_max - malla.lon_min) / malla.dlon)
+        if (f1 - f0) * (c1 - c0) > ANALISIS_MAX_CELDAS:
+            raise AnalisisError("Demasiadas celdas: aumente celda_km o achique el rectángulo")
+
+        ft, ct = malla.filas_tesela, malla.columnas_tesela
+        ty0, ty1 = f0 // ft, (f1 - 1) // ft
+        tx0, tx1 = c0 // ct, (c1 - 1) // ct
+        teselas = [(ty, tx) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+        rasters = await self._teselas(malla, teselas, executor)
+
+        mosaico = np.empty(((ty1 - ty0 + 1) * ft, (tx1 - tx0 + 1) * ct), dtype=np.uint16)
+        for (ty, tx), raster in zip(teselas, rasters):
+            fila, columna = (ty - ty0) * ft, (tx - tx0) * ct
+            mosaico[fila:fila + ft, columna:columna + ct] = raster
+        conteo = mosaico[f0 - ty0 * ft:f1 - ty0 * ft, c0 - tx0 * ct:c1 - tx0 * ct]
+        grilla = Grilla.alineada(
+            malla.lat_min + f0 * malla.dlat, malla.lon_min + c0 * malla.dlon,
+            malla.dlat, malla.dlon, f1 - f0, c1 - c0,
+        )
+        return grilla, conteo
+
+    def stats(self):
+        with self._lock:
+            return {
+                "torres": len(self._torres),
+                "teselas_en_cache": len(self._cache),
+                "aciertos": self.aciertos,
+                "calculadas": self.calculadas,
+            }
+
+
+# =================== RESULTADOS ===================
+
+def resumen(grilla, conteo):
+    """Áreas cubierta y sin cobertura, y área por cantidad de torres que cubren"""
+    area = np.broadcast_to(grilla.area_celda_fila[:, None], conteo.shape)
+    nivel = np.minimum(conteo, REDUNDANCIA_MAX)
+    celdas = np.bincount(nivel.ravel(), minlength=REDUNDANCIA_MAX + 1)
+    areas = np.bincount(nivel.ravel(), weights=area.ravel(), minlength=REDUNDANCIA_MAX + 1)
+    total = float(areas.sum())
+    return {
+        "area_total_km2": round(total, 2),
+        "area_cubierta_km2": round(total - float(areas[0]), 2),
+        "area_sin_cobertura_km2": round(float(areas[0]), 2),
+        "porcentaje_cubierto": round(100 * (1 - float(areas[0]) / total), 2) if total else 0.0,
+        "redundancia": [
+            {
+                "torres": f"{k}+" if k == REDUNDANCIA_MAX else str(k),
+                "celdas": int(celdas[k]),
+                "area_km2": round(float(areas[k]), 2),
+            }
+            for k in range(REDUNDANCIA_MAX + 1)
+        ],
+    }
+
+def raster_json(grilla, conteo):
+    """Mapa de redundancia: torres que cubren cada celda, fila 0 = sur"""
+    return {
+        "lat_min": grilla.lat_min, "lat_max": grilla.lat_max,
+        "lon_min": grilla.lon_min, "lon_max": grilla.lon_max,
+        "dlat": grilla.dlat, "dlon": grilla.dlon,
+        "filas": grilla.filas, "columnas": grilla.columnas,
+        "conteo": conteo.tolist(),
+    }
+
+def informe(grilla, conteo, formato="resumen"):
+    """Respuesta del análisis: resumen y, según formato, raster o brechas (pesado: usar fuera del loop)"""
+    resultado = {"filas": grilla.filas, "columnas": grilla.columnas, **resumen(grilla, conteo)}
+    if formato == "raster":
+        resultado["raster"] = raster_json(grilla, conteo)
+    elif formato == "brechas":
+        resultado["brechas"] = brechas_geojson(grilla, conteo)
+    return resultado
+
+def brechas_geojson(grilla, conteo):
+    """Zonas sin cobertura como MultiPolygon GeoJSON de rectángulos
+
+    Cada fila se recorre en tramos de celdas sin cobertura; los tramos
+    idénticos de filas consecutivas se unen en un mismo rectángulo.
+    """
+    vacio = conteo == 0
+    borde = np.zeros((vacio.shape[0], 1), dtype=np.int8)
+    cambios = np.diff(np.hstack([borde, vacio.astype(np.int8), borde]), axis=1)
+    filas_ini, cols_ini = np.nonzero(cambios == 1)
+    _, cols_fin = np.nonzero(cambios == -1)
+    tramos_por_fila = {}
+    for fila, desde, hasta in zip(filas_ini.tolist(), cols_ini.tolist(), cols_fin.tolist()):
+        tramos_por_fila.setdefault(fila, set()).add((desde, hasta))
+
+    abiertos = {}  # (col_desde, col_hasta) -> fila inicial
+    rectangulos = []
+    for fila in range(grilla.filas + 1):
+        vigentes = tramos_por_fila.get(fila, set())
+        for tramo in [tramo for tramo in abiertos if tramo not in vigentes]:
+            rectangulos.append((abiertos.pop(tramo), fila, *tramo))
+        for tramo in vigentes:
+            abiertos.setdefault(tramo, fila)
+
+    poligonos, area_km2 = [], 0.0
+    for fila_desde, fila_hasta, desde, hasta in rectangulos:
+        sur = grilla.lat_min + fila_desde * grilla.dlat
+        norte = grilla.lat_min + fila_hasta * grilla.dlat
+        oeste = grilla.lon_min + desde * grilla.dlon
+        este = grilla.lon_min + hasta * grilla.dlon
+        poligonos.append([[
+            [round(oeste, 6), round(sur, 6)], [round(este, 6), round(sur, 6)],
+            [round(este, 6), round(norte, 6)], [round(oeste, 6), round(norte, 6)],
+            [round(oeste, 6), round(sur, 6)],
+        ]])
+        area_km2 += float(grilla.area_celda_fila[fila_desde:fila_hasta].sum()) * (hasta - desde)
+    return {
+        "type": "Feature",
+        "geometry": {"type": "MultiPolygon", "coordinates": poligonos},
+        "properties": {"area_km2": round(area_km2, 2), "rectangulos": len(poligonos)},
+    }
+
+
+# =================== MOTOR COMPARTIDO ===================
+
+_analisis = AnalisisCobertura()
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn y no fork: el proceso ya tiene hilos que pueden tener locks tomados
+        _executor = ProcessPoolExecutor(
+            max_workers=ANALISIS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+def iniciar_pool():
+    """Crear el pool de teselas al arrancar, no en el primer análisis"""
+    _get_executor()
+
+def shutdown_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def _leer_torres():
+    torres = execute_query(
+        "SELECT id, latitud, longitud, alcance_km FROM Torres",
+        fetch_all=True
+    )
+    if isinstance(torres, dict):
+        raise Exception(torres['error'])
+    return [(t['id'], t['latitud'], t['longitud'], t['alcance_km']) for t in torres]
+
+def _aplicar(accion, torre_id, datos):
+    if accion == eventos.DELETE:
+        _analisis.remove(torre_id)
+    elif datos:
+        _analisis.upsert(torre_id, datos.get('latitud'), datos.get('longitud'), datos.get('alcance_km'))
+
+_sincronizado = eventos.IndiceSincronizado("Torres", _leer_torres, _analisis.build, _aplicar)
+
+async def analizar(lat_min, lat_max, lon_min, lon_max, celda_km):
+    """(Grilla, conteo) del rectángulo; las teselas faltantes se calculan en otro proceso"""
+    if not _sincronizado.cargado():
+        await run_in_db_thread(_sincronizado.cargar)
+    return await _analisis.raster(lat_min, lat_max, lon_min, lon_max, celda_km, _get_executor())
+
+def stats():
+    return _analisis.stats()
@@ -1,3 +1,10 @@
+import asyncio
+import hashlib
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 import jwt
@@ -10,9 +17,108 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "tu_clave_secreta_super_segura_cambiala
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Costo de bcrypt: los hashes con otro costo se regeneran al iniciar sesión
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Procesos dedicados a bcrypt y máximo de operaciones en espera
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", str(HASH_WORKERS * 16)))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 security = HTTPBearer()
 
+_hash_executor = None
+_hash_pending = 0
+
+# Máximo de tokens verificados que se recuerdan
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+class TokenCache:
+    """LRU de claims ya verificados, indexado por el SHA-256 del token
+
+    Cada entrada vence en el exp del propio token. Los tokens revocados se
+    recuerdan (sólo el digest) hasta su exp para rechazarlos sin decodificar.
+    """
+
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = OrderedDict()  # digest -> (claims, exp)
+        self._revoked = {}  # digest -> exp
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.revocations = 0
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, digest):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, exp = entry
+            if exp <= now:
+                del self._entries[digest]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return claims
+
+    def put(self, digest, claims):
+        exp = claims.get("exp")
+        if exp is None:
+            return
+        with self._lock:
+            self._entries[digest] = (claims, float(exp))
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def revoke(self, digest, exp):
+        now = time.time()
+        with self._lock:
+            self._entries.pop(digest, None)
+            self._revoked[digest] = float(exp)
+            self.revocations += 1
+            # Olvidar revocaciones de tokens que ya vencieron de todos modos
+            for vencido in [d for d, e in self._revoked.items() if e <= now]:
+                del self._revoked[vencido]
+
+    def is_revoked(self, digest):
+        with self._lock:
+            return digest in self._revoked
+
+    def stats(self):
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "tamano": len(self._entries),
+                "max_size": self._max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / consultas, 4) if consultas else 0.0,
+                "expirados": self.expired,
+                "desalojados": self.evictions,
+                "revocados": len(self._revoked),
+                "revocaciones": self.revocations,
+            }
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
+
 def verify_password(plain_password, hashed_password):
     """Verificar contraseña"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -21,6 +127,64 @@ def get_password_hash(password):
     """Generar hash de contraseña"""
     return pwd_context.hash(password)
 
+def _verify_and_update(plain_password, hashed_password):
+    """Verificar y, si el hash usa otro costo, devolver uno nuevo (corre en otro proceso)"""
+    if not hashed_password:
+        return False, None
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except ValueError:
+        # Hash con formato desconocido
+        return False, None
+
+def _get_hash_executor():
+    global _hash_executor
+    if _hash_executor is None:
+        # spawn: el proceso ya tiene hilos (pools de la base, reconstrucciones) y un
+        # fork podría copiar un lock tomado por otro hilo y colgar al hijo
+        _hash_executor = ProcessPoolExecutor(
+            max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _hash_executor
+
+def iniciar_hash_pool():
+    """Crear el pool de bcrypt al arrancar, no en el primer login"""
+    _get_hash_executor()
+
+def get_hash_queue_depth():
+    """Operaciones de bcrypt en curso o en espera"""
+    return _hash_pending
+
+async def _run_hash(func, *args):
+    """Ejecutar bcrypt en el pool de procesos sin bloquear el event loop"""
+    global _hash_pending
+    if _hash_pending >= HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor ocupado, intente nuevamente",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_hash_executor(), func, *args)
+    finally:
+        _hash_pending -= 1
+
+async def verify_password_async(plain_password, hashed_password):
+    """Verificar contraseña en el pool de procesos; devuelve (válida, hash_nuevo o None)"""
+    return await _run_hash(_verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """Generar hash de contraseña en el pool de procesos"""
+    return await _run_hash(get_password_hash, password)
+
+def shutdown_hash_pool():
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False, cancel_futures=True)
+        _hash_executor = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Crear token JWT"""
     to_encode = data.copy()
@@ -33,10 +197,25 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def _decode_token(token):
+    """Decodificar y verificar la firma de un token, usando el cache si ya se verificó"""
+    digest = token_cache.digest(token)
+    if token_cache.is_revoked(digest):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token revocado",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    payload = token_cache.get(digest)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.put(digest, payload)
+    return payload
+
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verificar token JWT"""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(credentials.credentials)
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(
@@ -51,13 +230,24 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
             detail="Token expirado",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token inválido",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+def revoke_token(token):
+    """Revocar un token: se quita del cache y se rechaza hasta su vencimiento"""
+    try:
+        payload = jwt.decode(
+            token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False}
+        )
+    except jwt.InvalidTokenError:
+        return False
+    token_cache.revoke(token_cache.digest(token), payload.get("exp", time.time()))
+    return True
+
 def get_current_user(token: str = Depends(verify_token)):
     """Obtener usuario actual desde el token"""
     return token
\ No newline at end of file
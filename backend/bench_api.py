@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""
+Benchmark en proceso de las rutas de la API.
+
+Genera una base temporal (por defecto 100k torres y 1M mantenimientos), monta
+la app FastAPI sobre httpx.ASGITransport y lanza peticiones concurrentes por
+escenario. Informa latencias p50/p95/p99, throughput y RSS máximo en JSON;
+con --comparar se contrasta contra una corrida anterior y se sale con código
+1 si algún p95 empeoró más que la tolerancia. Hay al menos un escenario por
+ruta; el feed SSE (/torres/stream) se mide hasta el primer evento recibido.
+
+Los datos salen de generador_datos.py con la semilla indicada, así que dos
+corridas con los mismos argumentos son comparables.
+
+    python bench_api.py [--torres 100000] [--mantenimientos 1000000]
+                        [--concurrencia 16] [--peticiones 200]
+                        [--salida resultados.json] [--comparar anterior.json]
+                        [--sin-metricas]
+
+Antes de los escenarios HTTP se mide el costo por fila de serializar los
+listados (ver medir_serializacion); --solo serializacion corre sólo eso.
+Con --sin-metricas se repiten los GET con y sin las métricas de /metrics y se
+informa la diferencia de p50 (ver medir_sobrecarga_metricas).
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+# Centro aproximado del Chaco, para ubicar las consultas espaciales
+LAT_CENTRO, LON_CENTRO = -26.8, -60.4
+# Fuera del rango de DNIs del generador, para que no se repita
+DNI_USUARIO = 99000001
+CLAVE_USUARIO = "bench-clave"
+ESTADOS = ['operativa', 'mantenimiento', 'limitada', 'inactiva']
+
+
+def poblar(db_path, n):
+    """Generar el dataset sintético y agregar el usuario con el que se hace login"""
+    import sqlite3
+    from auth import get_password_hash
+    from generador_datos import generar
+
+    generar(db_path, torres=n['torres'], mantenimientos=n['mantenimientos'],
+            tecnicos=n['tecnicos'], semilla=n['semilla'], salida=sys.stderr)
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO USUARIOTORRISTA (userCreaRepo, fechaAlta, nombre, apellido, norDni, cifrado, activo) "
+        "VALUES (1, datetime('now'), 'Bench', 'Usuario', ?, ?, 1)",
+        (DNI_USUARIO, get_password_hash(CLAVE_USUARIO))
+    )
+    conn.commit()
+    conn.close()
+
+
+# =================== ESCENARIOS ===================
+# Cada escenario arma la petición i-ésima a partir del contexto compartido.
+# El factor multiplica --peticiones (las rutas pesadas corren menos veces).
+
+def _torre_al_azar(ctx):
+    return ctx['rnd'].randrange(1, ctx['torres'] + 1)
+
+def _punto_al_azar(ctx):
+    rnd = ctx['rnd']
+    return LAT_CENTRO + rnd.uniform(-1.4, 1.4), LON_CENTRO + rnd.uniform(-1.4, 1.4)
+
+def _cuerpo_torre(ctx, i):
+    lat, lon = _punto_al_azar(ctx)
+    return {"nombre": f"Bench {i}", "tipo": "torre", "direccion": "S/N", "latitud": lat,
+            "longitud": lon, "estado": "operativa", "alcance_km": 15, "tipo_convenio": "Ecom"}
+
+def _cercanas(ctx, i):
+    lat, lon = _punto_al_azar(ctx)
+    return {"method": "GET", "url": f"/api/torres/cercanas?lat={lat}&lon={lon}&radio_km=10"}
+
+def _bbox(ctx, i):
+    lat, lon = _punto_al_azar(ctx)
+    return {"method": "GET", "url": f"/api/torres/bbox?lat_min={lat - 0.1}&lat_max={lat + 0.1}"
+                                    f"&lon_min={lon - 0.1}&lon_max={lon + 0.1}"}
+
+def _knn(ctx, i):
+    lat, lon = _punto_al_azar(ctx)
+    return {"method": "GET", "url": f"/api/torres/knn?lat={lat}&lon={lon}&k=5&estado=operativa"}
+
+def _clusters(ctx, i):
+    # Vista de ~1000x700 px en un zoom de provincia a ciudad
+    zoom = ctx['rnd'].randint(6, 13)
+    lat, lon = _punto_al_azar(ctx)
+    dlon = 1000 / 256 * 360 / 2 ** zoom / 2
+    dlat = dlon * 0.6
+    return {"method": "GET", "url": f"/api/torres/clusters?bbox={lon - dlon},{lat - dlat},"
+                                    f"{lon + dlon},{lat + dlat}&zoom={zoom}"}
+
+def _ruta(ctx, i):
+    # Salida desde Resistencia con hasta 500 paradas
+    return {"method": "POST", "url": "/api/rutas/planificar", "json": {
+        "base": "resistencia", "estados": ["mantenimiento", "limitada"], "radio_km": 200,
+        "max_paradas": 500, "tiempo_limite_ms": 1000}}
+
+def _export(ctx, i):
+    dia = date(2024, 1, 1) + timedelta(days=ctx['rnd'].randrange(360))
+    return {"method": "GET", "url": f"/api/mantenimientos/export?format=csv&desde={dia}&hasta={dia}"}
+
+def _mantenimiento(ctx, i):
+    return {"method": "POST", "url": "/api/mantenimientos", "json": {
+        "TorreID": _torre_al_azar(ctx), "UsuarioTorristaID": 1,
+        "fecha_inicio_mantenimiento": datetime(2025, 1, 1, 10).isoformat(),
+        "tipo_mantenimiento": "correctivo", "descripcion_trabajo": "Bench", "costo": 1000,
+    }}
+
+def _tecnico(ctx, i):
+    ctx['dni'] += 1
+    return {"method": "POST", "url": "/api/tecnicos", "json": {
+        "nombre": "Bench", "apellido": str(i), "dni": ctx['dni'],
+        "TorreID": _torre_al_azar(ctx), "tipoPersona": "CIVIL",
+    }}
+
+def _subir_blob(ctx, i):
+    return {"method": "POST", "url": "/api/blobs", "content": os.urandom(64 * 1024),
+            "headers": {"Content-Type": "image/jpeg"}}
+
+def _eliminar_torre(ctx, i):
+    # Desde el final hacia atrás para no repetir ids
+    return {"method": "DELETE", "url": f"/api/torres/{ctx['torres'] - i}"}
+
+def _importar(ctx, i, filas=1000):
+    campos = list(_cuerpo_torre(ctx, 0))
+    lineas = [",".join(campos)]
+    for j in range(filas):
+        torre = _cuerpo_torre(ctx, f"{i}-{j}")
+        lineas.append(",".join(str(torre[campo]) for campo in campos))
+    return {"method": "POST", "url": "/api/torres/bulk", "content": "\n".join(lineas).encode(),
+            "headers": {"Content-Type": "text/csv"}}
+
+def _mantenimiento_con_imagen(ctx, i):
+    peticion = _mantenimiento(ctx, i)
+    peticion['json']['imagen1_base64'] = base64.b64encode(os.urandom(48 * 1024)).decode()
+    return peticion
+
+def _subir_imagen(ctx, i):
+    return {"method": "PUT", "url": f"/api/mantenimientos/{ctx['mantenimiento']}/imagenes/{i % 4 + 1}",
+            "content": os.urandom(64 * 1024), "headers": {"Content-Type": "image/jpeg"}}
+
+def _registro(ctx, i):
+    ctx['dni_usuario'] += 1
+    return {"method": "POST", "url": "/api/auth/register", "json": {
+        "nombre": "Bench", "apellido": str(i), "norDni": ctx['dni_usuario'], "password": CLAVE_USUARIO}}
+
+def _logout(ctx, i):
+    import auth
+
+    # Un token por petición: revocar el compartido dejaría sin acceso a los demás escenarios
+    token = auth.create_access_token({"sub": str(DNI_USUARIO), "user_id": 1, "jti": f"logout-{i}"},
+                                     timedelta(hours=1))
+    return {"method": "POST", "url": "/api/auth/logout", "headers": {"Authorization": f"Bearer {token}"}}
+
+def _stream(ctx, i):
+    # Reanudar desde el anteúltimo evento: el último se reenvía del historial enseguida
+    return {"method": "GET", "url": f"/api/torres/stream?since={max(ctx['hub'].secuencia - 1, 0)}", "sse": True}
+
+ESCENARIOS = [
+    ("GET /torres?limit=100", 1, lambda ctx, i: {"method": "GET", "url": "/api/torres?limit=100"}),
+    ("GET /torres (completo)", 0.02, lambda ctx, i: {"method": "GET", "url": "/api/torres"}),
+    ("GET /torres?fields=id,latitud,longitud,estado", 0.05, lambda ctx, i: {
+        "method": "GET", "url": "/api/torres?fields=id,latitud,longitud,estado"}),
+    ("GET /torres (If-None-Match)", 1, lambda ctx, i: {
+        "method": "GET", "url": "/api/torres", "headers": {"If-None-Match": ctx['etag_torres']}}),
+    ("GET /torres/{id}", 1, lambda ctx, i: {"method": "GET", "url": f"/api/torres/{_torre_al_azar(ctx)}"}),
+    ("GET /torres/cercanas", 1, _cercanas),
+    ("GET /torres/bbox", 1, _bbox),
+    ("GET /torres/clusters", 1, _clusters),
+    ("GET /torres/knn", 1, _knn),
+    ("GET /mantenimientos?limit=50", 1, lambda ctx, i: {"method": "GET", "url": "/api/mantenimientos?limit=50"}),
+    ("GET /mantenimientos?limit=50&after=", 1, lambda ctx, i: {
+        "method": "GET", "url": f"/api/mantenimientos?limit=50&after={ctx['cursor_mantenimientos']}"}),
+    ("GET /mantenimientos?torre_id=", 1, lambda ctx, i: {
+        "method": "GET", "url": f"/api/mantenimientos?limit=50&torre_id={_torre_al_azar(ctx)}"}),
+    ("GET /mantenimientos/export (1 día)", 0.1, _export),
+    ("GET /mantenimientos/{id}/imagenes", 1, lambda ctx, i: {
+        "method": "GET", "url": f"/api/mantenimientos/{ctx['mantenimiento']}/imagenes"}),
+    ("GET /torres/stream (primer evento)", 0.5, _stream),
+    ("GET /tecnicos?limit=50", 1, lambda ctx, i: {"method": "GET", "url": "/api/tecnicos?limit=50"}),
+    ("GET /cobertura/analisis", 0.1, lambda ctx, i: {"method": "GET", "url": "/api/cobertura/analisis?celda_km=1"}),
+    ("GET /cobertura/analisis (brechas)", 0.05, lambda ctx, i: {
+        "method": "GET", "url": "/api/cobertura/analisis?celda_km=1&formato=brechas"}),
+    ("POST /rutas/planificar (500 paradas)", 0.02, _ruta),
+    ("GET /estadisticas", 1, lambda ctx, i: {"method": "GET", "url": "/api/estadisticas"}),
+    ("GET /", 1, lambda ctx, i: {"method": "GET", "url": "/api/"}),
+    ("GET /health", 1, lambda ctx, i: {"method": "GET", "url": "/api/health"}),
+    ("GET /metrics", 1, lambda ctx, i: {"method": "GET", "url": "/metrics"}),
+    ("GET /admin/consultas", 1, lambda ctx, i: {
+        "method": "GET", "url": "/api/admin/consultas", "headers": ctx['auth']}),
+    ("GET /admin/consultas-lentas", 1, lambda ctx, i: {
+        "method": "GET", "url": "/api/admin/consultas-lentas?limit=50", "headers": ctx['auth']}),
+    ("GET /admin/cache-tokens", 1, lambda ctx, i: {
+        "method": "GET", "url": "/api/admin/cache-tokens", "headers": ctx['auth']}),
+    ("POST /auth/login", 0.05, lambda ctx, i: {"method": "POST", "url": "/api/auth/login", "json": {
+        "username": str(DNI_USUARIO), "password": CLAVE_USUARIO}}),
+    ("POST /auth/register", 0.05, _registro),
+    ("POST /auth/logout", 1, _logout),
+    ("POST /torres", 1, lambda ctx, i: {"method": "POST", "url": "/api/torres", "json": _cuerpo_torre(ctx, i)}),
+    ("PUT /torres/{id}", 1, lambda ctx, i: {"method": "PUT", "url": f"/api/torres/{_torre_al_azar(ctx)}",
+                                            "json": {"estado": ctx['rnd'].choice(ESTADOS)}}),
+    ("POST /mantenimientos", 1, _mantenimiento),
+    ("POST /mantenimientos (imagen 48 KiB)", 0.5, _mantenimiento_con_imagen),
+    ("PUT /mantenimientos/{id}/imagenes/{posicion} (64 KiB)", 0.5, _subir_imagen),
+    ("POST /tecnicos", 1, _tecnico),
+    ("POST /blobs (64 KiB)", 0.5, _subir_blob),
+    ("GET /blobs/{sha256}", 1, lambda ctx, i: {"method": "GET", "url": f"/api/blobs/{ctx['blob']}"}),
+    ("POST /admin/estadisticas/reconstruir", 0.02, lambda ctx, i: {
+        "method": "POST", "url": "/api/admin/estadisticas/reconstruir", "headers": ctx['auth']}),
+    ("DELETE /torres/{id}", 0.25, _eliminar_torre),
+    # Al final: la importación invalida los índices en memoria de las torres
+    ("POST /torres/bulk (CSV, 1000 filas)", 0.05, _importar),
+]
+
+
+def _percentil(ordenadas, p):
+    """Percentil por rango más cercano"""
+    if not ordenadas:
+        return None
+    return ordenadas[min(len(ordenadas) - 1, max(0, math.ceil(p / 100 * len(ordenadas)) - 1))]
+
+def _rss_max_mb():
+    # ru_maxrss está en KiB en Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def _rss_actual_mb():
+    with open('/proc/self/statm') as archivo:
+        paginas = int(archivo.read().split()[1])
+    return round(paginas * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024, 1)
+
+async def primer_evento_sse(app, url, espera=10.0):
+    """Abrir un stream SSE, esperar el primer evento y desconectarse; devuelve el código HTTP
+
+    httpx.ASGITransport junta la respuesta completa antes de devolverla y el
+    feed no termina nunca, así que se habla ASGI directamente con la app.
+    """
+    ruta, _, consulta = url.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": ruta, "raw_path": ruta.encode(), "query_string": consulta.encode(),
+        "headers": [(b"host", b"bench")], "server": ("bench", 80), "client": ("127.0.0.1", 0),
+        "root_path": "",
+    }
+    pedido_enviado = False
+    desconectado = asyncio.Event()
+    evento = asyncio.Event()
+    estado = None
+
+    async def receive():
+        nonlocal pedido_enviado
+        if not pedido_enviado:
+            pedido_enviado = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await desconectado.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(mensaje):
+        nonlocal estado
+        if mensaje["type"] == "http.response.start":
+            estado = mensaje["status"]
+        elif mensaje["type"] == "http.response.body":
+            if b"data:" in mensaje.get("body", b"") or not mensaje.get("more_body", False):
+                evento.set()
+
+    tarea = asyncio.ensure_future(app(scope, receive, send))
+    try:
+        await asyncio.wait_for(evento.wait(), espera)
+    except asyncio.TimeoutError:
+        estado = 504
+    finally:
+        desconectado.set()
+        tarea.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await tarea
+    return estado
+
+async def correr_escenario(cliente, ctx, armar, peticiones, concurrencia):
+    latencias = []
+    codigos = Counter()
+    indices = iter(range(peticiones))
+
+    async def trabajador():
+        # Todos los trabajadores consumen del mismo iterador
+        for i in indices:
+            peticion = armar(ctx, i)
+            inicio = time.perf_counter()
+            if peticion.pop("sse", False):
+                codigo = await primer_evento_sse(ctx['app'], peticion['url'])
+            else:
+                codigo = (await cliente.request(**peticion)).status_code
+            latencias.append(time.perf_counter() - inicio)
+            codigos[codigo] += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(min(concurrencia, peticiones))))
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "peticiones": peticiones,
+        "concurrencia": min(concurrencia, peticiones),
+        "p50_ms": round(_percentil(latencias, 50) * 1000, 3),
+        "p95_ms": round(_percentil(latencias, 95) * 1000, 3),
+        "p99_ms": round(_percentil(latencias, 99) * 1000, 3),
+        "media_ms": round(sum(latencias) / len(latencias) * 1000, 3),
+        "max_ms": round(latencias[-1] * 1000, 3),
+        "throughput_rps": round(peticiones / duracion, 1),
+        "codigos": {str(codigo): cantidad for codigo, cantidad in sorted(codigos.items())},
+        "errores": sum(cantidad for codigo, cantidad in codigos.items() if codigo >= 400),
+        "rss_max_mb": _rss_max_mb(),
+        "rss_actual_mb": _rss_actual_mb(),
+    }
+
+# Listados para medir la serialización: (nombre, tabla/join, campos, orden, descendente, limit)
+LISTADOS_SERIALIZACION = [
+    ("torres", "Torres", "TORRE_CAMPOS", ['id'], False, None),
+    ("mantenimientos", "Mantenimientos m JOIN Torres t ON m.TorreID = t.id",
+     "MANTENIMIENTO_CAMPOS", ['fecha_inicio_mantenimiento', 'id'], True, 1000),
+]
+
+def medir_serializacion(repeticiones=5):
+    """Costo por fila de leer y codificar un listado: camino de dicts + Pydantic vs tuplas
+
+    'antes' reproduce lo que hacía FastAPI con response_model=List[dict]: un
+    sqlite3.Row y un dict por fila, validación y serialización de Pydantic y
+    json.dumps de JSONResponse. 'despues' es execute_query_tuplas + respuestas.
+    Se informa el mejor de las repeticiones en microsegundos por fila.
+    """
+    from typing import List
+
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+
+    import respuestas
+    import server
+    from database import execute_query, execute_query_tuplas
+    from paginacion import construir_consulta, preparar_pagina, preparar_pagina_tuplas
+
+    adaptador = TypeAdapter(List[dict])
+
+    def antes(query, params, orden, extra, limit):
+        filas = execute_query(query, params, fetch_all=True)
+        filas, _ = preparar_pagina(filas, orden, extra, limit)
+        validadas = adaptador.validate_python(filas)
+        return len(filas), JSONResponse(adaptador.dump_python(validadas, mode="json")).body
+
+    def despues(query, params, orden, extra, limit):
+        columnas, filas = execute_query_tuplas(query, params)
+        columnas, _ = preparar_pagina_tuplas(columnas, filas, orden, extra, limit)
+        return len(filas), respuestas.codificar_filas(columnas, filas)
+
+    resultados = {}
+    for nombre, desde, campos, orden, descendente, limit in LISTADOS_SERIALIZACION:
+        disponibles = getattr(server, campos)
+        por_defecto = [campo for campo in disponibles if campo not in server.IMAGEN_CAMPOS]
+        query, params, extra = construir_consulta(
+            disponibles, por_defecto, desde, orden, descendente=descendente, limit=limit
+        )
+        medicion = {}
+        for camino, funcion in (("antes", antes), ("despues", despues)):
+            mejor = None
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                filas, cuerpo = funcion(query, params, orden, extra, limit)
+                duracion = time.perf_counter() - inicio
+                mejor = duracion if mejor is None else min(mejor, duracion)
+            medicion["filas"] = filas
+            medicion[f"{camino}_us_fila"] = round(mejor / max(filas, 1) * 1e6, 3)
+            medicion[f"{camino}_bytes"] = len(cuerpo)
+        medicion["mejora"] = round(medicion["antes_us_fila"] / medicion["despues_us_fila"], 2)
+        resultados[nombre] = medicion
+        print(f"serialización {nombre:35s} {medicion['filas']:7d} filas  "
+              f"antes {medicion['antes_us_fila']:7.2f} us/fila  despues {medicion['despues_us_fila']:7.2f} us/fila  "
+              f"(x{medicion['mejora']:.2f})", file=sys.stderr)
+    return resultados
+
+async def medir_sobrecarga_metricas(cliente, ctx, args, rondas=3):
+    """p50 de los escenarios de lectura con y sin métricas (MetricasMiddleware y observadores de consultas)
+
+    Corre de a una petición por vez para medir el costo por petición sin la
+    cola de la concurrencia. Las dos variantes se alternan en cada ronda y se
+    toma la mejor mediana de cada una, así el calentamiento y el ruido no se
+    cargan a un solo lado. Sólo escenarios GET: repetirlos no cambia los datos.
+    """
+    import metricas
+    from database import sin_observadores_consultas
+
+    resultados = {}
+    for nombre, factor, armar in ESCENARIOS:
+        if args.solo and not any(filtro in nombre for filtro in args.solo):
+            continue
+        if factor < 1 or armar(ctx, 0)["method"] != "GET":
+            continue
+        mejores = {}
+        for _ in range(rondas):
+            for variante in ("con", "sin"):
+                metricas.MetricasMiddleware.activo = variante == "con"
+                try:
+                    with sin_observadores_consultas() if variante == "sin" else contextlib.nullcontext():
+                        resultado = await correr_escenario(cliente, ctx, armar, args.peticiones, 1)
+                finally:
+                    metricas.MetricasMiddleware.activo = True
+                mejores[variante] = min(mejores.get(variante, math.inf), resultado['p50_ms'])
+        delta = mejores["con"] - mejores["sin"]
+        resultados[nombre] = {
+            "con_p50_ms": mejores["con"],
+            "sin_p50_ms": mejores["sin"],
+            "delta_ms": round(delta, 3),
+            "delta_pct": round(delta / mejores["sin"] * 100, 1),
+        }
+        print(f"métricas {nombre:48s} con {mejores['con']:8.3f} ms  sin {mejores['sin']:8.3f} ms  "
+              f"({delta * 1000:+7.0f} us, {resultados[nombre]['delta_pct']:+5.1f}%)", file=sys.stderr)
+    return resultados
+
+async def _preparar_contexto(cliente, args):
+    import auth
+    import cambios
+    import server
+
+    token = auth.create_access_token({"sub": str(DNI_USUARIO), "user_id": 1}, timedelta(hours=1))
+    ctx = {
+        "app": server.app,
+        "hub": cambios.get_hub(),
+        "rnd": random.Random(args.semilla),
+        "torres": args.torres,
+        "dni": 40000000,
+        "dni_usuario": DNI_USUARIO,
+        "auth": {"Authorization": f"Bearer {token}"},
+    }
+    ctx['etag_torres'] = (await cliente.get("/api/torres?limit=1")).headers['etag']
+    pagina = await cliente.get("/api/mantenimientos?limit=50")
+    ctx['cursor_mantenimientos'] = pagina.headers['x-next-cursor']
+    blob = await cliente.post("/api/blobs", content=os.urandom(64 * 1024))
+    ctx['blob'] = blob.json()['sha256']
+    # Un mantenimiento con imagen, el más reciente del listado, para las rutas de imágenes
+    peticion = _mantenimiento_con_imagen(ctx, 0)
+    peticion['json']['fecha_inicio_mantenimiento'] = datetime(2099, 1, 1).isoformat()
+    await cliente.request(**peticion)
+    pagina = await cliente.get("/api/mantenimientos?limit=1&fields=id")
+    ctx['mantenimiento'] = pagina.json()[0]['id']
+    # Dos cambios de torre para que el feed tenga qué reenviar al reanudar
+    for _ in range(2):
+        await cliente.put(f"/api/torres/{_torre_al_azar(ctx)}", json={"estado": ctx['rnd'].choice(ESTADOS)})
+    return ctx
+
+async def ejecutar(args):
+    import httpx
+    import server
+
+    await server.startup()
+    transporte = httpx.ASGITransport(app=server.app)
+    resultados = {}
+    sobrecarga = {}
+    try:
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+            ctx = await _preparar_contexto(cliente, args)
+            for nombre, factor, armar in ESCENARIOS:
+                if args.solo and not any(filtro in nombre for filtro in args.solo):
+                    continue
+                peticiones = max(1, int(args.peticiones * factor))
+                resultado = await correr_escenario(cliente, ctx, armar, peticiones, args.concurrencia)
+                resultados[nombre] = resultado
+                print(f"{nombre:48s} p50 {resultado['p50_ms']:9.2f} ms  p95 {resultado['p95_ms']:9.2f} ms  "
+                      f"p99 {resultado['p99_ms']:9.2f} ms  {resultado['throughput_rps']:8.1f} req/s"
+                      + (f"  errores {resultado['errores']}" if resultado['errores'] else ""),
+                      file=sys.stderr)
+            if args.sin_metricas:
+                sobrecarga = await medir_sobrecarga_metricas(cliente, ctx, args)
+    finally:
+        await server.shutdown()
+    return resultados, sobrecarga
+
+def comparar(actual, anterior, tolerancia):
+    """Lista de escenarios cuyo p95 empeoró más que la tolerancia"""
+    regresiones = []
+    for nombre, resultado in actual['escenarios'].items():
+        previo = anterior.get('escenarios', {}).get(nombre)
+        if not previo or not previo.get('p95_ms'):
+            continue
+        relacion = resultado['p95_ms'] / previo['p95_ms']
+        marca = "  <-- REGRESIÓN" if relacion > 1 + tolerancia else ""
+        print(f"{nombre:48s} p95 {previo['p95_ms']:9.2f} -> {resultado['p95_ms']:9.2f} ms "
+              f"(x{relacion:.2f}){marca}", file=sys.stderr)
+        if marca:
+            regresiones.append(nombre)
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--torres", type=int, default=100000)
+    parser.add_argument("--mantenimientos", type=int, default=1000000)
+    parser.add_argument("--tecnicos", type=int, default=20000)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--peticiones", type=int, default=200, help="Peticiones por escenario (antes del factor)")
+    parser.add_argument("--solo", action="append", help="Correr sólo escenarios que contengan este texto")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto stdout)")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    parser.add_argument("--sin-metricas", action="store_true",
+                        help="Medir además los GET con y sin métricas y reportar la diferencia")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Empeoramiento de p95 tolerado (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directorio:
+        # Antes de importar database/server: la app usa la base y el almacén temporales
+        os.environ['SQLITE_DB_PATH'] = str(Path(directorio) / "bench.db")
+        os.environ['BLOB_DIR'] = str(Path(directorio) / "blobs")
+        sys.path.insert(0, str(Path(__file__).parent))
+
+        inicio = time.perf_counter()
+        # Los avisos de migraciones van a stderr: stdout queda para el JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            poblar(os.environ['SQLITE_DB_PATH'], vars(args))
+        generacion_s = time.perf_counter() - inicio
+        print(f"Datos generados en {generacion_s:.1f} s", file=sys.stderr)
+
+        with contextlib.redirect_stdout(sys.stderr):
+            serializacion = medir_serializacion() if not args.solo or "serializacion" in args.solo else {}
+            escenarios, sobrecarga = asyncio.run(ejecutar(args))
+
+    actual = {
+        "fecha": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "datos": {"torres": args.torres, "mantenimientos": args.mantenimientos, "tecnicos": args.tecnicos,
+                  "semilla": args.semilla, "generacion_s": round(generacion_s, 1)},
+        "concurrencia": args.concurrencia,
+        "rss_max_mb": _rss_max_mb(),
+        "serializacion": serializacion,
+        "escenarios": escenarios,
+    }
+    if sobrecarga:
+        actual["sobrecarga_metricas"] = sobrecarga
+    texto = json.dumps(actual, indent=2, ensure_ascii=False)
+    if args.salida:
+        Path(args.salida).write_text(texto + "\n", encoding="utf-8")
+    else:
+        print(texto)
+
+    if args.comparar:
+        anterior = json.loads(Path(args.comparar).read_text(encoding="utf-8"))
+        if comparar(actual, anterior, args.tolerancia):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark de los índices agregados por las migraciones 1 a 5.
+
+Crea una base temporal, la llena con datos sintéticos y muestra, para cada
+consulta caliente, el plan (EXPLAIN QUERY PLAN) y el tiempo medio antes y
+después de aplicar las migraciones.
+
+    python bench_indices.py [--torres 20000] [--mantenimientos 200000]
+"""
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from database import init_sqlite_db, apply_migrations
+
+CONSULTAS = [
+    ("login", """
+        SELECT id, nombre, apellido, norDni, cifrado FROM USUARIOTORRISTA
+        WHERE norDni = ? AND activo = 1
+    """, lambda n: (30000000 + random.randrange(n['usuarios']),)),
+    ("mantenimientos por torre", """
+        SELECT m.id, m.fecha_inicio_mantenimiento, t.nombre AS torre_nombre
+        FROM Mantenimientos m JOIN Torres t ON m.TorreID = t.id
+        WHERE m.TorreID = ?
+        ORDER BY m.fecha_inicio_mantenimiento DESC, m.id DESC LIMIT 50
+    """, lambda n: (random.randrange(1, n['torres']),)),
+    ("mantenimientos por fecha", """
+        SELECT m.id, m.fecha_inicio_mantenimiento, t.nombre AS torre_nombre
+        FROM Mantenimientos m JOIN Torres t ON m.TorreID = t.id
+        WHERE m.fecha_inicio_mantenimiento >= ?
+        ORDER BY m.fecha_inicio_mantenimiento DESC, m.id DESC LIMIT 50
+    """, lambda n: (f"2024-{random.randint(1, 12):02d}-01",)),
+    ("técnicos por torre", """
+        SELECT t.id, t.nombre, t.apellido FROM TECNICOINTERVINIENTE t
+        WHERE t.TorreID = ? AND t.activo = 1
+        ORDER BY t.fechaAlta DESC
+    """, lambda n: (random.randrange(1, n['torres']),)),
+    ("torres por convenio", """
+        SELECT COUNT(*) FROM Torres WHERE tipo_convenio = ?
+    """, lambda n: (random.choice(['Policia', 'Ecom', 'De tercero']),)),
+]
+
+def poblar(conn, n):
+    convenios = ['Policia', 'Ecom', 'De tercero']
+    conn.executemany(
+        "INSERT INTO Torres (nombre, tipo, direccion, latitud, longitud, estado, "
+        "alcance_km, tipo_convenio) VALUES (?, 'torre', 'S/N', ?, ?, 'operativa', ?, ?)",
+        ((f"Torre {i}", -27 - random.random() * 2, -59 - random.random() * 3,
+          random.uniform(5, 40), random.choice(convenios)) for i in range(n['torres']))
+    )
+    conn.executemany(
+        "INSERT INTO USUARIOTORRISTA (userCreaRepo, fechaAlta, nombre, apellido, norDni, activo) "
+        "VALUES (1, datetime('now'), 'Usuario', ?, ?, ?)",
+        ((str(i), 30000000 + i, int(random.random() > 0.1)) for i in range(n['usuarios']))
+    )
+    conn.executemany(
+        "INSERT INTO TECNICOINTERVINIENTE (nombre, apellido, dni, TorreID, tipoPersona, "
+        "fechaAlta, usuarioAlta, activo) VALUES ('Técnico', ?, ?, ?, 'CIVIL', ?, 1, ?)",
+        ((str(i), 20000000 + i, random.randrange(1, n['torres']),
+          f"2023-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+          int(random.random() > 0.2)) for i in range(n['tecnicos']))
+    )
+    conn.executemany(
+        "INSERT INTO Mantenimientos (TorreID, UsuarioTorristaID, fecha_inicio_mantenimiento, "
+        "descripcion_trabajo) VALUES (?, 1, ?, 'Revisión general')",
+        ((random.randrange(1, n['torres']),
+          f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d} 10:00:00")
+         for _ in range(n['mantenimientos']))
+    )
+    conn.commit()
+
+def medir(conn, n, repeticiones):
+    resultados = {}
+    for nombre, sql, parametros in CONSULTAS:
+        plan = [fila[3] for fila in conn.execute("EXPLAIN QUERY PLAN " + sql, parametros(n))]
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            conn.execute(sql, parametros(n)).fetchall()
+        media_ms = (time.perf_counter() - inicio) / repeticiones * 1000
+        resultados[nombre] = (plan, media_ms)
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--torres", type=int, default=20000)
+    parser.add_argument("--mantenimientos", type=int, default=200000)
+    parser.add_argument("--tecnicos", type=int, default=20000)
+    parser.add_argument("--usuarios", type=int, default=20000)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args()
+    n = vars(args)
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_path = Path(directorio) / "bench.db"
+        init_sqlite_db(db_path)
+        conn = sqlite3.connect(db_path)
+        poblar(conn, n)
+        conn.execute("ANALYZE")
+
+        antes = medir(conn, n, args.repeticiones)
+        apply_migrations(conn, hasta=5)
+        conn.execute("ANALYZE")
+        despues = medir(conn, n, args.repeticiones)
+        conn.close()
+
+    for nombre, _, _ in CONSULTAS:
+        plan_antes, ms_antes = antes[nombre]
+        plan_despues, ms_despues = despues[nombre]
+        print(f"\n== {nombre}: {ms_antes:.3f} ms -> {ms_despues:.3f} ms "
+              f"(x{ms_antes / max(ms_despues, 1e-9):.1f})")
+        print("   antes:   " + " | ".join(plan_antes))
+        print("   después: " + " | ".join(plan_despues))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+from database import get_db, get_db_read
+
+BLOB_DIR = Path(os.getenv('BLOB_DIR', Path(__file__).parent / "blobs"))
+CHUNK_SIZE = 64 * 1024
+# Antigüedad mínima para purgar un blob sin vincular: las subidas por POST /api/blobs
+# se vinculan en una petición posterior
+BLOB_GRACIA_HORAS = float(os.getenv('BLOB_GRACIA_HORAS', '24'))
+# Blobs eliminados por transacción al purgar
+BLOB_PURGA_LOTE = 500
+# Tamaño máximo de un archivo subido o de una imagen base64 ya decodificada
+BLOB_MAX_BYTES = int(os.getenv('BLOB_MAX_BYTES', str(20 * 1024 * 1024)))
+IMAGEN_COLUMNAS = ('imagen1_base64', 'imagen2_base64', 'imagen3_base64', 'imagen4_base64')
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+_FIRMAS_MIME = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+class BlobError(ValueError):
+    """Datos de imagen inválidos"""
+
+class BlobDemasiadoGrande(BlobError):
+    """Imagen por encima de BLOB_MAX_BYTES"""
+
+
+def es_sha256(valor):
+    return bool(_SHA256_RE.match(valor or ''))
+
+def ruta_blob(sha256):
+    """Ruta en disco de un blob: blobs/ab/abcdef..."""
+    return BLOB_DIR / sha256[:2] / sha256
+
+def detectar_mime(cabecera, por_defecto='application/octet-stream'):
+    for firma, mime in _FIRMAS_MIME:
+        if cabecera.startswith(firma):
+            return mime
+    if cabecera[:4] == b'RIFF' and cabecera[8:12] == b'WEBP':
+        return 'image/webp'
+    return por_defecto
+
+
+class EscritorBlob:
+    """Escribe un blob por partes calculando el SHA-256 al vuelo"""
+
+    def __init__(self):
+        BLOB_DIR.mkdir(parents=True, exist_ok=True)
+        fd, nombre = tempfile.mkstemp(dir=BLOB_DIR, prefix='.subida-')
+        self._archivo = os.fdopen(fd, 'wb')
+        self._temporal = Path(nombre)
+        self._hash = hashlib.sha256()
+        self._cabecera = b''
+        self.tamano = 0
+
+    def write(self, chunk):
+        if len(self._cabecera) < 16:
+            self._cabecera += chunk[:16 - len(self._cabecera)]
+        self._hash.update(chunk)
+        self._archivo.write(chunk)
+        self.tamano += len(chunk)
+
+    def abort(self):
+        self._archivo.close()
+        self._temporal.unlink(missing_ok=True)
+
+    def commit(self, conn, tipo_mime=None):
+        """Registrar el blob y mover el archivo a su ruta definitiva (deduplicando)
+
+        El INSERT va primero: toma el lock de escritura de la base, así que el
+        archivo se ubica serializado con purgar_blobs_huerfanos, que borra
+        filas y archivos dentro de esa misma exclusión.
+        """
+        self._archivo.close()
+        sha256 = self._hash.hexdigest()
+        if not tipo_mime or tipo_mime == 'application/octet-stream':
+            tipo_mime = detectar_mime(self._cabecera)
+        try:
+            # Subir de nuevo un contenido existente renueva su período de gracia
+            conn.execute(
+                "INSERT INTO Blobs (sha256, tamano, tipo_mime) VALUES (?, ?, ?) "
+                "ON CONFLICT(sha256) DO UPDATE SET fecha_creacion = CURRENT_TIMESTAMP",
+                (sha256, self.tamano, tipo_mime)
+            )
+            destino = ruta_blob(sha256)
+            if destino.exists():
+                # Mismo contenido ya almacenado: descartar la copia
+                self._temporal.unlink(missing_ok=True)
+            else:
+                destino.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(self._temporal, destino)
+        except BaseException:
+            self._temporal.unlink(missing_ok=True)
+            raise
+        return {"sha256": sha256, "tamano": self.tamano, "tipo_mime": tipo_mime}
+
+
+def guardar_bytes(conn, data, tipo_mime=None):
+    """Guardar un blob completo en memoria"""
+    escritor = EscritorBlob()
+    try:
+        for inicio in range(0, len(data), CHUNK_SIZE):
+            escritor.write(data[inicio:inicio + CHUNK_SIZE])
+    except Exception:
+        escritor.abort()
+        raise
+    return escritor.commit(conn, tipo_mime)
+
+def decodificar_base64(valor, max_bytes=BLOB_MAX_BYTES):
+    """Decodificar base64, aceptando también data URLs (data:image/png;base64,...)
+
+    Se rechazan caracteres fuera del alfabeto base64 (sólo se toleran espacios
+    y saltos de línea) en vez de descartarlos y guardar un archivo corrupto.
+    El tamaño se controla antes de decodificar; max_bytes=None no lo limita.
+    """
+    tipo_mime = None
+    if valor.startswith('data:'):
+        cabecera, _, valor = valor.partition(',')
+        tipo_mime = cabecera[5:].split(';')[0] or None
+    valor = ''.join(valor.split())
+    # Cada 4 caracteres son 3 bytes, menos hasta 2 de relleno
+    if max_bytes is not None and len(valor) * 3 // 4 - 2 > max_bytes:
+        raise BlobDemasiadoGrande(f"Imagen demasiado grande (máximo {max_bytes} bytes)")
+    try:
+        data = base64.b64decode(valor, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise BlobError(f"Imagen base64 inválida: {e}")
+    if max_bytes is not None and len(data) > max_bytes:
+        raise BlobDemasiadoGrande(f"Imagen demasiado grande (máximo {max_bytes} bytes)")
+    return data, tipo_mime
+
+def guardar_base64(conn, valor, max_bytes=BLOB_MAX_BYTES):
+    data, tipo_mime = decodificar_base64(valor, max_bytes)
+    return guardar_bytes(conn, data, tipo_mime)
+
+def vincular_imagen(conn, mantenimiento_id, posicion, sha256):
+    """Asociar un blob a una posición (1-4) de un mantenimiento"""
+    conn.execute(
+        "INSERT INTO MantenimientoImagenes (MantenimientoID, posicion, sha256) VALUES (?, ?, ?) "
+        "ON CONFLICT(MantenimientoID, posicion) DO UPDATE SET sha256 = excluded.sha256",
+        (mantenimiento_id, posicion, sha256)
+    )
+
+def obtener_blob(sha256):
+    """Metadatos de un blob o None"""
+    with get_db_read() as conn:
+        row = conn.execute(
+            "SELECT sha256, tamano, tipo_mime FROM Blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone()
+    return dict(row) if row else None
+
+def leer_rango(sha256, inicio, fin):
+    """Generador de chunks del blob entre inicio y fin (inclusive)"""
+    with open(ruta_blob(sha256), 'rb') as archivo:
+        archivo.seek(inicio)
+        restante = fin - inicio + 1
+        while restante > 0:
+            chunk = archivo.read(min(CHUNK_SIZE, restante))
+            if not chunk:
+                break
+            restante -= len(chunk)
+            yield chunk
+
+def parsear_range(cabecera, tamano):
+    """Interpretar 'bytes=inicio-fin' (un solo rango); None si no aplica"""
+    if not cabecera or not cabecera.startswith('bytes='):
+        return None
+    rango = cabecera[6:].strip()
+    if ',' in rango:
+        # Rangos múltiples: se responde el archivo completo
+        return None
+    desde, _, hasta = rango.partition('-')
+    try:
+        if desde == '':
+            # Sufijo: los últimos N bytes
+            largo = int(hasta)
+            if largo <= 0:
+                raise BlobError("Rango inválido")
+            return max(tamano - largo, 0), tamano - 1
+        inicio = int(desde)
+        fin = int(hasta) if hasta else tamano - 1
+    except ValueError:
+        raise BlobError("Rango inválido")
+    if inicio >= tamano or fin < inicio:
+        raise BlobError("Rango inválido")
+    return inicio, min(fin, tamano - 1)
+
+
+# =================== MIGRACIÓN DE COLUMNAS BASE64 ===================
+
+def migrar_imagenes_base64(lote=100, salida=sys.stdout):
+    """Mover las imágenes base64 de Mantenimientos al almacén de blobs
+
+    Procesa de a `lote` filas por transacción; cada imagen queda vinculada en
+    MantenimientoImagenes y su columna se pone en NULL. Es reanudable.
+    """
+    condicion = ' OR '.join(f"{columna} IS NOT NULL" for columna in IMAGEN_COLUMNAS)
+    ultimo_id = 0
+    migradas = 0
+    while True:
+        with get_db() as conn:
+            filas = conn.execute(
+                f"SELECT id, {', '.join(IMAGEN_COLUMNAS)} FROM Mantenimientos "
+                f"WHERE id > ? AND ({condicion}) ORDER BY id LIMIT ?",
+                (ultimo_id, lote)
+            ).fetchall()
+            if not filas:
+                break
+            for fila in filas:
+                for posicion, columna in enumerate(IMAGEN_COLUMNAS, start=1):
+                    if fila[columna]:
+                        try:
+                            # Imágenes ya guardadas: se migran aunque superen el tope de subida
+                            blob = guardar_base64(conn, fila[columna], max_bytes=None)
+                        except BlobError as e:
+                            print(f"Mantenimiento {fila['id']}, imagen {posicion}: {e}", file=salida)
+                            continue
+                        vincular_imagen(conn, fila['id'], posicion, blob['sha256'])
+                        conn.execute(
+                            f"UPDATE Mantenimientos SET {columna} = NULL WHERE id = ?",
+                            (fila['id'],)
+                        )
+                        migradas += 1
+                ultimo_id = fila['id']
+        print(f"Migradas {migradas} imágenes (hasta mantenimiento {ultimo_id})", file=salida)
+    return migradas
+
+def purgar_blobs_huerfanos(gracia_horas=BLOB_GRACIA_HORAS, lote=BLOB_PURGA_LOTE):
+    """Eliminar blobs sin vincular a ningún mantenimiento y con más de gracia_horas
+
+    Cada fila se borra y su archivo se elimina dentro de la transacción de
+    escritura: una subida del mismo contenido (EscritorBlob.commit) espera
+    ese lock y vuelve a ubicar el archivo si hace falta. Sólo se eliminan
+    archivos cuya fila se borró.
+    """
+    limite = f"-{gracia_horas * 3600:.0f} seconds"
+    with get_db_read() as conn:
+        candidatos = [row[0] for row in conn.execute(
+            "SELECT sha256 FROM Blobs b WHERE b.fecha_creacion < datetime('now', ?) "
+            "AND NOT EXISTS (SELECT 1 FROM MantenimientoImagenes i WHERE i.sha256 = b.sha256)",
+            (limite,)
+        ).fetchall()]
+    eliminados = 0
+    for inicio in range(0, len(candidatos), lote):
+        with get_db() as conn:
+            for sha256 in candidatos[inicio:inicio + lote]:
+                # Se vuelve a verificar con el lock tomado: pudo vincularse o subirse de nuevo
+                cursor = conn.execute(
+                    "DELETE FROM Blobs WHERE sha256 = ? AND fecha_creacion < datetime('now', ?) "
+                    "AND NOT EXISTS (SELECT 1 FROM MantenimientoImagenes WHERE sha256 = ?)",
+                    (sha256, limite, sha256)
+                )
+                if cursor.rowcount == 1:
+                    ruta_blob(sha256).unlink(missing_ok=True)
+                    eliminados += 1
+    return eliminados
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Herramientas del almacén de imágenes")
+    parser.add_argument("--lote", type=int, default=100, help="Filas por transacción")
+    parser.add_argument("--purgar", action="store_true", help="Eliminar blobs huérfanos")
+    parser.add_argument("--gracia-horas", type=float, default=BLOB_GRACIA_HORAS,
+                        help="No purgar blobs subidos hace menos de estas horas")
+    parser.add_argument("--vacuum", action="store_true", help="Compactar la base al terminar")
+    args = parser.parse_args()
+
+    total = migrar_imagenes_base64(lote=args.lote)
+    print(f"Total de imágenes migradas: {total}")
+    if args.purgar:
+        print(f"Blobs huérfanos eliminados: {purgar_blobs_huerfanos(args.gracia_horas)}")
+    if args.vacuum:
+        import sqlite3
+        from database import DB_PATH
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("VACUUM")
+        conn.close()
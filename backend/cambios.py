@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+from collections import deque
+
+import eventos
+
+# Eventos recientes que se conservan para reanudar con since=
+CAMBIOS_HISTORIAL = int(os.getenv('CAMBIOS_HISTORIAL', '5000'))
+# Eventos pendientes por suscriptor antes de considerarlo lento
+CAMBIOS_COLA = int(os.getenv('CAMBIOS_COLA', '256'))
+# Segundos entre comentarios de keep-alive en el stream SSE
+CAMBIOS_HEARTBEAT = float(os.getenv('CAMBIOS_HEARTBEAT', '15'))
+
+# Campos de la torre que viajan en el feed (lo que necesita el mapa)
+CAMPOS_FEED = ('nombre', 'tipo', 'latitud', 'longitud', 'estado', 'alcance_km', 'tipo_convenio')
+
+
+class Suscripcion:
+    """Cola acotada de un cliente; si se llena se vacía y se le pide recargar"""
+
+    def __init__(self, max_pendientes):
+        self.cola = asyncio.Queue(maxsize=max_pendientes)
+        self.desbordes = 0
+
+    def entregar(self, evento):
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Cliente lento: no se lo deja acumular memoria; lo pendiente se
+            # reemplaza por una orden de recarga completa
+            self.desbordes += 1
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait({"seq": evento['seq'], "accion": eventos.RECARGA})
+
+
+class CambiosHub:
+    """Difusión en proceso de los cambios de estado de las torres
+
+    Cada evento lleva un número de secuencia creciente; los últimos
+    CAMBIOS_HISTORIAL se guardan para que un cliente reconectado reciba sólo
+    lo que se perdió. Todo se ejecuta en el hilo del event loop.
+    """
+
+    def __init__(self, historial=CAMBIOS_HISTORIAL, max_pendientes=CAMBIOS_COLA):
+        self.secuencia = 0
+        self._historial = deque(maxlen=historial)
+        self._max_pendientes = max_pendientes
+        self._suscripciones = set()
+        # Último estado conocido de cada torre, para enviar sólo lo que cambió
+        self._ultimo = {}
+        self._loop = None
+
+    def _emitir(self, evento):
+        self.secuencia += 1
+        evento = {"seq": self.secuencia, **evento}
+        self._historial.append(evento)
+        for suscripcion in self._suscripciones:
+            suscripcion.entregar(evento)
+
+    def _diferencia(self, registro_id, datos):
+        actual = {campo: datos.get(campo) for campo in CAMPOS_FEED if campo in datos}
+        anterior = self._ultimo.get(registro_id, {})
+        self._ultimo[registro_id] = {**anterior, **actual}
+        return {campo: valor for campo, valor in actual.items() if anterior.get(campo, object()) != valor}
+
+    def publicar(self, accion, registro_id=None, datos=None):
+        if accion == eventos.DELETE:
+            self._ultimo.pop(registro_id, None)
+            self._emitir({"accion": accion, "id": registro_id})
+        elif accion == eventos.RECARGA:
+            self._ultimo.clear()
+            self._emitir({"accion": accion})
+        else:
+            cambios = self._diferencia(registro_id, datos or {})
+            if cambios or accion == eventos.INSERT:
+                self._emitir({"accion": accion, "id": registro_id, "cambios": cambios})
+
+    def suscribir(self, since=None):
+        """Registrar un cliente; devuelve (suscripción, eventos a reenviar)"""
+        self._loop = asyncio.get_running_loop()
+        suscripcion = Suscripcion(self._max_pendientes)
+        pendientes = []
+        if since is not None:
+            primero = self._historial[0]['seq'] if self._historial else self.secuencia + 1
+            if since > self.secuencia or since < primero - 1:
+                # Secuencia de otro proceso o demasiado vieja: el cliente debe recargar
+                pendientes.append({"seq": self.secuencia, "accion": eventos.RECARGA})
+            else:
+                pendientes.extend(evento for evento in self._historial if evento['seq'] > since)
+        self._suscripciones.add(suscripcion)
+        return suscripcion, pendientes
+
+    def desuscribir(self, suscripcion):
+        self._suscripciones.discard(suscripcion)
+
+    def stats(self):
+        return {
+            "secuencia": self.secuencia,
+            "suscriptores": len(self._suscripciones),
+            "historial": len(self._historial),
+        }
+
+
+_hub = CambiosHub()
+
+def get_hub():
+    return _hub
+
+def _on_torre(accion, registro_id, datos):
+    try:
+        en_loop = asyncio.get_running_loop() is _hub._loop
+    except RuntimeError:
+        en_loop = False
+    if en_loop or _hub._loop is None:
+        _hub.publicar(accion, registro_id, datos)
+    else:
+        # Escritura publicada desde otro hilo: el hub sólo se toca en el loop
+        _hub._loop.call_soon_threadsafe(_hub.publicar, accion, registro_id, datos)
+
+eventos.suscribir("Torres", _on_torre)
+
+
+def formato_sse(evento):
+    # Sin campo event: todos llegan a EventSource.onmessage; la acción va en data
+    return f"id: {evento['seq']}\ndata: {json.dumps(evento, default=str)}\n\n"
+
+async def stream_sse(since=None, heartbeat=CAMBIOS_HEARTBEAT):
+    """Generador de texto SSE con los cambios posteriores a since"""
+    # Los pendientes salen del historial y la cola sólo recibe eventos
+    # posteriores a la suscripción, así que no hay duplicados
+    suscripcion, pendientes = _hub.suscribir(since)
+    try:
+        for evento in pendientes:
+            yield formato_sse(evento)
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield formato_sse(evento)
+    finally:
+        _hub.desuscribir(suscripcion)
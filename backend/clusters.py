@@ -0,0 +1,321 @@
+import math
+import os
+import threading
+
+import numpy as np
+
+import eventos
+from database import execute_query
+
+# Zoom máximo con agrupamiento; por encima se devuelven las torres individuales
+CLUSTER_MAX_ZOOM = int(os.getenv('CLUSTER_MAX_ZOOM', '16'))
+# Lado de la celda de agrupamiento en píxeles de pantalla (potencia de 2, <= 256)
+CLUSTER_CELDA_PX = int(os.getenv('CLUSTER_CELDA_PX', '64'))
+# Tope de celdas visibles por consulta (una pantalla 4K tiene unas 2000 de 64 px):
+# acota el tamaño de la respuesta y el tiempo de la consulta
+CLUSTER_MAX_CELDAS = int(os.getenv('CLUSTER_MAX_CELDAS', '4096'))
+
+# Valor usado en los conteos cuando la torre no tiene estado o convenio
+SIN_DATO = "sin_dato"
+# Latitud máxima de Web Mercator
+LAT_MAX_MERCATOR = 85.05112878
+
+
+class ClusterError(ValueError):
+    """Rectángulo con demasiadas celdas para el zoom pedido"""
+
+
+def mercator_x(lon):
+    return (lon + 180.0) / 360.0
+
+def mercator_y(lat):
+    lat = max(-LAT_MAX_MERCATOR, min(LAT_MAX_MERCATOR, lat))
+    seno = math.sin(math.radians(lat))
+    return 0.5 - math.log((1 + seno) / (1 - seno)) / (4 * math.pi)
+
+def lon_desde_x(x):
+    return x * 360.0 - 180.0
+
+def lat_desde_y(y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+
+class ClusterIndex:
+    """Índice jerárquico de agrupamiento de torres por nivel de zoom
+
+    Cada nivel es una grilla en coordenadas Web Mercator con celdas de
+    CLUSTER_CELDA_PX píxeles; la grilla de un nivel subdivide en cuatro la del
+    anterior, así que una torre pertenece a exactamente una celda por nivel y
+    agregarla, moverla o quitarla cuesta O(niveles). Es un agrupamiento por
+    grilla (como el de supercluster pero sin la búsqueda de vecinos), a cambio
+    de que las actualizaciones no requieran reconstruir nada.
+
+    Las celdas se guardan por clave cx * n + cy (n celdas por lado en el
+    nivel). Una celda con una sola torre guarda sólo su id; con más, una lista
+    [cantidad, suma_x, suma_y, suma_ids, {(estado, convenio): n}] y, en el
+    último nivel, además el conjunto de ids para expandir el zoom máximo.
+    """
+
+    def __init__(self, max_zoom=CLUSTER_MAX_ZOOM, celda_px=CLUSTER_CELDA_PX, max_celdas=CLUSTER_MAX_CELDAS):
+        if celda_px <= 0 or celda_px > 256 or celda_px & (celda_px - 1):
+            raise ValueError("CLUSTER_CELDA_PX debe ser una potencia de 2 entre 1 y 256")
+        self.max_zoom = max_zoom
+        self.max_celdas = max_celdas
+        # Celdas por lado en el zoom 0: un tile de 256 px dividido en celdas
+        self._base = 256 // celda_px
+        self._lock = threading.Lock()
+        self._torres = {}  # id -> (x, y, latitud, longitud, estado, convenio)
+        self._niveles = [{} for _ in range(max_zoom + 1)]
+
+    # --------- mantenimiento del índice ---------
+
+    def _celdas(self, x, y):
+        for zoom, nivel in enumerate(self._niveles):
+            n = self._base << zoom
+            yield zoom, nivel, min(int(x * n), n - 1) * n + min(int(y * n), n - 1)
+
+    def _nueva_celda(self, torre_id, ultimo):
+        x, y, _, _, estado, convenio = self._torres[torre_id]
+        celda = [1, x, y, torre_id, {(estado, convenio): 1}]
+        if ultimo:
+            celda.append({torre_id})
+        return celda
+
+    def _agregar(self, torre_id, torre):
+        x, y, _, _, estado, convenio = torre
+        clave_conteo = (estado, convenio)
+        for zoom, nivel, clave in self._celdas(x, y):
+            celda = nivel.get(clave)
+            if celda is None:
+                nivel[clave] = torre_id
+                continue
+            if not isinstance(celda, list):
+                celda = nivel[clave] = self._nueva_celda(celda, zoom == self.max_zoom)
+            celda[0] += 1
+            celda[1] += x
+            celda[2] += y
+            celda[3] += torre_id
+            conteos = celda[4]
+            conteos[clave_conteo] = conteos.get(clave_conteo, 0) + 1
+            if zoom == self.max_zoom:
+                celda[5].add(torre_id)
+
+    def _quitar(self, torre_id, torre):
+        x, y, _, _, estado, convenio = torre
+        clave_conteo = (estado, convenio)
+        for zoom, nivel, clave in self._celdas(x, y):
+            celda = nivel[clave]
+            if not isinstance(celda, list):
+                del nivel[clave]
+                continue
+            celda[0] -= 1
+            celda[3] -= torre_id
+            if celda[0] == 1:
+                # Vuelve a ser una celda de una torre: la que queda es suma_ids
+                nivel[clave] = celda[3]
+                continue
+            celda[1] -= x
+            celda[2] -= y
+            conteos = celda[4]
+            conteos[clave_conteo] -= 1
+            if not conteos[clave_conteo]:
+                del conteos[clave_conteo]
+            if zoom == self.max_zoom:
+                celda[5].discard(torre_id)
+
+    @staticmethod
+    def _torre(lat, lon, estado, convenio):
+        if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None
+        lat, lon = float(lat), float(lon)
+        return (mercator_x(lon), mercator_y(lat), lat, lon, estado or SIN_DATO, convenio or SIN_DATO)
+
+    def build(self, torres):
+        """Reconstruir desde cero con (id, latitud, longitud, estado, tipo_convenio)
+
+        Las celdas de cada nivel se agrupan con NumPy; sólo las celdas con más
+        de una torre se arman en Python.
+        """
+        filas = [
+            (torre_id, float(lat), float(lon), estado or SIN_DATO, convenio or SIN_DATO)
+            for torre_id, lat, lon, estado, convenio in torres
+            if lat is not None and lon is not None and -90 <= lat <= 90 and -180 <= lon <= 180
+        ]
+        validas = {}
+        niveles = [{} for _ in range(self.max_zoom + 1)]
+        if filas:
+            ids = np.fromiter((fila[0] for fila in filas), dtype=np.int64, count=len(filas))
+            lat = np.fromiter((fila[1] for fila in filas), dtype=np.float64, count=ids.size)
+            lon = np.fromiter((fila[2] for fila in filas), dtype=np.float64, count=ids.size)
+            x = (lon + 180.0) / 360.0
+            seno = np.sin(np.radians(np.clip(lat, -LAT_MAX_MERCATOR, LAT_MAX_MERCATOR)))
+            y = 0.5 - np.log((1 + seno) / (1 - seno)) / (4 * math.pi)
+            validas = {
+                fila[0]: (fx, fy) + fila[1:]
+                for fila, fx, fy in zip(filas, x.tolist(), y.tolist())
+            }
+            claves_conteo = [fila[3:] for fila in filas]
+            distintas = list(dict.fromkeys(claves_conteo))
+            codigo = {clave: i for i, clave in enumerate(distintas)}
+            conteo_cod = np.array([codigo[clave] for clave in claves_conteo], dtype=np.int64)
+            for zoom, nivel in enumerate(niveles):
+                self._agrupar_nivel(nivel, zoom, ids, x, y, conteo_cod, distintas)
+        with self._lock:
+            self._torres = validas
+            self._niveles = niveles
+
+    def _agrupar_nivel(self, nivel, zoom, ids, x, y, conteo_cod, distintas):
+        n = self._base << zoom
+        cx = np.minimum((x * n).astype(np.int64), n - 1)
+        cy = np.minimum((y * n).astype(np.int64), n - 1)
+        claves, grupo, cantidad = np.unique(cx * n + cy, return_inverse=True, return_counts=True)
+        celdas = claves.tolist()
+
+        sueltas = np.flatnonzero(cantidad[grupo] == 1)
+        nivel.update(zip(claves[grupo[sueltas]].tolist(), ids[sueltas].tolist()))
+
+        multiples = np.flatnonzero(cantidad > 1)
+        if not multiples.size:
+            return
+        suma_x = np.bincount(grupo, weights=x)
+        suma_y = np.bincount(grupo, weights=y)
+        suma_ids = np.zeros(claves.size, dtype=np.int64)
+        np.add.at(suma_ids, grupo, ids)
+        for g in multiples.tolist():
+            nivel[celdas[g]] = [int(cantidad[g]), float(suma_x[g]), float(suma_y[g]), int(suma_ids[g]), {}]
+        # Conteos por (estado, convenio): un par grupo/código por combinación presente
+        k = len(distintas)
+        pares, veces = np.unique(grupo * k + conteo_cod, return_counts=True)
+        en_multiples = cantidad[pares // k] > 1
+        for par, veces_par in zip(pares[en_multiples].tolist(), veces[en_multiples].tolist()):
+            nivel[celdas[par // k]][4][distintas[par % k]] = veces_par
+        if zoom == self.max_zoom:
+            miembros = ids[np.argsort(grupo, kind='stable')].tolist()
+            inicios = (np.cumsum(cantidad) - cantidad).tolist()
+            for g in multiples.tolist():
+                nivel[celdas[g]].append(set(miembros[inicios[g]:inicios[g] + cantidad[g]]))
+
+    def upsert(self, torre_id, lat, lon, estado, convenio):
+        """Agregar una torre o actualizar su posición, estado o convenio"""
+        nueva = self._torre(lat, lon, estado, convenio)
+        with self._lock:
+            anterior = self._torres.pop(torre_id, None)
+            if anterior == nueva:
+                if anterior is not None:
+                    self._torres[torre_id] = anterior
+                return
+            if anterior is not None:
+                self._quitar(torre_id, anterior)
+            if nueva is not None:
+                self._torres[torre_id] = nueva
+                self._agregar(torre_id, nueva)
+
+    def remove(self, torre_id):
+        with self._lock:
+            anterior = self._torres.pop(torre_id, None)
+            if anterior is not None:
+                self._quitar(torre_id, anterior)
+
+    # --------- consultas ---------
+
+    def _punto(self, torre_id):
+        _, _, lat, lon, estado, convenio = self._torres[torre_id]
+        return {
+            "id": torre_id, "lat": lat, "lon": lon, "cantidad": 1,
+            "estados": {estado: 1}, "convenios": {convenio: 1},
+        }
+
+    def _cluster(self, celda):
+        cantidad, suma_x, suma_y, _, conteos = celda[:5]
+        estados, convenios = {}, {}
+        for (estado, convenio), n in conteos.items():
+            estados[estado] = estados.get(estado, 0) + n
+            convenios[convenio] = convenios.get(convenio, 0) + n
+        return {
+            "lat": round(lat_desde_y(suma_y / cantidad), 6),
+            "lon": round(lon_desde_x(suma_x / cantidad), 6),
+            "cantidad": cantidad, "estados": estados, "convenios": convenios,
+        }
+
+    def _celdas_en_bbox(self, nivel, n, oeste, sur, este, norte):
+        cx0 = max(0, min(int(mercator_x(oeste) * n), n - 1))
+        cx1 = max(0, min(int(mercator_x(este) * n), n - 1))
+        cy0 = max(0, min(int(mercator_y(norte) * n), n - 1))
+        cy1 = max(0, min(int(mercator_y(sur) * n), n - 1))
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) <= len(nivel):
+            # Vista chica respecto del nivel: recorrer las celdas del rectángulo
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    celda = nivel.get(cx * n + cy)
+                    if celda is not None:
+                        yield celda
+        else:
+            for clave, celda in nivel.items():
+                cx, cy = divmod(clave, n)
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    yield celda
+
+    def celdas_visibles(self, oeste, sur, este, norte, zoom):
+        """Celdas de CLUSTER_CELDA_PX que ocupa el rectángulo en ese zoom (como en pantalla)"""
+        n = self._base << int(zoom)
+        ancho = min(int(mercator_x(este) * n), n - 1) - min(int(mercator_x(oeste) * n), n - 1) + 1
+        alto = min(int(mercator_y(sur) * n), n - 1) - min(int(mercator_y(norte) * n), n - 1) + 1
+        return ancho * alto
+
+    def clusters(self, oeste, sur, este, norte, zoom):
+        """Clusters y torres sueltas cuyas celdas intersectan el rectángulo en ese zoom
+
+        Rechaza rectángulos de más de max_celdas celdas: sin tope, una vista de
+        todo el mundo en un zoom alto devuelve cada torre por separado.
+        """
+        if self.celdas_visibles(oeste, sur, este, norte, zoom) > self.max_celdas:
+            raise ClusterError(
+                f"El rectángulo ocupa más de {self.max_celdas} celdas en zoom {zoom}: achíquelo o baje el zoom"
+            )
+        nivel_zoom = min(max(int(zoom), 0), self.max_zoom)
+        expandir = zoom > self.max_zoom
+        resultado = []
+        with self._lock:
+            nivel = self._niveles[nivel_zoom]
+            for celda in self._celdas_en_bbox(nivel, self._base << nivel_zoom, oeste, sur, este, norte):
+                if not isinstance(celda, list):
+                    resultado.append(self._punto(celda))
+                elif expandir:
+                    resultado.extend(self._punto(torre_id) for torre_id in sorted(celda[5]))
+                else:
+                    resultado.append(self._cluster(celda))
+        return resultado
+
+    def __len__(self):
+        return len(self._torres)
+
+
+# =================== ÍNDICE COMPARTIDO ===================
+
+_index = ClusterIndex()
+
+def _leer_torres():
+    torres = execute_query(
+        "SELECT id, latitud, longitud, estado, tipo_convenio FROM Torres",
+        fetch_all=True
+    )
+    if isinstance(torres, dict):
+        raise Exception(torres['error'])
+    return [(t['id'], t['latitud'], t['longitud'], t['estado'], t['tipo_convenio']) for t in torres]
+
+def _aplicar(accion, torre_id, datos):
+    if accion == eventos.DELETE:
+        _index.remove(torre_id)
+    elif datos:
+        _index.upsert(torre_id, datos.get('latitud'), datos.get('longitud'),
+                      datos.get('estado'), datos.get('tipo_convenio'))
+
+_sincronizado = eventos.IndiceSincronizado("Torres", _leer_torres, _index.build, _aplicar)
+
+def get_cluster_index():
+    """Índice cargado desde la base (bloqueante: usar fuera del event loop)"""
+    _sincronizado.cargar()
+    return _index
+
+def clusters_en_bbox(oeste, sur, este, norte, zoom):
+    return get_cluster_index().clusters(oeste, sur, este, norte, zoom)
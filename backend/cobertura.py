@@ -0,0 +1,286 @@
+import math
+import os
+import threading
+
+import numpy as np
+
+import eventos
+from database import execute_query
+from geo import KM_PER_DEGREE_LAT
+
+# Tamaño de celda de la grilla de cobertura y tope de celdas en memoria
+COBERTURA_CELDA_KM = float(os.getenv('COBERTURA_CELDA_KM', '0.5'))
+COBERTURA_MAX_CELDAS = int(os.getenv('COBERTURA_MAX_CELDAS', '4000000'))
+# Margen alrededor de las torres para absorber movimientos sin reconstruir
+COBERTURA_MARGEN_KM = 50.0
+
+
+class Grilla:
+    """Grilla lat/lon regular; cada fila tiene su propia área de celda en km²"""
+
+    def __init__(self, lat_min, lat_max, lon_min, lon_max, celda_km, max_celdas):
+        lat_centro = math.radians((lat_min + lat_max) / 2)
+        dlat = celda_km / KM_PER_DEGREE_LAT
+        dlon = celda_km / (KM_PER_DEGREE_LAT * max(math.cos(lat_centro), 1e-6))
+        filas = max(1, math.ceil((lat_max - lat_min) / dlat))
+        columnas = max(1, math.ceil((lon_max - lon_min) / dlon))
+        if filas * columnas > max_celdas:
+            # Agrandar las celdas hasta respetar el tope de memoria
+            escala = math.sqrt(filas * columnas / max_celdas)
+            dlat *= escala
+            dlon *= escala
+            filas = max(1, math.ceil((lat_max - lat_min) / dlat))
+            columnas = max(1, math.ceil((lon_max - lon_min) / dlon))
+
+        self._configurar(lat_min, lon_min, dlat, dlon, filas, columnas)
+
+    @classmethod
+    def alineada(cls, lat_min, lon_min, dlat, dlon, filas, columnas):
+        """Grilla con paso y tamaño dados (para teselas que deben coincidir entre sí)"""
+        grilla = cls.__new__(cls)
+        grilla._configurar(lat_min, lon_min, dlat, dlon, filas, columnas)
+        return grilla
+
+    def _configurar(self, lat_min, lon_min, dlat, dlon, filas, columnas):
+        self.lat_min = lat_min
+        self.lon_min = lon_min
+        self.lat_max = lat_min + filas * dlat
+        self.lon_max = lon_min + columnas * dlon
+        self.dlat = dlat
+        self.dlon = dlon
+        self.filas = filas
+        self.columnas = columnas
+        self.lat_filas = lat_min + (np.arange(filas) + 0.5) * dlat
+        cos_filas = np.cos(np.radians(self.lat_filas))
+        self.cos_filas = np.maximum(cos_filas, 1e-6)
+        self.area_celda_fila = (dlat * KM_PER_DEGREE_LAT) * (dlon * KM_PER_DEGREE_LAT * cos_filas)
+
+    def contiene(self, lat, lon, alcance_km):
+        """Indicar si el disco entra completo en la grilla"""
+        dlat = alcance_km / KM_PER_DEGREE_LAT
+        dlon = alcance_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 1e-6))
+        return (
+            lat - dlat >= self.lat_min and lat + dlat <= self.lat_max
+            and lon - dlon >= self.lon_min and lon + dlon <= self.lon_max
+        )
+
+    def tramos(self, lat, lon, alcance_km):
+        """Rasterizar discos como tramos horizontales (fila, col_desde, col_hasta) inclusive
+
+        lat, lon y alcance_km son arrays; el cálculo está vectorizado sobre
+        todas las combinaciones torre/fila.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        alcance_km = np.asarray(alcance_km, dtype=np.float64)
+        vacio = np.empty(0, dtype=np.int64)
+        if lat.size == 0:
+            return vacio, vacio, vacio
+
+        dlat_disco = alcance_km / KM_PER_DEGREE_LAT
+        fila_desde = np.floor((lat - dlat_disco - self.lat_min) / self.dlat).astype(np.int64)
+        fila_hasta = np.floor((lat + dlat_disco - self.lat_min) / self.dlat).astype(np.int64)
+        fila_desde = np.clip(fila_desde, 0, self.filas - 1)
+        fila_hasta = np.clip(fila_hasta, 0, self.filas - 1)
+        cantidad = fila_hasta - fila_desde + 1
+
+        # Expandir cada torre en una entrada por fila cubierta
+        torre = np.repeat(np.arange(lat.size), cantidad)
+        inicio = np.cumsum(cantidad) - cantidad
+        fila = fila_desde[torre] + (np.arange(torre.size) - inicio[torre])
+
+        dy_km = (self.lat_filas[fila] - lat[torre]) * KM_PER_DEGREE_LAT
+        semiancho_km = np.sqrt(np.maximum(alcance_km[torre] ** 2 - dy_km ** 2, 0.0))
+        semiancho = semiancho_km / (KM_PER_DEGREE_LAT * self.cos_filas[fila])
+        lon_t = lon[torre]
+        # Celdas cuyo centro cae dentro del disco
+        col_desde = np.ceil((lon_t - semiancho - self.lon_min) / self.dlon - 0.5).astype(np.int64)
+        col_hasta = np.floor((lon_t + semiancho - self.lon_min) / self.dlon - 0.5).astype(np.int64)
+        col_desde = np.maximum(col_desde, 0)
+        col_hasta = np.minimum(col_hasta, self.columnas - 1)
+
+        validos = (np.abs(dy_km) <= alcance_km[torre]) & (col_desde <= col_hasta)
+        return fila[validos], col_desde[validos], col_hasta[validos]
+
+    def rasterizar(self, lat, lon, alcance_km):
+        """Raster de conteo: cuántos discos cubren cada celda (barrido por filas)"""
+        fila, desde, hasta = self.tramos(lat, lon, alcance_km)
+        ancho = self.columnas + 1
+        total = self.filas * ancho
+        diferencias = (
+            np.bincount(fila * ancho + desde, minlength=total)
+            - np.bincount(fila * ancho + hasta + 1, minlength=total)
+        )
+        conteo = np.cumsum(diferencias.reshape(self.filas, ancho), axis=1)[:, :self.columnas]
+        return conteo.astype(np.int32)
+
+
+def _torre_valida(lat, lon, alcance_km):
+    """Descartar torres sin alcance o con coordenadas fuera de rango"""
+    return (
+        lat is not None and lon is not None and bool(alcance_km) and alcance_km > 0
+        and -90 <= lat <= 90 and -180 <= lon <= 180
+    )
+
+
+class CoverageEngine:
+    """Área de la unión de los discos de cobertura, mantenida en forma incremental
+
+    Las escrituras (upsert/remove) llegan desde el event loop: sólo toman el
+    lock para sumar o restar un disco. Los rasterizados completos se hacen
+    sobre una copia, fuera del lock, y se instalan de una vez.
+    """
+
+    def __init__(self, celda_km=COBERTURA_CELDA_KM, max_celdas=COBERTURA_MAX_CELDAS,
+                 margen_km=COBERTURA_MARGEN_KM):
+        self.celda_km = celda_km
+        self.max_celdas = max_celdas
+        self.margen_km = margen_km
+        self._lock = threading.RLock()
+        # Un solo rasterizado completo a la vez (no lo toman las escrituras)
+        self._rebuild_lock = threading.Lock()
+        self._torres = {}  # id -> (latitud, longitud, alcance_km)
+        self.grilla = None
+        self.conteo = None
+        self._cubiertas_fila = None
+        self._area_km2 = 0.0
+        # Raster a rehacer en la próxima consulta (las escrituras llegan desde el event loop)
+        self._pendiente = False
+        # Ids escritos durante un rasterizado en curso (None si no hay ninguno)
+        self._cambiadas = None
+
+    def build(self, torres):
+        """Reconstruir el raster desde cero con (id, latitud, longitud, alcance_km)"""
+        registros = {
+            torre_id: (float(lat), float(lon), float(alcance))
+            for torre_id, lat, lon, alcance in torres
+            if _torre_valida(lat, lon, alcance)
+        }
+        with self._rebuild_lock:
+            raster = self._rasterizar(registros)
+            with self._lock:
+                self._torres = registros
+                self._instalar(raster)
+                self._pendiente = False
+
+    def _rasterizar(self, torres):
+        """(grilla, conteo, celdas cubiertas por fila) para las torres dadas; no toca el estado"""
+        if not torres:
+            return None, None, None
+        lat, lon, alcance = (np.array(v, dtype=np.float64) for v in zip(*torres.values()))
+        cos_lat = np.maximum(np.cos(np.radians(lat)), 1e-6)
+        dlat = (alcance + self.margen_km) / KM_PER_DEGREE_LAT
+        dlon = (alcance + self.margen_km) / (KM_PER_DEGREE_LAT * cos_lat)
+        grilla = Grilla(
+            float((lat - dlat).min()), float((lat + dlat).max()),
+            float((lon - dlon).min()), float((lon + dlon).max()),
+            self.celda_km, self.max_celdas,
+        )
+        conteo = grilla.rasterizar(lat, lon, alcance)
+        return grilla, conteo, np.count_nonzero(conteo, axis=1)
+
+    def _instalar(self, raster):
+        self.grilla, self.conteo, self._cubiertas_fila = raster
+        self._area_km2 = (
+            float(self._cubiertas_fila @ self.grilla.area_celda_fila) if self.grilla is not None else 0.0
+        )
+
+    def _rebuild(self):
+        """Rehacer el raster pendiente sin bloquear a las escrituras mientras se rasteriza"""
+        with self._rebuild_lock:
+            while True:
+                with self._lock:
+                    if not self._pendiente:
+                        return
+                    foto = dict(self._torres)
+                    self._cambiadas = set()
+                raster = self._rasterizar(foto)
+                with self._lock:
+                    cambiadas, self._cambiadas = self._cambiadas, None
+                    self._instalar(raster)
+                    self._pendiente = False
+                    # Pasar al raster nuevo lo escrito mientras se calculaba
+                    for torre_id in cambiadas:
+                        self._cambiar(foto.get(torre_id), self._torres.get(torre_id))
+                        if self._pendiente:
+                            break
+
+    def _aplicar(self, torre, delta):
+        """Sumar o restar un disco del raster actualizando sólo las filas tocadas"""
+        lat, lon, alcance = torre
+        fila, desde, hasta = self.grilla.tramos([lat], [lon], [alcance])
+        for f, c0, c1 in zip(fila.tolist(), desde.tolist(), hasta.tolist()):
+            self.conteo[f, c0:c1 + 1] += delta
+        if fila.size:
+            self._cubiertas_fila[fila] = np.count_nonzero(self.conteo[fila], axis=1)
+
+    def _cambiar(self, anterior, nueva):
+        """Pasar una torre de anterior a nueva en el raster; marcarlo pendiente si no alcanza"""
+        if anterior == nueva or self._pendiente:
+            return
+        if nueva is not None and (self.grilla is None or not self.grilla.contiene(*nueva)):
+            # La grilla no alcanza: rehacerla acá bloquearía a quien publicó la escritura
+            self._pendiente = True
+            return
+        if anterior is not None:
+            self._aplicar(anterior, -1)
+        if nueva is not None:
+            self._aplicar(nueva, 1)
+        self._area_km2 = float(self._cubiertas_fila @ self.grilla.area_celda_fila)
+
+    def upsert(self, torre_id, lat, lon, alcance_km):
+        """Agregar una torre o actualizar su posición/alcance"""
+        with self._lock:
+            anterior = self._torres.pop(torre_id, None)
+            nueva = None
+            if _torre_valida(lat, lon, alcance_km):
+                nueva = (float(lat), float(lon), float(alcance_km))
+                self._torres[torre_id] = nueva
+            if self._cambiadas is not None:
+                self._cambiadas.add(torre_id)
+            self._cambiar(anterior, nueva)
+
+    def remove(self, torre_id):
+        """Quitar una torre del raster"""
+        self.upsert(torre_id, None, None, None)
+
+    def area_km2(self):
+        """Área cubierta; si el raster quedó pendiente lo rehace (bloqueante: fuera del event loop)"""
+        if self._pendiente:
+            self._rebuild()
+        with self._lock:
+            return self._area_km2
+
+    def __len__(self):
+        return len(self._torres)
+
+
+# =================== MOTOR COMPARTIDO ===================
+
+_engine = CoverageEngine()
+
+def _leer_torres():
+    torres = execute_query(
+        "SELECT id, latitud, longitud, alcance_km FROM Torres",
+        fetch_all=True
+    )
+    if isinstance(torres, dict):
+        raise Exception(torres['error'])
+    return [(t['id'], t['latitud'], t['longitud'], t['alcance_km']) for t in torres]
+
+def _aplicar(accion, torre_id, datos):
+    if accion == eventos.DELETE:
+        _engine.remove(torre_id)
+    elif datos:
+        _engine.upsert(torre_id, datos.get('latitud'), datos.get('longitud'), datos.get('alcance_km'))
+
+_sincronizado = eventos.IndiceSincronizado("Torres", _leer_torres, _engine.build, _aplicar)
+
+def get_coverage_engine():
+    """Motor de cobertura cargado desde la base (bloqueante: usar fuera del event loop)"""
+    _sincronizado.cargar()
+    return _engine
+
+def area_cubierta_km2():
+    """Área en km² de la unión de todas las coberturas"""
+    return get_coverage_engine().area_km2()
@@ -0,0 +1,81 @@
+import threading
+
+from database import execute_query, registrar_observador_consultas, run_query_in_db_thread, translate_query
+
+
+class Consulta:
+    """Sentencia con nombre, traducida al dialecto activo al registrarse"""
+
+    def __init__(self, nombre, sql):
+        self.nombre = nombre
+        self.sql = translate_query(sql)
+        self._lock = threading.Lock()
+        self.llamadas = 0
+        self.errores = 0
+        self.filas = 0
+        self.tiempo_total = 0.0
+        self.tiempo_max = 0.0
+
+    def _registrar_llamada(self, duracion, filas, error):
+        with self._lock:
+            self.llamadas += 1
+            self.tiempo_total += duracion
+            if duracion > self.tiempo_max:
+                self.tiempo_max = duracion
+            self.filas += filas
+            if error is not None:
+                self.errores += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "nombre": self.nombre,
+                "llamadas": self.llamadas,
+                "errores": self.errores,
+                "filas": self.filas,
+                "tiempo_total_ms": round(self.tiempo_total * 1000, 3),
+                "tiempo_medio_ms": round(self.tiempo_total * 1000 / self.llamadas, 3) if self.llamadas else 0.0,
+                "tiempo_max_ms": round(self.tiempo_max * 1000, 3),
+            }
+
+
+_registro = {}
+# Texto SQL traducido -> consulta, para reconocer las sentencias registradas
+_por_sql = {}
+
+def registrar(nombre, sql):
+    """Registrar una sentencia con nombre (llamar a nivel de módulo, al importar)"""
+    if nombre in _registro:
+        raise ValueError(f"Consulta ya registrada: {nombre}")
+    consulta = Consulta(nombre, sql)
+    _registro[nombre] = consulta
+    _por_sql[consulta.sql] = consulta
+    return consulta
+
+def nombre_consulta(sql):
+    """Nombre registrado de un texto SQL (ya traducido) o None"""
+    consulta = _por_sql.get(sql)
+    return consulta.nombre if consulta else None
+
+def ejecutar(consulta, params=None, fetch_one=False, fetch_all=False):
+    """Ejecutar una sentencia registrada (las estadísticas las toma el observador)"""
+    return execute_query(consulta.sql, params, fetch_one, fetch_all)
+
+def _on_consulta(query, params, duracion, filas, error):
+    consulta = _por_sql.get(query)
+    if consulta is not None:
+        consulta._registrar_llamada(duracion, filas, error)
+
+registrar_observador_consultas(_on_consulta)
+
+async def ejecutar_async(consulta, params=None, fetch_one=False, fetch_all=False):
+    """Variante awaitable de ejecutar"""
+    return await run_query_in_db_thread(consulta.sql, ejecutar, consulta, params, fetch_one, fetch_all)
+
+def estadisticas_consultas():
+    """Estadísticas por sentencia, de mayor a menor tiempo total"""
+    return sorted(
+        (consulta.stats() for consulta in _registro.values()),
+        key=lambda stats: stats['tiempo_total_ms'],
+        reverse=True
+    )
@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+from database import get_db_read, registrar_observador_consultas
+
+# Umbral en milisegundos a partir del cual una consulta se considera lenta
+CONSULTA_LENTA_MS = float(os.getenv('CONSULTA_LENTA_MS', '100'))
+# Máximo de consultas distintas (normalizadas) que se acumulan
+CONSULTA_LENTA_MAX = int(os.getenv('CONSULTA_LENTA_MAX', '500'))
+
+logger = logging.getLogger("consultas_lentas")
+
+_LITERAL_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_LITERAL_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LISTA_MARCADORES = re.compile(r"\?(?:\s*,\s*\?)+")
+_ESPACIOS = re.compile(r"\s+")
+
+@lru_cache(maxsize=1024)
+def normalizar_sql(sql):
+    """Texto canónico de una consulta: literales como ?, listas de ? colapsadas, espacios simples"""
+    sql = _LITERAL_TEXTO.sub('?', sql)
+    sql = _LITERAL_NUMERO.sub('?', sql)
+    sql = _LISTA_MARCADORES.sub('?, ...', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+def forma_parametros(params):
+    """Tipos de los parámetros, sin sus valores (no se registran datos de usuarios)"""
+    if not params:
+        return []
+    if isinstance(params, dict):
+        return {clave: type(valor).__name__ for clave, valor in params.items()}
+    return [type(valor).__name__ for valor in params]
+
+def plan_de_consulta(sql, params):
+    """Salida de EXPLAIN QUERY PLAN como líneas indentadas según la jerarquía"""
+    try:
+        with get_db_read() as conn:
+            filas = conn.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+    except Exception as e:
+        return [f"(sin plan: {e})"]
+    profundidad = {0: -1}
+    lineas = []
+    for fila in filas:
+        nodo, padre, detalle = fila[0], fila[1], fila[3]
+        profundidad[nodo] = profundidad.get(padre, -1) + 1
+        lineas.append('  ' * profundidad[nodo] + detalle)
+    return lineas
+
+
+class RegistroLentas:
+    """Consultas que superaron el umbral, agrupadas por SQL normalizado"""
+
+    def __init__(self, umbral_ms=CONSULTA_LENTA_MS, maximo=CONSULTA_LENTA_MAX):
+        self.umbral_ms = umbral_ms
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self.descartadas = 0
+
+    def observar(self, query, params, duracion, filas, error):
+        duracion_ms = duracion * 1000
+        if duracion_ms < self.umbral_ms:
+            return
+        normalizada = normalizar_sql(query)
+        ahora = datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            entrada = self._entradas.get(normalizada)
+            nueva = entrada is None
+            if nueva:
+                if len(self._entradas) >= self.maximo:
+                    self.descartadas += 1
+                    return
+                entrada = self._entradas[normalizada] = {
+                    "sql": normalizada, "ocurrencias": 0, "tiempo_total_ms": 0.0,
+                    "tiempo_max_ms": 0.0, "filas_max": 0, "errores": 0,
+                    "primera_vez": ahora, "plan": None,
+                }
+            entrada["ocurrencias"] += 1
+            entrada["tiempo_total_ms"] += duracion_ms
+            entrada["tiempo_max_ms"] = max(entrada["tiempo_max_ms"], duracion_ms)
+            entrada["filas_max"] = max(entrada["filas_max"], filas)
+            entrada["errores"] += error is not None
+            entrada["ultima_vez"] = ahora
+            entrada["parametros"] = forma_parametros(params)
+
+        if nueva:
+            # El plan se captura una sola vez por consulta normalizada, fuera del lock
+            entrada["plan"] = plan_de_consulta(query, params)
+
+        logger.warning(json.dumps({
+            "evento": "consulta_lenta",
+            "duracion_ms": round(duracion_ms, 3),
+            "umbral_ms": self.umbral_ms,
+            "sql": normalizada,
+            "parametros": forma_parametros(params),
+            "filas": filas,
+            "error": error,
+            "plan": entrada["plan"] if nueva else None,
+        }, ensure_ascii=False))
+
+    def top(self, orden="tiempo_total_ms", limite=20):
+        with self._lock:
+            entradas = [dict(entrada) for entrada in self._entradas.values()]
+        for entrada in entradas:
+            entrada["tiempo_medio_ms"] = round(entrada["tiempo_total_ms"] / entrada["ocurrencias"], 3)
+            entrada["tiempo_total_ms"] = round(entrada["tiempo_total_ms"], 3)
+            entrada["tiempo_max_ms"] = round(entrada["tiempo_max_ms"], 3)
+        entradas.sort(key=lambda entrada: entrada[orden], reverse=True)
+        return entradas[:limite]
+
+    def reiniciar(self):
+        with self._lock:
+            self._entradas.clear()
+            self.descartadas = 0
+
+
+_registro = RegistroLentas()
+
+def get_registro_lentas():
+    return _registro
+
+registrar_observador_consultas(_registro.observar)
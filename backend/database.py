@@ -1,6 +1,12 @@
+import asyncio
 import sqlite3
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from functools import lru_cache, partial
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -8,15 +14,108 @@ load_dotenv()
 
 # Para desarrollo usamos SQLite, para producción SQL Server
 USE_SQLITE = os.getenv('USE_SQLITE', 'true').lower() == 'true'
-DB_PATH = Path(__file__).parent / "torres.db"
+DB_PATH = Path(os.getenv('SQLITE_DB_PATH', Path(__file__).parent / "torres.db"))
 
-def init_sqlite_db():
-    """Inicializar base de datos SQLite con el schema completo"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+# Perfiles de PRAGMA para SQLite. journal_mode se fija una vez en el archivo;
+# el resto se aplica a cada conexión al abrirla. cache_size negativo = KiB
+# por conexión.
+SQLITE_PROFILES = {
+    "rendimiento": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+    },
+    "seguro": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -16384,
+        "busy_timeout": 10000,
+        "temp_store": "DEFAULT",
+    },
+    # Comportamiento original: journal con rollback, lectores bloqueados por escrituras
+    "compatible": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "busy_timeout": 5000,
+        "temp_store": "DEFAULT",
+    },
+}
+SQLITE_PROFILE = os.getenv('SQLITE_PROFILE', 'rendimiento')
+if SQLITE_PROFILE not in SQLITE_PROFILES:
+    raise ValueError(f"SQLITE_PROFILE desconocido: {SQLITE_PROFILE}")
+
+def _sqlite_pragmas():
+    """PRAGMA del perfil activo, con overrides individuales SQLITE_<PRAGMA>"""
+    pragmas = dict(SQLITE_PROFILES[SQLITE_PROFILE])
+    for nombre, valor in pragmas.items():
+        override = os.getenv(f"SQLITE_{nombre.upper()}")
+        if override is not None:
+            pragmas[nombre] = type(valor)(override)
+    return pragmas
+
+SQLITE_PRAGMAS = _sqlite_pragmas()
+SQLITE_CACHED_STATEMENTS = int(os.getenv('SQLITE_CACHED_STATEMENTS', '256'))
+
+def sentencias_sql(script):
+    """Separar un script en sentencias completas (respeta BEGIN ... END de los triggers)"""
+    sentencia = ''
+    for parte in script.split(';'):
+        sentencia += parte + ';'
+        if sqlite3.complete_statement(sentencia):
+            if sentencia.strip(' \t\r\n;'):
+                yield sentencia
+            sentencia = ''
+    # Lo que queda después del último ';' (comentarios o espacios)
+    if sentencia[:-1].strip():
+        yield sentencia[:-1]
+
+def ejecutar_script(cursor, script):
+    """Variante de executescript que no confirma la transacción en curso
+
+    executescript hace COMMIT antes de empezar y corre en autocommit, así que
+    un error a mitad de camino deja el schema a medio aplicar.
+    """
+    for sentencia in sentencias_sql(script):
+        cursor.execute(sentencia)
+
+@contextmanager
+def transaccion(conn):
+    """Transacción explícita, incluidas las sentencias DDL (CREATE, DROP...)
+
+    Con el modo por defecto del módulo sqlite3 los CREATE se confirman solos;
+    acá la conexión pasa a autocommit y el BEGIN/COMMIT se maneja a mano.
+    """
+    nivel = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN")
+        try:
+            yield conn.cursor()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = nivel
+
+def init_sqlite_db(db_path=None):
+    """Inicializar base de datos SQLite con el schema completo (en una sola transacción)"""
+    conn = sqlite3.connect(db_path or DB_PATH)
+    try:
+        with transaccion(conn) as cursor:
+            _crear_schema_inicial(cursor)
+    finally:
+        conn.close()
+
+def _crear_schema_inicial(cursor):
     # Crear tablas basadas en el schema de SQL Server
-    cursor.executescript("""
+    ejecutar_script(cursor, """
         -- Tabla de Roles
         CREATE TABLE IF NOT EXISTS ROL (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -122,7 +221,7 @@ def init_sqlite_db():
     # Insertar datos de ejemplo si no existen
     cursor.execute("SELECT COUNT(*) FROM ROL")
     if cursor.fetchone()[0] == 0:
-        cursor.executescript("""
+        ejecutar_script(cursor, """
             INSERT INTO ROL (nombreRol, descripcion) VALUES
             ('Administrador', 'Acceso total al sistema'),
             ('Técnico Torrista', 'Gestión y mantenimiento de torres'),
@@ -144,16 +243,255 @@ def init_sqlite_db():
             ('Torre Central ECOM', 'torreantena', 'Av. 25 de Mayo 1234, Resistencia', -27.451958, -58.986347, 'operativa', 35.00, 'Ecom', 2, 2),
             ('Repetidor Villa Ángela', 'repetidor', 'Ruta 89 Km 45, Villa Ángela', -27.573813, -60.715000, 'limitada', 15.00, 'De tercero', 3, 3);
         """)
-    
+
+def init_spatial_index(cursor):
+    """Crear el índice espacial R*Tree de Torres y los triggers que lo sincronizan"""
+    ejecutar_script(cursor, """
+        CREATE VIRTUAL TABLE IF NOT EXISTS Torres_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        );
+
+        CREATE TRIGGER IF NOT EXISTS Torres_rtree_insert AFTER INSERT ON Torres
+        BEGIN
+            INSERT INTO Torres_rtree VALUES
+            (new.id, new.latitud, new.latitud, new.longitud, new.longitud);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Torres_rtree_update AFTER UPDATE OF latitud, longitud ON Torres
+        BEGIN
+            UPDATE Torres_rtree
+            SET min_lat = new.latitud, max_lat = new.latitud,
+                min_lon = new.longitud, max_lon = new.longitud
+            WHERE id = new.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Torres_rtree_delete AFTER DELETE ON Torres
+        BEGIN
+            DELETE FROM Torres_rtree WHERE id = old.id;
+        END;
+
+        -- Indexar torres que existían antes de crear el índice
+        INSERT INTO Torres_rtree
+        SELECT id, latitud, latitud, longitud, longitud FROM Torres
+        WHERE id NOT IN (SELECT id FROM Torres_rtree);
+    """)
+
+def init_stats_tables(cursor):
+    """Crear las tablas de estadísticas materializadas y sus triggers"""
+    ejecutar_script(cursor, """
+        -- Contadores: total_torres, torres_visitadas y convenio:<tipo_convenio>
+        CREATE TABLE IF NOT EXISTS EstadisticasResumen (
+            clave VARCHAR(100) PRIMARY KEY,
+            valor INTEGER NOT NULL DEFAULT 0
+        );
+
+        -- Cantidad de mantenimientos por torre (una fila por torre visitada)
+        CREATE TABLE IF NOT EXISTS TorresVisitadas (
+            TorreID INTEGER PRIMARY KEY,
+            mantenimientos INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE TRIGGER IF NOT EXISTS Torres_stats_insert AFTER INSERT ON Torres
+        BEGIN
+            INSERT INTO EstadisticasResumen (clave, valor) VALUES ('total_torres', 1)
+            ON CONFLICT(clave) DO UPDATE SET valor = valor + 1;
+            INSERT INTO EstadisticasResumen (clave, valor)
+            VALUES ('convenio:' || COALESCE(new.tipo_convenio, ''), 1)
+            ON CONFLICT(clave) DO UPDATE SET valor = valor + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Torres_stats_delete AFTER DELETE ON Torres
+        BEGIN
+            UPDATE EstadisticasResumen SET valor = valor - 1 WHERE clave = 'total_torres';
+            UPDATE EstadisticasResumen SET valor = valor - 1
+            WHERE clave = 'convenio:' || COALESCE(old.tipo_convenio, '');
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Torres_stats_update AFTER UPDATE OF tipo_convenio ON Torres
+        WHEN old.tipo_convenio IS NOT new.tipo_convenio
+        BEGIN
+            UPDATE EstadisticasResumen SET valor = valor - 1
+            WHERE clave = 'convenio:' || COALESCE(old.tipo_convenio, '');
+            INSERT INTO EstadisticasResumen (clave, valor)
+            VALUES ('convenio:' || COALESCE(new.tipo_convenio, ''), 1)
+            ON CONFLICT(clave) DO UPDATE SET valor = valor + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Mantenimientos_stats_insert AFTER INSERT ON Mantenimientos
+        BEGIN
+            INSERT INTO TorresVisitadas (TorreID, mantenimientos) VALUES (new.TorreID, 1)
+            ON CONFLICT(TorreID) DO UPDATE SET mantenimientos = mantenimientos + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Mantenimientos_stats_delete AFTER DELETE ON Mantenimientos
+        BEGIN
+            UPDATE TorresVisitadas SET mantenimientos = mantenimientos - 1
+            WHERE TorreID = old.TorreID;
+            DELETE FROM TorresVisitadas WHERE TorreID = old.TorreID AND mantenimientos <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS Mantenimientos_stats_update AFTER UPDATE OF TorreID ON Mantenimientos
+        WHEN old.TorreID IS NOT new.TorreID
+        BEGIN
+            UPDATE TorresVisitadas SET mantenimientos = mantenimientos - 1
+            WHERE TorreID = old.TorreID;
+            DELETE FROM TorresVisitadas WHERE TorreID = old.TorreID AND mantenimientos <= 0;
+            INSERT INTO TorresVisitadas (TorreID, mantenimientos) VALUES (new.TorreID, 1)
+            ON CONFLICT(TorreID) DO UPDATE SET mantenimientos = mantenimientos + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS TorresVisitadas_stats_insert AFTER INSERT ON TorresVisitadas
+        BEGIN
+            INSERT INTO EstadisticasResumen (clave, valor) VALUES ('torres_visitadas', 1)
+            ON CONFLICT(clave) DO UPDATE SET valor = valor + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS TorresVisitadas_stats_delete AFTER DELETE ON TorresVisitadas
+        BEGIN
+            UPDATE EstadisticasResumen SET valor = valor - 1 WHERE clave = 'torres_visitadas';
+        END;
+    """)
+    cursor.execute("SELECT COUNT(*) FROM EstadisticasResumen")
+    if cursor.fetchone()[0] == 0:
+        rebuild_stats_tables(cursor)
+
+def rebuild_stats_tables(cursor):
+    """Recalcular desde cero los contadores materializados (dentro de la transacción en curso)"""
+    cursor.execute("DELETE FROM TorresVisitadas")
+    cursor.execute("DELETE FROM EstadisticasResumen")
+    # Cargar TorresVisitadas dispara el contador torres_visitadas
+    cursor.execute("""
+        INSERT INTO TorresVisitadas (TorreID, mantenimientos)
+        SELECT TorreID, COUNT(*) FROM Mantenimientos GROUP BY TorreID
+    """)
+    cursor.execute("""
+        INSERT INTO EstadisticasResumen (clave, valor)
+        SELECT 'total_torres', COUNT(*) FROM Torres
+    """)
+    cursor.execute("""
+        INSERT INTO EstadisticasResumen (clave, valor)
+        SELECT 'convenio:' || COALESCE(tipo_convenio, ''), COUNT(*)
+        FROM Torres GROUP BY COALESCE(tipo_convenio, '')
+    """)
+    cursor.execute("""
+        INSERT INTO EstadisticasResumen (clave, valor) VALUES ('torres_visitadas', 0)
+        ON CONFLICT(clave) DO NOTHING
+    """)
+
+def init_blob_tables(cursor):
+    """Crear las tablas del almacén de imágenes por contenido (ver blobs.py)"""
+    ejecutar_script(cursor, """
+        -- Archivos almacenados en disco, identificados por su SHA-256
+        CREATE TABLE IF NOT EXISTS Blobs (
+            sha256 CHAR(64) PRIMARY KEY,
+            tamano INTEGER NOT NULL,
+            tipo_mime VARCHAR(100) NOT NULL,
+            fecha_creacion DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+
+        -- Imágenes (posiciones 1 a 4) de cada mantenimiento
+        CREATE TABLE IF NOT EXISTS MantenimientoImagenes (
+            MantenimientoID INTEGER NOT NULL,
+            posicion INTEGER NOT NULL CHECK (posicion BETWEEN 1 AND 4),
+            sha256 CHAR(64) NOT NULL,
+            PRIMARY KEY (MantenimientoID, posicion),
+            FOREIGN KEY (MantenimientoID) REFERENCES Mantenimientos(id) ON DELETE CASCADE,
+            FOREIGN KEY (sha256) REFERENCES Blobs(sha256)
+        );
+    """)
+
+# =================== MIGRACIONES ===================
+
+# Migraciones versionadas, aplicadas en orden y una sola vez por base.
+# Cada una es SQL o una función que recibe un cursor; deben ser idempotentes
+# (IF NOT EXISTS) porque las bases previas a este registro ya pueden tener
+# parte de las estructuras.
+MIGRACIONES = [
+    (1, "Índice Mantenimientos(TorreID, fecha_inicio_mantenimiento)",
+     "CREATE INDEX IF NOT EXISTS IX_Mantenimientos_TorreID_fecha "
+     "ON Mantenimientos(TorreID, fecha_inicio_mantenimiento)"),
+    (2, "Índice Mantenimientos(fecha_inicio_mantenimiento)",
+     "CREATE INDEX IF NOT EXISTS IX_Mantenimientos_fecha "
+     "ON Mantenimientos(fecha_inicio_mantenimiento)"),
+    (3, "Índice TECNICOINTERVINIENTE(TorreID, activo)",
+     "CREATE INDEX IF NOT EXISTS IX_TECNICOINTERVINIENTE_TorreID_activo "
+     "ON TECNICOINTERVINIENTE(TorreID, activo)"),
+    (4, "Índice USUARIOTORRISTA(norDni, activo)",
+     "CREATE INDEX IF NOT EXISTS IX_USUARIOTORRISTA_norDni_activo "
+     "ON USUARIOTORRISTA(norDni, activo)"),
+    (5, "Índice Torres(tipo_convenio)",
+     "CREATE INDEX IF NOT EXISTS IX_Torres_tipo_convenio ON Torres(tipo_convenio)"),
+    (6, "Índice espacial R*Tree de Torres", init_spatial_index),
+    (7, "Estadísticas materializadas", init_stats_tables),
+    (8, "Almacén de imágenes por contenido", init_blob_tables),
+]
+
+def get_schema_version(conn):
+    """Versiones de migración ya aplicadas"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaVersion (
+            version INTEGER PRIMARY KEY,
+            descripcion VARCHAR(255) NOT NULL,
+            fecha_aplicada DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
     conn.commit()
-    conn.close()
+    return {row[0] for row in conn.execute("SELECT version FROM SchemaVersion")}
+
+def apply_migrations(conn, hasta=None):
+    """Aplicar en orden las migraciones pendientes; devuelve las versiones aplicadas
+
+    Cada migración y su fila en SchemaVersion van en una misma transacción:
+    si falla, no queda nada de ella aplicado.
+    """
+    aplicadas = get_schema_version(conn)
+    nuevas = []
+    for version, descripcion, migracion in MIGRACIONES:
+        if version in aplicadas or (hasta is not None and version > hasta):
+            continue
+        with transaccion(conn) as cursor:
+            if callable(migracion):
+                migracion(cursor)
+            else:
+                ejecutar_script(cursor, migracion)
+            cursor.execute(
+                "INSERT INTO SchemaVersion (version, descripcion) VALUES (?, ?)",
+                (version, descripcion)
+            )
+        print(f"Migración {version} aplicada: {descripcion}")
+        nuevas.append(version)
+    return nuevas
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def _ensure_sqlite_schema():
+    """Crear la base si no existe y aplicar las migraciones pendientes (una vez por proceso)"""
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            # Por tabla y no por archivo: un archivo vacío (creación interrumpida) también se inicializa
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Torres'").fetchone():
+                init_sqlite_db()
+            conn.execute(f"PRAGMA journal_mode = {SQLITE_PRAGMAS['journal_mode']}")
+            apply_migrations(conn)
+        finally:
+            conn.close()
+        _schema_ready = True
 
-def get_db_connection():
+def prepare_database():
+    """Preparar el schema al iniciar la aplicación"""
+    if USE_SQLITE:
+        _ensure_sqlite_schema()
+
+def get_db_connection(read_only=False):
     """Crear conexión a la base de datos"""
     if USE_SQLITE:
-        if not DB_PATH.exists():
-            init_sqlite_db()
-        return sqlite3.connect(DB_PATH)
+        _ensure_sqlite_schema()
+        return _crear_conexion_sqlite(read_only)
     else:
         # Para SQL Server (cuando esté disponible)
         try:
@@ -169,45 +507,315 @@ def get_db_connection():
             return pyodbc.connect(CONNECTION_STRING)
         except ImportError:
             print("pyodbc no disponible, usando SQLite")
-            if not DB_PATH.exists():
-                init_sqlite_db()
-            return sqlite3.connect(DB_PATH)
+            _ensure_sqlite_schema()
+            return _crear_conexion_sqlite(read_only)
+
+def _crear_conexion_sqlite(read_only=False):
+    """Abrir una conexión SQLite con los PRAGMA aplicados una sola vez"""
+    # check_same_thread=False: la conexión vive en el pool y puede ser
+    # usada por distintos hilos, aunque nunca por dos a la vez.
+    # cached_statements: cache de sentencias preparadas por conexión; como las
+    # conexiones son de larga vida y el texto de cada consulta es estable, las
+    # consultas frecuentes se preparan una sola vez por conexión
+    if read_only:
+        conn = sqlite3.connect(f"{DB_PATH.resolve().as_uri()}?mode=ro", uri=True,
+                               check_same_thread=False,
+                               cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.execute("PRAGMA query_only = ON")
+    else:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False,
+                               cached_statements=SQLITE_CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    for nombre in ("busy_timeout", "synchronous", "cache_size", "mmap_size", "temp_store"):
+        conn.execute(f"PRAGMA {nombre} = {SQLITE_PRAGMAS[nombre]}")
+    return conn
+
+class ConnectionPool:
+    """Pool acotado de conexiones reutilizables"""
+
+    def __init__(self, factory, max_size=5, timeout=30.0, max_idle=300.0):
+        self._factory = factory
+        self._max_size = max_size
+        self._timeout = timeout
+        self._max_idle = max_idle
+        self._idle = deque()  # (conexión, momento en que se devolvió)
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._size = 0
+        self._stats = {
+            "creadas": 0,
+            "reutilizadas": 0,
+            "descartadas": 0,
+            "esperas": 0,
+        }
+
+    def _is_healthy(self, conn, idle_since):
+        """Comprobar una conexión que estuvo ociosa demasiado tiempo"""
+        if time.monotonic() - idle_since < self._max_idle:
+            return True
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._stats["descartadas"] += 1
+            self._available.notify()
+
+    def acquire(self):
+        """Tomar una conexión del pool, creando una si hay lugar"""
+        deadline = time.monotonic() + self._timeout
+        while True:
+            with self._lock:
+                while not self._idle and self._size >= self._max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("No hay conexiones disponibles en el pool")
+                    self._stats["esperas"] += 1
+                    self._available.wait(remaining)
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+                    conn = None
+
+            if conn is None:
+                try:
+                    conn = self._factory()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._available.notify()
+                    raise
+                with self._lock:
+                    self._stats["creadas"] += 1
+                return conn
+
+            if self._is_healthy(conn, idle_since):
+                with self._lock:
+                    self._stats["reutilizadas"] += 1
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, broken=False):
+        """Devolver una conexión al pool (o descartarla si quedó inutilizable)"""
+        if broken:
+            self._discard(conn)
+            return
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def close_all(self):
+        """Cerrar todas las conexiones ociosas"""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        """Estadísticas del pool"""
+        with self._lock:
+            return {
+                "max_size": self._max_size,
+                "abiertas": self._size,
+                "ociosas": len(self._idle),
+                "en_uso": self._size - len(self._idle),
+                **self._stats,
+            }
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+# SQLite admite un solo escritor a la vez: con una conexión de escritura las
+# escrituras hacen cola en el pool en lugar de competir por el lock del archivo
+DB_WRITE_POOL_SIZE = int(os.getenv('DB_WRITE_POOL_SIZE', '1'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+
+_pool = ConnectionPool(
+    get_db_connection,
+    max_size=DB_WRITE_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+)
+# En modo WAL los lectores no esperan a los escritores
+_read_pool = ConnectionPool(
+    partial(get_db_connection, read_only=True),
+    max_size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+)
+
+# Hilos dedicados a la base de datos: tantos como conexiones en cada pool, así
+# las consultas en exceso esperan en la cola del executor y no bloquean el
+# event loop. Lecturas y escrituras tienen executors separados: las escrituras
+# en cola no ocupan hilos mientras hay conexiones de lectura libres
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+_db_write_executor = ThreadPoolExecutor(
+    max_workers=DB_WRITE_POOL_SIZE, thread_name_prefix="db-escritura"
+)
+
+def get_pool_stats():
+    """Estadísticas de los pools de conexiones"""
+    return {"lectura": _read_pool.stats(), "escritura": _pool.stats()}
+
+def get_sqlite_profile():
+    """Perfil de PRAGMA configurado y modo de journal efectivo"""
+    if not USE_SQLITE:
+        return None
+    with get_db_read() as conn:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    return {
+        "perfil": SQLITE_PROFILE,
+        "pragmas": SQLITE_PRAGMAS,
+        "journal_mode_efectivo": journal_mode,
+    }
 
 @contextmanager
-def get_db():
-    """Context manager para manejo automático de conexiones"""
-    conn = get_db_connection()
+def _checkout(pool):
+    conn = pool.acquire()
     if not conn:
         raise Exception("No se pudo conectar a la base de datos")
     
+    broken = False
     try:
         yield conn
         conn.commit()
-    except Exception as e:
-        conn.rollback()
+    except BaseException as e:
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
         raise e
     finally:
-        conn.close()
+        pool.release(conn, broken=broken)
+
+def get_db():
+    """Context manager para manejo automático de conexiones (de escritura)"""
+    return _checkout(_pool)
+
+def get_db_read():
+    """Context manager con una conexión de sólo lectura"""
+    return _checkout(_read_pool)
+
+# Traducciones de SQL Server a SQLite
+_SQLITE_TRANSLATIONS = (
+    ('GETDATE()', "datetime('now')"),
+    ('IDENTITY(1,1)', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+)
+
+@lru_cache(maxsize=1024)
+def translate_query(query):
+    """Traducir una consulta al dialecto activo (una vez por texto de consulta)"""
+    if USE_SQLITE:
+        for origen, destino in _SQLITE_TRANSLATIONS:
+            query = query.replace(origen, destino)
+    return query
+
+def _es_lectura(query):
+    return query.lstrip()[:6].upper() == 'SELECT'
+
+# Callbacks notificados después de cada execute_query (métricas, log de lentas)
+_observadores_consultas = []
+
+def registrar_observador_consultas(callback):
+    """Registrar callback(query, params, duracion_s, filas, error) para cada execute_query
+
+    query es el texto ya traducido; error es None si la consulta no falló.
+    """
+    _observadores_consultas.append(callback)
+
+@contextmanager
+def sin_observadores_consultas():
+    """Suspender los observadores de execute_query (para medir cuánto cuestan)"""
+    guardados = list(_observadores_consultas)
+    _observadores_consultas.clear()
+    try:
+        yield
+    finally:
+        _observadores_consultas[:] = guardados
 
 def execute_query(query, params=None, fetch_one=False, fetch_all=False):
     """Ejecutar consulta SQL de manera segura"""
+    # Convertir query de SQL Server a SQLite si es necesario
+    query = translate_query(query)
+    if not _observadores_consultas:
+        return _execute_query(query, params, fetch_one, fetch_all)
+    
+    inicio = time.perf_counter()
+    resultado = _execute_query(query, params, fetch_one, fetch_all)
+    duracion = time.perf_counter() - inicio
+    
+    error, filas = None, 0
+    # Los errores vuelven como {"error": mensaje}, también con fetch_one/fetch_all
+    if isinstance(resultado, dict) and resultado.keys() == {'error'}:
+        error = resultado['error']
+    elif fetch_all:
+        filas = len(resultado)
+    elif fetch_one:
+        filas = 0 if resultado is None else 1
+    else:
+        filas = max(resultado.get('rowcount') or 0, 0)
+    _notificar_observadores(query, params, duracion, filas, error)
+    return resultado
+
+def _notificar_observadores(query, params, duracion, filas, error):
+    for callback in _observadores_consultas:
+        try:
+            callback(query, params, duracion, filas, error)
+        except Exception as ex:
+            print(f"Error en observador de consultas: {ex}")
+
+# Nombres de columnas por texto de consulta; la proyección de un SQL fijo no cambia
+_columnas_por_consulta = {}
+
+def execute_query_tuplas(query, params=None):
+    """Variante de lectura de execute_query que devuelve (columnas, filas como tuplas)
+
+    Evita crear un sqlite3.Row y un dict por fila; pensada para listados que
+    se serializan directamente (ver respuestas.py). Los errores vuelven como
+    {"error": mensaje}, igual que en execute_query.
+    """
+    query = translate_query(query)
+    inicio = time.perf_counter()
     try:
-        with get_db() as conn:
+        with get_db_read() as conn:
+            cursor = conn.cursor()
             if USE_SQLITE:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-            else:
-                cursor = conn.cursor()
+                cursor.row_factory = None
+            cursor.execute(query, params or ())
+            columnas = _columnas_por_consulta.get(query)
+            if columnas is None:
+                columnas = tuple(column[0] for column in cursor.description)
+                if len(_columnas_por_consulta) < 1024:
+                    _columnas_por_consulta[query] = columnas
+            resultado = (columnas, cursor.fetchall())
+    except Exception as ex:
+        print(f"Error ejecutando consulta: {ex}")
+        resultado = {"error": str(ex)}
+    if _observadores_consultas:
+        error = resultado['error'] if isinstance(resultado, dict) else None
+        filas = 0 if error is not None else len(resultado[1])
+        _notificar_observadores(query, params, time.perf_counter() - inicio, filas, error)
+    return resultado
+
+def _execute_query(query, params, fetch_one, fetch_all):
+    try:
+        with (get_db_read() if _es_lectura(query) else get_db()) as conn:
+            cursor = conn.cursor()
             
             if params:
-                # Convertir query de SQL Server a SQLite si es necesario
-                if USE_SQLITE:
-                    query = query.replace('GETDATE()', 'datetime("now")')
-                    query = query.replace('IDENTITY(1,1)', 'INTEGER PRIMARY KEY AUTOINCREMENT')
                 cursor.execute(query, params)
             else:
-                if USE_SQLITE:
-                    query = query.replace('GETDATE()', 'datetime("now")')
                 cursor.execute(query)
             
             if fetch_one:
@@ -230,8 +838,43 @@ def execute_query(query, params=None, fetch_one=False, fetch_all=False):
                         return [dict(zip(columns, row)) for row in rows]
                 return []
             
-            return {"success": True}
+            return {
+                "success": True,
+                "lastrowid": getattr(cursor, 'lastrowid', None),
+                "rowcount": cursor.rowcount,
+            }
             
     except Exception as ex:
         print(f"Error ejecutando consulta: {ex}")
-        return {"error": str(ex)}
\ No newline at end of file
+        return {"error": str(ex)}
+
+async def run_in_db_thread(func, *args, **kwargs):
+    """Ejecutar una función bloqueante de lectura en el executor dedicado"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, partial(func, *args, **kwargs))
+
+async def run_in_db_write_thread(func, *args, **kwargs):
+    """Ejecutar una función bloqueante que escribe en el executor de escrituras"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_write_executor, partial(func, *args, **kwargs))
+
+async def run_query_in_db_thread(query, func, *args, **kwargs):
+    """Ejecutar func en el executor de lecturas o de escrituras según la sentencia"""
+    if _es_lectura(query):
+        return await run_in_db_thread(func, *args, **kwargs)
+    return await run_in_db_write_thread(func, *args, **kwargs)
+
+async def run_with_db(func, *args, **kwargs):
+    """Variante awaitable de get_db: ejecuta func(conn, ...) dentro de una transacción"""
+    def _run():
+        with get_db() as conn:
+            return func(conn, *args, **kwargs)
+    return await run_in_db_write_thread(_run)
+
+async def execute_query_async(query, params=None, fetch_one=False, fetch_all=False):
+    """Variante awaitable de execute_query"""
+    return await run_query_in_db_thread(query, execute_query, query, params, fetch_one, fetch_all)
+
+async def execute_query_tuplas_async(query, params=None):
+    """Variante awaitable de execute_query_tuplas"""
+    return await run_in_db_thread(execute_query_tuplas, query, params)
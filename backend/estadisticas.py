@@ -0,0 +1,19 @@
+from database import rebuild_stats_tables
+
+def leer_contadores(cursor):
+    """Leer los contadores materializados como {clave: valor}"""
+    cursor.execute("SELECT clave, valor FROM EstadisticasResumen")
+    return {clave: valor for clave, valor in cursor.fetchall()}
+
+def reconstruir_contadores(conn):
+    """Recalcular los contadores desde cero y reportar la deriva encontrada"""
+    cursor = conn.cursor()
+    antes = leer_contadores(cursor)
+    rebuild_stats_tables(cursor)
+    despues = leer_contadores(cursor)
+    deriva = {
+        clave: {"materializado": antes.get(clave, 0), "real": despues.get(clave, 0)}
+        for clave in sorted(set(antes) | set(despues))
+        if antes.get(clave, 0) != despues.get(clave, 0)
+    }
+    return {"deriva": deriva, "contadores": despues}
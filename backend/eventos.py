@@ -0,0 +1,74 @@
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Acciones publicadas por los handlers de escritura
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+# Cambios masivos (importaciones, scripts): los suscriptores deben recargar todo
+RECARGA = "recarga"
+
+_suscriptores = defaultdict(list)
+
+def suscribir(tabla, callback):
+    """Registrar callback(accion, registro_id, datos) para las escrituras sobre una tabla"""
+    _suscriptores[tabla].append(callback)
+
+def publicar(tabla, accion, registro_id=None, datos=None):
+    """Notificar una escritura ya confirmada a los suscriptores de la tabla"""
+    for callback in _suscriptores.get(tabla, ()):
+        try:
+            callback(accion, registro_id, datos)
+        except Exception as e:
+            # Un suscriptor con fallas no debe afectar la respuesta de la escritura
+            logger.error(f"Error en suscriptor de {tabla}: {e}")
+
+
+class IndiceSincronizado:
+    """Índice en memoria de una tabla: se carga una vez y se mantiene con las escrituras
+
+    leer() trae las filas de la base (bloqueante), construir(filas) arma el
+    índice y aplicar(accion, registro_id, datos) le pasa una escritura ya
+    cargado. Un solo hilo lee la tabla a la vez; los demás esperan su
+    resultado. Mientras no está cargado las escrituras sólo avanzan la
+    generación: si cambió durante la lectura, se vuelve a leer. RECARGA
+    descarta el índice y la próxima consulta lo rearma.
+    """
+
+    def __init__(self, tabla, leer, construir, aplicar):
+        self._leer = leer
+        self._construir = construir
+        self._aplicar = aplicar
+        self._estado_lock = threading.Lock()
+        self._carga_lock = threading.Lock()
+        self._cargado = False
+        self._generacion = 0
+        suscribir(tabla, self._on_escritura)
+
+    def cargado(self):
+        """Indicar si el índice está al día (las consultas no tocan la base)"""
+        return self._cargado
+
+    def cargar(self):
+        """Leer y construir si hace falta (bloqueante: usar fuera del event loop)"""
+        with self._carga_lock:
+            while not self._cargado:
+                with self._estado_lock:
+                    generacion = self._generacion
+                # La construcción va fuera de _estado_lock: las escrituras que
+                # llegan mientras tanto no esperan, sólo avanzan la generación
+                self._construir(self._leer())
+                with self._estado_lock:
+                    if generacion == self._generacion:
+                        self._cargado = True
+
+    def _on_escritura(self, accion, registro_id, datos):
+        with self._estado_lock:
+            if not self._cargado or accion == RECARGA:
+                self._generacion += 1
+                self._cargado = False
+                return
+            self._aplicar(accion, registro_id, datos)
@@ -0,0 +1,130 @@
+import csv
+import io
+import json
+import os
+import threading
+
+from database import get_db_connection
+
+# Filas leídas por vuelta del cursor: la memoria no depende del tamaño de la tabla
+LOTE_EXPORTACION = 500
+# Exportaciones simultáneas: cada una tiene su propia conexión mientras el cliente descarga
+EXPORTACION_MAX_CONCURRENTES = int(os.getenv('EXPORTACION_MAX_CONCURRENTES', '4'))
+
+_exportaciones = threading.BoundedSemaphore(EXPORTACION_MAX_CONCURRENTES)
+
+
+class ExportacionesAgotadas(Exception):
+    """Ya hay EXPORTACION_MAX_CONCURRENTES exportaciones en curso"""
+
+EXPORTACION_MANTENIMIENTOS_QUERY = """
+    SELECT m.id, m.TorreID, t.nombre AS torre_nombre, m.UsuarioTorristaID,
+           m.fecha_inicio_mantenimiento, m.fecha_fin_mantenimiento,
+           m.tipo_mantenimiento, m.descripcion_trabajo, m.notas_mantenimiento,
+           m.costo, m.fecha_registro
+    FROM Mantenimientos m
+    JOIN Torres t ON m.TorreID = t.id
+"""
+
+def iterar_lotes(query, params=()):
+    """Generador de (columnas, lote de tuplas) leyendo con fetchmany
+
+    Usa una conexión de sólo lectura propia, no una del pool: una descarga
+    lenta la retiene todo lo que dure y no debe dejar sin conexiones al resto
+    de las consultas. Se cierra al terminar o si el cliente corta la descarga.
+    El primer lote se entrega siempre, aunque esté vacío, para que los
+    formatos con encabezado lo escriban también cuando no hay filas.
+    """
+    conn = get_db_connection(read_only=True)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        columnas = [columna[0] for columna in cursor.description]
+        filas = cursor.fetchmany(LOTE_EXPORTACION)
+        yield columnas, [tuple(fila) for fila in filas]
+        while filas:
+            filas = cursor.fetchmany(LOTE_EXPORTACION)
+            if filas:
+                yield columnas, [tuple(fila) for fila in filas]
+    finally:
+        conn.close()
+
+def exportar_csv(lotes):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    encabezado = False
+    for columnas, filas in lotes:
+        if not encabezado:
+            writer.writerow(columnas)
+            encabezado = True
+        writer.writerows(filas)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+def exportar_ndjson(lotes):
+    for columnas, filas in lotes:
+        if not filas:
+            continue
+        yield ''.join(
+            json.dumps(dict(zip(columnas, fila)), ensure_ascii=False, default=str) + '\n'
+            for fila in filas
+        ).encode('utf-8')
+
+FORMATOS = {
+    "csv": (exportar_csv, "text/csv; charset=utf-8"),
+    "ndjson": (exportar_ndjson, "application/x-ndjson"),
+}
+
+def exportar_mantenimientos(formato, desde=None, hasta=None):
+    """Generador de bytes con el historial de mantenimientos entre dos fechas (inclusive)
+
+    Lanza ExportacionesAgotadas si ya hay EXPORTACION_MAX_CONCURRENTES en curso.
+    """
+    condiciones, params = [], []
+    if desde:
+        condiciones.append("m.fecha_inicio_mantenimiento >= ?")
+        params.append(desde.isoformat())
+    if hasta:
+        # Comparación textual: todo lo que empiece con la fecha 'hasta' queda incluido
+        condiciones.append("m.fecha_inicio_mantenimiento < ?")
+        params.append(hasta.isoformat() + '~')
+    query = EXPORTACION_MANTENIMIENTOS_QUERY
+    if condiciones:
+        query += " WHERE " + " AND ".join(condiciones)
+    query += " ORDER BY m.fecha_inicio_mantenimiento, m.id"
+
+    generador, _ = FORMATOS[formato]
+    if not _exportaciones.acquire(blocking=False):
+        raise ExportacionesAgotadas()
+    return _Exportacion(generador(iterar_lotes(query, params)))
+
+class _Exportacion:
+    """Iterador de bloques que devuelve su lugar en el cupo al cerrarse
+
+    Se libera al agotarse, ante un error o cuando se descarta sin terminar
+    (cliente que corta, incluso antes del primer bloque): un generador sin
+    arrancar no ejecuta su finally, por eso esto no es un generador.
+    """
+
+    def __init__(self, bloques):
+        self._bloques = bloques
+        self._abierta = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._bloques)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self._abierta:
+            self._abierta = False
+            self._bloques.close()
+            _exportaciones.release()
+
+    __del__ = close
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Generador determinístico de datos sintéticos a escala.
+
+Torres agrupadas alrededor de las ciudades del Chaco (más una fracción rural),
+historiales de mantenimiento con visitas Poisson por torre, fotos opcionales
+en el almacén de blobs y técnicos con DNI único. Escribe directo al esquema
+con inserts por lotes; la misma semilla produce siempre los mismos datos.
+
+    python generador_datos.py --db grande.db --torres 100000 --mantenimientos 1000000 \\
+                              [--tecnicos 20000] [--fotos 0.05] [--semilla 42]
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from geo import KM_PER_DEGREE_LAT
+
+# Filas por executemany
+LOTE_GENERACION = 50000
+
+# (nombre, latitud, longitud, peso ~ población relativa, dispersión en km)
+CIUDADES_CHACO = (
+    ("Resistencia", -27.4514, -58.9867, 290, 9.0),
+    ("Presidencia Roque Sáenz Peña", -26.7852, -60.4388, 100, 6.0),
+    ("Barranqueras", -27.4833, -58.9333, 55, 3.0),
+    ("Fontana", -27.4181, -59.0239, 35, 3.0),
+    ("Villa Ángela", -27.5733, -60.7153, 45, 4.0),
+    ("General San Martín", -26.5374, -59.3416, 30, 4.0),
+    ("Charata", -27.2144, -61.1881, 30, 4.0),
+    ("Juan José Castelli", -25.9468, -60.6200, 25, 4.0),
+    ("Quitilipi", -26.8694, -60.2172, 25, 3.0),
+    ("Machagai", -26.9267, -60.0494, 20, 3.0),
+    ("Las Breñas", -27.0897, -61.0808, 20, 3.0),
+    ("Tres Isletas", -26.3404, -60.4320, 18, 3.0),
+    ("Villa Berthet", -27.2917, -60.4125, 12, 2.5),
+    ("Presidencia de la Plaza", -27.0014, -59.8424, 12, 2.5),
+    ("Pampa del Infierno", -26.5058, -61.1746, 10, 2.5),
+)
+# Rectángulo de la provincia: las torres rurales caen en cualquier punto
+CHACO_BBOX = (-28.0, -24.1, -62.3, -58.3)
+FRACCION_RURAL = 0.15
+
+TIPOS_TORRE = (("torre", 0.45), ("torre_arriestrada", 0.2), ("mastil_amurado", 0.1),
+               ("torreantena", 0.15), ("repetidor", 0.1))
+ESTADOS_TORRE = (("operativa", 0.8), ("mantenimiento", 0.08), ("limitada", 0.07), ("inactiva", 0.05))
+CONVENIOS = (("Policia", 0.5), ("Ecom", 0.35), ("De tercero", 0.15))
+TIPOS_MANTENIMIENTO = (("preventivo", 0.6), ("correctivo", 0.3), ("emergencia", 0.1))
+DESCRIPCIONES = {
+    "preventivo": ("Revisión general de estructura y balizamiento", "Ajuste de riendas y tornillería",
+                   "Limpieza de equipos y control de puesta a tierra"),
+    "correctivo": ("Reemplazo de antena dañada", "Reparación de cableado coaxial",
+                   "Cambio de baliza quemada"),
+    "emergencia": ("Restablecimiento de servicio tras tormenta", "Reparación por descarga atmosférica",
+                   "Reposición de equipo robado"),
+}
+TIPOS_PERSONA = (("POLICIAL", 0.55), ("CIVIL", 0.35), ("CONTRATISTA", 0.1))
+NOMBRES = ("Juan", "Carlos", "José", "Luis", "Miguel", "Ana", "María", "Laura", "Sofía", "Lucía",
+           "Diego", "Pablo", "Martín", "Gabriela", "Valeria", "Ramón", "Héctor", "Silvia")
+APELLIDOS = ("González", "Rodríguez", "Gómez", "Fernández", "López", "Díaz", "Martínez", "Pérez",
+             "Romero", "Sosa", "Benítez", "Acosta", "Ramírez", "Ayala", "Ojeda", "Zalazar")
+# DNIs de técnicos: rango de documentos de adultos
+DNI_MIN, DNI_MAX = 18000000, 46000000
+
+
+def _elegir(rng, opciones, n):
+    """Muestra de n valores según pesos, como array de objetos Python"""
+    valores, pesos = zip(*opciones)
+    indices = rng.choice(len(valores), size=n, p=np.array(pesos) / sum(pesos))
+    return np.array(valores, dtype=object)[indices]
+
+def _fechas_texto(segundos):
+    """Segundos desde epoch -> 'YYYY-MM-DD HH:MM:SS' (vectorizado)"""
+    return np.char.replace(
+        np.datetime_as_string(segundos.astype('datetime64[s]'), unit='s'), 'T', ' '
+    )
+
+def _lotes(filas, tamano=LOTE_GENERACION):
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def _siguiente_id(cursor, tabla):
+    """Primer id libre, respetando sqlite_sequence (AUTOINCREMENT no reutiliza ids)"""
+    maximo = cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabla}").fetchone()[0]
+    secuencia = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (tabla,)).fetchone()
+    return max(maximo, secuencia[0] if secuencia else 0) + 1
+
+
+def generar_torres(rng, n):
+    """Arrays de columnas de n torres: ~85% alrededor de ciudades, el resto rural"""
+    lat_min, lat_max, lon_min, lon_max = CHACO_BBOX
+    rurales = int(round(n * FRACCION_RURAL))
+    urbanas = n - rurales
+
+    pesos = np.array([ciudad[3] for ciudad in CIUDADES_CHACO], dtype=float)
+    ciudad = rng.choice(len(CIUDADES_CHACO), size=urbanas, p=pesos / pesos.sum())
+    centros_lat = np.array([c[1] for c in CIUDADES_CHACO])[ciudad]
+    centros_lon = np.array([c[2] for c in CIUDADES_CHACO])[ciudad]
+    dispersion = np.array([c[4] for c in CIUDADES_CHACO])[ciudad]
+    # Desvío normal en km, convertido a grados según la latitud
+    lat = centros_lat + rng.normal(0, 1, urbanas) * dispersion / KM_PER_DEGREE_LAT
+    lon = centros_lon + rng.normal(0, 1, urbanas) * dispersion / (
+        KM_PER_DEGREE_LAT * np.cos(np.radians(centros_lat)))
+
+    lat = np.concatenate([lat, rng.uniform(lat_min, lat_max, rurales)])
+    lon = np.concatenate([lon, rng.uniform(lon_min, lon_max, rurales)])
+    urbana = np.concatenate([np.ones(urbanas, bool), np.zeros(rurales, bool)])
+    ciudad = np.concatenate([ciudad, np.full(rurales, -1)])
+    # Mezclar para que las ciudades no queden en bloques contiguos de ids
+    orden = rng.permutation(n)
+    lat, lon, urbana, ciudad = lat[orden], lon[orden], urbana[orden], ciudad[orden]
+    # Índice -1 = último nombre = zona rural
+    nombres = np.array([c[0] for c in CIUDADES_CHACO] + ["Zona rural"], dtype=object)
+
+    tipo = _elegir(rng, TIPOS_TORRE, n)
+    # Las torres rurales cubren más distancia
+    alcance = np.where(urbana, rng.uniform(5, 20, n), rng.uniform(15, 45, n)).round(2)
+    return {
+        "latitud": np.clip(lat, lat_min, lat_max).round(6),
+        "longitud": np.clip(lon, lon_min, lon_max).round(6),
+        "ciudad": nombres[ciudad],
+        "tipo": tipo,
+        "estado": _elegir(rng, ESTADOS_TORRE, n),
+        "convenio": _elegir(rng, CONVENIOS, n),
+        "alcance": alcance,
+        "frecuencia": (rng.integers(1360, 1740, n) / 10).round(1),
+    }
+
+def generar_visitas(rng, n_torres, n_mantenimientos, desde, hasta):
+    """Visitas por torre ~ Poisson con media n_mantenimientos / n_torres
+
+    La tasa de cada torre se sortea de una gamma (unas se visitan más que
+    otras); dada la cantidad, las fechas de un proceso de Poisson son uniformes
+    en el período. Devuelve (índice de torre, segundos) ordenados por torre y fecha.
+    """
+    tasa = n_mantenimientos / max(n_torres, 1)
+    # Cada torre tiene su propia tasa: algunas se visitan bastante más que otras
+    tasas = rng.gamma(4.0, tasa / 4.0, n_torres)
+    visitas = rng.poisson(tasas)
+    torre = np.repeat(np.arange(n_torres), visitas)
+    inicio = np.datetime64(desde, 's').astype(np.int64)
+    fin = np.datetime64(hasta, 's').astype(np.int64)
+    # Horario laboral: 7 a 19 hs, fechas en segundos redondeadas a 5 minutos
+    dias = rng.integers(0, (fin - inicio) // 86400, torre.size)
+    segundos = inicio + dias * 86400 + rng.integers(7 * 12, 19 * 12, torre.size) * 300
+    orden = np.lexsort((segundos, torre))
+    return torre[orden], segundos[orden]
+
+def generar(db_path, torres=10000, mantenimientos=100000, tecnicos=2000, usuarios=20,
+            fotos=0.0, semilla=42, desde="2019-01-01", hasta="2025-01-01", salida=sys.stdout):
+    """Cargar datos sintéticos en db_path (se crea si no existe) y devolver las cantidades"""
+    from database import init_sqlite_db, apply_migrations
+
+    rng = np.random.default_rng(semilla)
+    nueva = not Path(db_path).exists()
+    if nueva:
+        init_sqlite_db(db_path)
+    conn = sqlite3.connect(db_path)
+    # Carga masiva: sin fsync por transacción (si se corta, se regenera)
+    conn.execute("PRAGMA synchronous = OFF")
+    if not nueva:
+        # Base existente: esquema al día, los triggers mantienen R*Tree y contadores
+        apply_migrations(conn)
+    cursor = conn.cursor()
+    conteo = {}
+
+    # --- Usuarios torristas (responsables de los mantenimientos) ---
+    usuario_inicial = _siguiente_id(cursor, "USUARIOTORRISTA")
+    dnis_usados = {fila[0] for fila in cursor.execute(
+        "SELECT norDni FROM USUARIOTORRISTA WHERE norDni IS NOT NULL")}
+    dnis_usuarios = _dnis_unicos(rng, usuarios, dnis_usados)
+    cursor.executemany(
+        "INSERT INTO USUARIOTORRISTA (id, userCreaRepo, fechaAlta, nombre, apellido, norDni, "
+        "tipoPersona, rol, activo) VALUES (?, 1, ?, ?, ?, ?, 1, 2, 1)",
+        ((usuario_inicial + i, desde, str(rng.choice(NOMBRES)), str(rng.choice(APELLIDOS)), int(dni))
+         for i, dni in enumerate(dnis_usuarios))
+    )
+    ids_usuarios = np.arange(usuario_inicial, usuario_inicial + usuarios)
+    conteo['usuarios'] = usuarios
+
+    # --- Torres ---
+    torre_inicial = _siguiente_id(cursor, "Torres")
+    datos = generar_torres(rng, torres)
+    ids_torres = np.arange(torre_inicial, torre_inicial + torres)
+    torre_visitas, segundos = generar_visitas(rng, torres, mantenimientos, desde, hasta)
+    # Fecha del último mantenimiento de cada torre (las visitas vienen ordenadas)
+    ultima = np.full(torres, None, dtype=object)
+    if torre_visitas.size:
+        ultimos = np.r_[np.nonzero(np.diff(torre_visitas))[0], torre_visitas.size - 1]
+        ultima[torre_visitas[ultimos]] = _fechas_texto(segundos[ultimos]).astype('U10')
+    creadores = rng.choice(ids_usuarios, torres).tolist() if usuarios else [1] * torres
+    filas = zip(
+        ids_torres.tolist(),
+        (f"{tipo.replace('_', ' ').capitalize()} {ciudad} {i}" for i, (tipo, ciudad) in
+         enumerate(zip(datos['tipo'], datos['ciudad']), start=torre_inicial)),
+        datos['tipo'].tolist(),
+        (f"{'Ruta' if ciudad == 'Zona rural' else 'Calle'} {km}, {ciudad}" for km, ciudad in
+         zip(rng.integers(1, 1200, torres).tolist(), datos['ciudad'])),
+        datos['latitud'].tolist(), datos['longitud'].tolist(), datos['estado'].tolist(),
+        datos['alcance'].tolist(), ultima.tolist(),
+        (f"{mhz} MHz" for mhz in datos['frecuencia'].tolist()),
+        datos['convenio'].tolist(), creadores, creadores,
+    )
+    for lote in _lotes(filas):
+        cursor.executemany(
+            "INSERT INTO Torres (id, nombre, tipo, direccion, latitud, longitud, estado, "
+            "alcance_km, fecha_ultimo_mantenimiento, frecuencia_mhz, tipo_convenio, "
+            "UsuarioCreadorID, UsuarioActualizadorID) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            lote
+        )
+    conteo['torres'] = torres
+
+    # --- Mantenimientos ---
+    n_visitas = torre_visitas.size
+    mantenimiento_inicial = _siguiente_id(cursor, "Mantenimientos")
+    tipos = _elegir(rng, TIPOS_MANTENIMIENTO, n_visitas)
+    variante = rng.integers(0, 3, n_visitas)
+    # Duración de 1 a 8 hs; las emergencias pueden no tener cierre registrado
+    fin = segundos + rng.integers(12, 96, n_visitas) * 300
+    sin_cierre = (tipos == "emergencia") & (rng.random(n_visitas) < 0.2)
+    fechas_fin = _fechas_texto(fin).astype(object)
+    fechas_fin[sin_cierre] = None
+    # Costo lognormal, más caro para correctivos y emergencias
+    factor = np.select([tipos == "correctivo", tipos == "emergencia"], [2.5, 4.0], 1.0)
+    costo = (rng.lognormal(10, 0.6, n_visitas) * factor).round(2)
+    filas = zip(
+        range(mantenimiento_inicial, mantenimiento_inicial + n_visitas),
+        ids_torres[torre_visitas].tolist(),
+        (rng.choice(ids_usuarios, n_visitas) if usuarios else np.ones(n_visitas, int)).tolist(),
+        _fechas_texto(segundos).tolist(),
+        fechas_fin.tolist(),
+        tipos.tolist(),
+        (DESCRIPCIONES[tipo][v] for tipo, v in zip(tipos, variante.tolist())),
+        costo.tolist(),
+    )
+    for lote in _lotes(filas):
+        cursor.executemany(
+            "INSERT INTO Mantenimientos (id, TorreID, UsuarioTorristaID, fecha_inicio_mantenimiento, "
+            "fecha_fin_mantenimiento, tipo_mantenimiento, descripcion_trabajo, costo, fecha_registro) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((*fila, fila[4] or fila[3]) for fila in lote)
+        )
+    conteo['mantenimientos'] = n_visitas
+
+    # --- Técnicos intervinientes ---
+    dnis_usados = {fila[0] for fila in cursor.execute("SELECT dni FROM TECNICOINTERVINIENTE")}
+    dnis_tecnicos = _dnis_unicos(rng, tecnicos, dnis_usados)
+    tipo_persona = _elegir(rng, TIPOS_PERSONA, tecnicos)
+    alta = np.datetime64(desde, 's').astype(np.int64) + rng.integers(0, 5 * 365, tecnicos) * 86400
+    activo = rng.random(tecnicos) < 0.9
+    filas = zip(
+        rng.choice(NOMBRES, tecnicos).tolist(), rng.choice(APELLIDOS, tecnicos).tolist(),
+        dnis_tecnicos.tolist(), rng.choice(ids_torres, tecnicos).tolist() if torres else [None] * tecnicos,
+        tipo_persona.tolist(),
+        (int(legajo) if tipo == "POLICIAL" else None
+         for tipo, legajo in zip(tipo_persona, rng.integers(10000, 99999, tecnicos))),
+        (int(legajo) if tipo != "POLICIAL" else None
+         for tipo, legajo in zip(tipo_persona, rng.integers(10000, 99999, tecnicos))),
+        _fechas_texto(alta).tolist(), activo.astype(int).tolist(),
+    )
+    for lote in _lotes(filas):
+        cursor.executemany(
+            "INSERT INTO TECNICOINTERVINIENTE (nombre, apellido, dni, TorreID, tipoPersona, "
+            "idPersonalPolicial, idPersonalCivil, fechaAlta, usuarioAlta, activo) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)",
+            lote
+        )
+    conteo['tecnicos'] = tecnicos
+    conn.commit()
+
+    if nueva:
+        # Índices, R*Tree y contadores se construyen una sola vez sobre los datos cargados
+        apply_migrations(conn)
+    if fotos > 0 and n_visitas:
+        conteo['fotos'] = _generar_fotos(conn, rng, mantenimiento_inicial, n_visitas, fotos)
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"Generados: {conteo}", file=salida)
+    return conteo
+
+def _dnis_unicos(rng, n, usados):
+    """n DNIs distintos entre sí y de los ya cargados"""
+    dnis = np.empty(0, dtype=np.int64)
+    while dnis.size < n:
+        faltan = n - dnis.size
+        candidatos = rng.choice(DNI_MAX - DNI_MIN, size=faltan + len(usados) // 100 + 16,
+                                replace=False) + DNI_MIN
+        candidatos = candidatos[~np.isin(candidatos, list(usados) or [-1])]
+        candidatos = candidatos[~np.isin(candidatos, dnis)]
+        dnis = np.concatenate([dnis, candidatos[:faltan]])
+    return dnis
+
+# Imágenes distintas en el almacén: las fotos se reparten entre ellas
+# (el almacén deduplica por contenido, así el disco no crece con los mantenimientos)
+FOTOS_DISTINTAS = 64
+TAMANO_FOTO = 32 * 1024
+
+def _generar_fotos(conn, rng, mantenimiento_inicial, n_visitas, proporcion):
+    """Vincular de 1 a 4 fotos a una proporción de los mantenimientos"""
+    import blobs
+
+    cabecera_jpeg = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+    hashes = [
+        blobs.guardar_bytes(conn, cabecera_jpeg + rng.bytes(TAMANO_FOTO), 'image/jpeg')['sha256']
+        for _ in range(FOTOS_DISTINTAS)
+    ]
+    con_fotos = np.nonzero(rng.random(n_visitas) < proporcion)[0] + mantenimiento_inicial
+    cantidades = rng.integers(1, 5, con_fotos.size)
+    elegidas = rng.integers(0, FOTOS_DISTINTAS, int(cantidades.sum()))
+    filas = zip(
+        np.repeat(con_fotos, cantidades).tolist(),
+        (posicion for cantidad in cantidades.tolist() for posicion in range(1, cantidad + 1)),
+        (hashes[i] for i in elegidas.tolist()),
+    )
+    for lote in _lotes(filas):
+        conn.executemany(
+            "INSERT OR REPLACE INTO MantenimientoImagenes (MantenimientoID, posicion, sha256) "
+            "VALUES (?, ?, ?)", lote
+        )
+    conn.commit()
+    return int(cantidades.sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", required=True, help="Archivo SQLite (se crea si no existe)")
+    parser.add_argument("--torres", type=int, default=10000)
+    parser.add_argument("--mantenimientos", type=int, default=100000,
+                        help="Cantidad esperada (la real sigue la distribución de Poisson)")
+    parser.add_argument("--tecnicos", type=int, default=2000)
+    parser.add_argument("--usuarios", type=int, default=20)
+    parser.add_argument("--fotos", type=float, default=0.0, help="Proporción de mantenimientos con fotos")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--desde", default="2019-01-01")
+    parser.add_argument("--hasta", default="2025-01-01")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    conteo = generar(args.db, args.torres, args.mantenimientos, args.tecnicos, args.usuarios,
+                     args.fotos, args.semilla, args.desde, args.hasta)
+    total = sum(conteo.values())
+    duracion = time.perf_counter() - inicio
+    print(f"{total} filas en {duracion:.1f} s ({total / duracion:.0f} filas/s)")
+
+if __name__ == "__main__":
+    main()
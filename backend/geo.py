@@ -0,0 +1,37 @@
+import math
+
+# Radio medio de la Tierra
+EARTH_RADIUS_KM = 6371.0088
+# Derivado del mismo radio que haversine_km: si no, los prefiltros por rectángulo
+# quedan chicos y pierden torres que la distancia exacta ubica dentro del radio
+KM_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distancia en km sobre la esfera entre dos puntos (grados)"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def bbox_for_radius(lat, lon, radio_km):
+    """Rectángulo (lat_min, lat_max, lon_min, lon_max) que contiene el círculo dado
+
+    El ancho en longitud es el exacto de la esfera (asin(sen δ / cos φ)),
+    algo mayor que radio / (km por grado · cos φ). Si el círculo toca un polo
+    se toman todas las longitudes.
+    """
+    delta = radio_km / EARTH_RADIUS_KM
+    dlat = math.degrees(delta)
+    lat_min, lat_max = lat - dlat, lat + dlat
+    if lat_min <= -90.0 or lat_max >= 90.0 or delta >= math.pi / 2:
+        dlon = 180.0
+    else:
+        dlon = math.degrees(math.asin(min(1.0, math.sin(delta) / math.cos(math.radians(lat)))))
+    return (
+        max(lat_min, -90.0),
+        min(lat_max, 90.0),
+        lon - dlon,
+        lon + dlon,
+    )
@@ -0,0 +1,144 @@
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+
+from database import get_db
+from models import TorreCreate
+
+# Filas por transacción de executemany
+LOTE_IMPORTACION = 1000
+# Máximo de errores detallados en la respuesta (el total siempre se informa)
+MAX_ERRORES_DETALLADOS = 1000
+
+INSERT_TORRE_QUERY = """
+    INSERT INTO Torres
+    (nombre, tipo, direccion, latitud, longitud, estado, alcance_km,
+     fecha_ultimo_mantenimiento, frecuencia_mhz, notas, tipo_convenio,
+     UsuarioCreadorID, UsuarioActualizadorID, fecha_creacion, fecha_actualizacion)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+"""
+
+
+class ImportacionError(ValueError):
+    """El archivo no tiene un formato reconocible"""
+
+
+def detectar_formato(content_type, cuerpo):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    if content_type == 'application/geo+json':
+        return 'geojson'
+    inicio = cuerpo.lstrip()[:1]
+    if inicio == b'[':
+        return 'json'
+    if inicio == b'{':
+        return 'geojson'
+    return 'csv'
+
+def filas_csv(cuerpo):
+    lector = csv.DictReader(io.StringIO(cuerpo.decode('utf-8-sig')))
+    for fila in lector:
+        # Celdas vacías = campo no informado
+        yield {clave.strip(): (valor if valor != '' else None)
+               for clave, valor in fila.items() if clave}
+
+def filas_json(cuerpo):
+    datos = json.loads(cuerpo)
+    if not isinstance(datos, list):
+        raise ImportacionError("Se esperaba un array JSON de torres")
+    yield from datos
+
+def filas_geojson(cuerpo):
+    datos = json.loads(cuerpo)
+    if not isinstance(datos, dict) or datos.get('type') != 'FeatureCollection':
+        raise ImportacionError("Se esperaba un FeatureCollection GeoJSON")
+    for feature in datos.get('features') or []:
+        fila = dict((feature or {}).get('properties') or {})
+        geometria = (feature or {}).get('geometry') or {}
+        if geometria.get('type') == 'Point':
+            coordenadas = geometria.get('coordinates') or []
+            if len(coordenadas) >= 2:
+                fila['longitud'], fila['latitud'] = coordenadas[0], coordenadas[1]
+        yield fila
+
+LECTORES = {
+    'csv': filas_csv,
+    'json': filas_json,
+    'geojson': filas_geojson,
+}
+
+def validar_filas(filas):
+    """Generador de (número de fila, parámetros del INSERT | None, errores)"""
+    for numero, fila in enumerate(filas, start=1):
+        try:
+            if not isinstance(fila, dict):
+                raise ImportacionError("La fila no es un objeto")
+            torre = TorreCreate(**fila)
+        except ValidationError as e:
+            errores = [
+                f"{'.'.join(str(parte) for parte in error['loc'])}: {error['msg']}"
+                for error in e.errors()
+            ]
+            yield numero, None, errores
+            continue
+        except (ImportacionError, TypeError) as e:
+            yield numero, None, [str(e)]
+            continue
+        yield numero, (
+            torre.nombre, torre.tipo, torre.direccion, torre.latitud,
+            torre.longitud, torre.estado, torre.alcance_km,
+            torre.fecha_ultimo_mantenimiento, torre.frecuencia_mhz,
+            torre.notas, torre.tipo_convenio, torre.UsuarioCreadorID,
+            torre.UsuarioActualizadorID
+        ), None
+
+def _insertar_lote(conn, lote, errores):
+    """Insertar un lote en una transacción; si falla, aislar las filas problemáticas"""
+    try:
+        conn.executemany(INSERT_TORRE_QUERY, [params for _, params in lote])
+        conn.commit()
+        return len(lote)
+    except Exception:
+        conn.rollback()
+
+    insertadas = 0
+    for numero, params in lote:
+        try:
+            conn.execute(INSERT_TORRE_QUERY, params)
+            conn.commit()
+            insertadas += 1
+        except Exception as e:
+            conn.rollback()
+            errores.append({"fila": numero, "errores": [str(e)]})
+    return insertadas
+
+def importar_torres(cuerpo, formato):
+    """Validar e insertar torres en lotes; las filas inválidas no abortan el resto"""
+    filas = LECTORES[formato](cuerpo)
+    errores = []
+    total = 0
+    insertadas = 0
+    lote = []
+    with get_db() as conn:
+        for numero, params, errores_fila in validar_filas(filas):
+            total += 1
+            if errores_fila:
+                errores.append({"fila": numero, "errores": errores_fila})
+                continue
+            lote.append((numero, params))
+            if len(lote) >= LOTE_IMPORTACION:
+                insertadas += _insertar_lote(conn, lote, errores)
+                lote = []
+        if lote:
+            insertadas += _insertar_lote(conn, lote, errores)
+
+    errores.sort(key=lambda error: error['fila'])
+    return {
+        "total": total,
+        "insertadas": insertadas,
+        "con_errores": len(errores),
+        "errores": errores[:MAX_ERRORES_DETALLADOS],
+    }
@@ -0,0 +1,250 @@
+import bisect
+import re
+import threading
+import time
+from functools import lru_cache
+
+import consultas
+from auth import get_hash_queue_depth
+from database import get_pool_stats, registrar_observador_consultas
+
+# Formato de exposición de texto de Prometheus (versión 0.0.4)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+BUCKETS_HTTP = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_DB = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_metricas = []
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _etiquetas(nombres, valores, extra=''):
+    partes = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = 'untyped'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}
+        _metricas.append(self)
+
+    def _encabezado(self):
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+
+    def exponer(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        return self._encabezado() + [
+            f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}"
+            for clave, valor in valores
+        ]
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, *etiquetas, valor=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+
+class Medidor(_Metrica):
+    """Gauge; con funcion= el valor se lee al exponer (sin costo en el camino caliente)
+
+    funcion devuelve un número o, si hay etiquetas, {tupla de etiquetas: número}.
+    """
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._funcion = funcion
+
+    def inc(self, *etiquetas, valor=1):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def dec(self, *etiquetas, valor=1):
+        self.inc(*etiquetas, valor=-valor)
+
+    def exponer(self):
+        if self._funcion is not None:
+            valores = self._funcion()
+            with self._lock:
+                self._valores = valores if isinstance(valores, dict) else {(): valores}
+        return super().exponer()
+
+
+class ContadorFuncion(Medidor):
+    """Counter cuyo valor mantiene otro componente (p. ej. las estadísticas del pool)"""
+    tipo = 'counter'
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_HTTP):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(buckets)
+
+    def observar(self, valor, *etiquetas):
+        # Conteo por bucket no acumulado; se acumula recién al exponer
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._valores.get(etiquetas)
+            if serie is None:
+                serie = self._valores[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def exponer(self):
+        with self._lock:
+            valores = [(clave, list(conteos), suma) for clave, (conteos, suma) in self._valores.items()]
+        lineas = self._encabezado()
+        for clave, conteos, suma in valores:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float('inf'),), conteos):
+                acumulado += conteo
+                etiquetas = _etiquetas(self.etiquetas, clave, f'le="{_numero(float(limite))}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {acumulado}")
+        return lineas
+
+
+def exponer():
+    """Todas las métricas registradas en formato de texto de Prometheus"""
+    lineas = []
+    for metrica in _metricas:
+        lineas.extend(metrica.exponer())
+    return '\n'.join(lineas) + '\n'
+
+
+# =================== MÉTRICAS HTTP ===================
+
+http_duracion = Histograma(
+    "torres_http_request_duration_seconds", "Duración de las peticiones HTTP",
+    ("method", "route", "status"), BUCKETS_HTTP
+)
+http_en_curso = Medidor(
+    "torres_http_requests_in_flight", "Peticiones HTTP en curso", ("method",)
+)
+
+class MetricasMiddleware:
+    """Middleware ASGI: latencia por ruta/método/estado y peticiones en curso
+
+    La ruta es la plantilla (/api/torres/{torre_id}), no la URL, para acotar
+    la cantidad de series; las URLs sin ruta se agrupan en "sin_ruta".
+    """
+
+    # Apagado sólo para medir el costo del propio middleware (bench_api --sin-metricas)
+    activo = True
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not MetricasMiddleware.activo:
+            await self.app(scope, receive, send)
+            return
+
+        metodo = scope["method"]
+        estado = 500
+
+        async def send_con_estado(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        http_en_curso.inc(metodo)
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_con_estado)
+        finally:
+            duracion = time.perf_counter() - inicio
+            http_en_curso.dec(metodo)
+            ruta = scope.get("route")
+            http_duracion.observar(duracion, metodo, ruta.path if ruta else "sin_ruta", str(estado))
+
+
+# =================== MÉTRICAS DE BASE DE DATOS ===================
+
+db_duracion = Histograma(
+    "torres_db_query_duration_seconds", "Duración de execute_query por sentencia",
+    ("query",), BUCKETS_DB
+)
+db_filas = Contador("torres_db_rows_total", "Filas devueltas o afectadas por sentencia", ("query",))
+db_errores = Contador("torres_db_query_errors_total", "Consultas con error por sentencia", ("query",))
+
+_VERBO = re.compile(r'\s*(\w+)\s+([\w"]+)')
+_TABLA = re.compile(r'\b(?:FROM|INTO)\s+([\w"]+)', re.IGNORECASE)
+
+@lru_cache(maxsize=1024)
+def etiqueta_consulta(sql):
+    """Nombre de la sentencia registrada o 'verbo:tabla' para el SQL ad hoc"""
+    nombre = consultas.nombre_consulta(sql)
+    if nombre:
+        return nombre
+    verbo = _VERBO.match(sql)
+    if not verbo:
+        return "otra"
+    if verbo.group(1).upper() == 'UPDATE':
+        tabla = verbo.group(2)
+    else:
+        tabla = _TABLA.search(sql)
+        if not tabla:
+            return verbo.group(1).lower()
+        tabla = tabla.group(1)
+    tabla = tabla.strip('"')
+    return f"{verbo.group(1).lower()}:{tabla}"
+
+def _on_consulta(query, params, duracion, filas, error):
+    etiqueta = etiqueta_consulta(query)
+    db_duracion.observar(duracion, etiqueta)
+    if filas:
+        db_filas.inc(etiqueta, valor=filas)
+    if error is not None:
+        db_errores.inc(etiqueta)
+
+def _stats_pools(campo):
+    return {(pool,): stats[campo] for pool, stats in get_pool_stats().items()}
+
+def _conexiones_cerradas():
+    return {(pool,): stats["creadas"] - stats["abiertas"] for pool, stats in get_pool_stats().items()}
+
+ContadorFuncion("torres_db_connections_opened_total", "Conexiones abiertas por pool",
+                ("pool",), lambda: _stats_pools("creadas"))
+ContadorFuncion("torres_db_connections_closed_total", "Conexiones cerradas por pool",
+                ("pool",), _conexiones_cerradas)
+Medidor("torres_db_connections_in_use", "Conexiones prestadas por pool",
+        ("pool",), lambda: _stats_pools("en_uso"))
+ContadorFuncion("torres_db_pool_waits_total", "Esperas por una conexión libre",
+                ("pool",), lambda: _stats_pools("esperas"))
+
+
+# =================== OTRAS ===================
+
+Medidor("torres_bcrypt_queue_depth", "Operaciones bcrypt pendientes en el pool de procesos",
+        funcion=get_hash_queue_depth)
+
+
+def instalar(app):
+    """Agregar el middleware y empezar a observar execute_query"""
+    app.add_middleware(MetricasMiddleware)
+    registrar_observador_consultas(_on_consulta)
@@ -82,6 +82,19 @@ class TecnicoInterviniente(TecnicoIntervinienteBase):
     usuarioBaja: Optional[int] = None
     activo: bool = True
 
+# Modelos para Planificación de Rutas
+class RutaRequest(BaseModel):
+    base: Optional[str] = None  # 'resistencia', 'saenz_pena'; o latitud/longitud
+    latitud: Optional[float] = Field(None, ge=-90, le=90)
+    longitud: Optional[float] = Field(None, ge=-180, le=180)
+    torre_ids: Optional[List[int]] = None  # sin ids se eligen por estado/fecha
+    estados: List[str] = ['mantenimiento', 'limitada']
+    dias_sin_mantenimiento: Optional[int] = Field(365, ge=1)
+    radio_km: float = Field(150.0, gt=0, le=1000)
+    max_paradas: int = Field(500, ge=1, le=2000)
+    tiempo_limite_ms: int = Field(1000, ge=10, le=30000)
+    regreso: bool = True
+
 # Modelos para Usuarios
 class UsuarioBase(BaseModel):
     nombre: str
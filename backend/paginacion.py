@@ -0,0 +1,105 @@
+import base64
+import json
+
+from fastapi import HTTPException
+
+from database import USE_SQLITE
+
+def seleccionar_campos(fields, disponibles, por_defecto):
+    """Validar el parámetro fields= (separado por comas) contra las columnas disponibles"""
+    if not fields:
+        return list(por_defecto)
+    pedidos = [campo.strip() for campo in fields.split(',') if campo.strip()]
+    invalidos = [campo for campo in pedidos if campo not in disponibles]
+    if invalidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos desconocidos: {', '.join(invalidos)}"
+        )
+    return list(dict.fromkeys(pedidos))
+
+def codificar_cursor(valores):
+    """Cursor opaco con los valores de orden de la última fila devuelta"""
+    data = json.dumps(valores, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def decodificar_cursor(cursor, cantidad):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valores = json.loads(data)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(valores, list) or len(valores) != cantidad:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return valores
+
+def construir_consulta(disponibles, campos, desde, orden, condiciones=None, params=None,
+                       descendente=False, limit=None, after=None):
+    """Armar un SELECT con proyección y paginación por keyset
+
+    disponibles: {campo: expresión SQL}; orden: campos que identifican
+    unívocamente cada fila, en orden de prioridad (el último suele ser id).
+    Devuelve (sql, params, columnas_extra), donde columnas_extra son los
+    campos de orden agregados sólo para calcular el próximo cursor.
+    """
+    condiciones = list(condiciones or [])
+    params = list(params or [])
+    extra = [campo for campo in orden if campo not in campos]
+    select = ', '.join(f"{disponibles[campo]} AS {campo}" for campo in campos + extra)
+
+    if after:
+        valores = decodificar_cursor(after, len(orden))
+        comparador = '<' if descendente else '>'
+        if USE_SQLITE or len(orden) == 1:
+            # Comparación de filas (SQLite >= 3.15): el planificador la usa como
+            # límite del índice (SEARCH) en vez de recorrerlo hasta el cursor
+            columnas = ', '.join(disponibles[campo] for campo in orden)
+            marcas = ', '.join('?' * len(orden))
+            condiciones.append(f"({columnas}) {comparador} ({marcas})")
+            params.extend(valores)
+        else:
+            # SQL Server no tiene comparación de filas:
+            # (a, b) > (x, y)  ==>  a > x OR (a = x AND b > y)
+            alternativas = []
+            for i, campo in enumerate(orden):
+                partes = [f"{disponibles[previo]} = ?" for previo in orden[:i]]
+                partes.append(f"{disponibles[campo]} {comparador} ?")
+                alternativas.append('(' + ' AND '.join(partes) + ')')
+                params.extend(valores[:i + 1])
+            condiciones.append('(' + ' OR '.join(alternativas) + ')')
+
+    sql = f"SELECT {select} FROM {desde}"
+    if condiciones:
+        sql += " WHERE " + ' AND '.join(condiciones)
+    direccion = ' DESC' if descendente else ''
+    sql += " ORDER BY " + ', '.join(f"{disponibles[campo]}{direccion}" for campo in orden)
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params, extra
+
+def preparar_pagina(filas, orden, extra, limit):
+    """Calcular el cursor siguiente y quitar los campos que no se pidieron"""
+    siguiente = None
+    if limit and len(filas) == limit:
+        ultima = filas[-1]
+        siguiente = codificar_cursor([ultima[campo] for campo in orden])
+    if extra:
+        for fila in filas:
+            for campo in extra:
+                fila.pop(campo, None)
+    return filas, siguiente
+
+def preparar_pagina_tuplas(columnas, filas, orden, extra, limit):
+    """Igual que preparar_pagina para filas en tuplas; devuelve (columnas visibles, cursor)
+
+    Las columnas extra van al final del SELECT, así que basta con no
+    nombrarlas: al armar cada objeto se descartan sin copiar la fila.
+    """
+    siguiente = None
+    if limit and len(filas) == limit:
+        ultima = filas[-1]
+        siguiente = codificar_cursor([ultima[columnas.index(campo)] for campo in orden])
+    if extra:
+        columnas = columnas[:len(columnas) - len(extra)]
+    return columnas, siguiente
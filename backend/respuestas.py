@@ -0,0 +1,65 @@
+import json
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # opcional: sin orjson se usa json de la biblioteca estándar
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Cabeceras de la respuesta temporal de FastAPI que no se copian a la final
+_CABECERAS_PROPIAS = {'content-length', 'content-type'}
+
+
+def avisar_serializador():
+    """Avisar al iniciar si los listados se serializan sin orjson (bastante más lento)"""
+    if orjson is None:
+        logger.warning("orjson no está instalado: los listados se serializan con json de la biblioteca estándar")
+
+def _por_defecto(valor):
+    # Decimal y datetime llegan de SQL Server (pyodbc): igual que jsonable_encoder de
+    # FastAPI, Decimal sin decimales como entero y fechas en ISO 8601; el resto como texto
+    if isinstance(valor, Decimal):
+        return int(valor) if valor.as_tuple().exponent >= 0 else float(valor)
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    return str(valor)
+
+def codificar(datos):
+    """JSON compacto en bytes (mismo formato que JSONResponse de FastAPI)"""
+    if orjson is not None:
+        return orjson.dumps(datos, default=_por_defecto)
+    return json.dumps(
+        datos, ensure_ascii=False, allow_nan=False, separators=(',', ':'), default=_por_defecto
+    ).encode('utf-8')
+
+def codificar_filas(columnas, filas):
+    """Lista de objetos JSON a partir de tuplas con nombres de columna compartidos
+
+    Si hay más valores que columnas, los sobrantes se ignoran (zip corta en la
+    más corta): así se descartan las columnas extra de orden de la paginación.
+    """
+    return codificar([dict(zip(columnas, fila)) for fila in filas])
+
+
+class JSONCrudo(Response):
+    """Respuesta con un cuerpo JSON ya codificado en bytes"""
+    media_type = "application/json"
+
+
+def respuesta_filas(response, columnas, filas):
+    """Respuesta final para filas de la base, sin pasar por la validación de Pydantic
+
+    Las filas provienen de consultas propias, así que no se revalidan. Se
+    conservan las cabeceras ya puestas en el Response inyectado (ETag, cursor).
+    """
+    headers = {
+        clave: valor for clave, valor in response.headers.items()
+        if clave not in _CABECERAS_PROPIAS
+    }
+    return JSONCrudo(codificar_filas(columnas, filas), headers=headers)
@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geo import EARTH_RADIUS_KM
+
+# Bases de las cuadrillas: nombre para la API -> (latitud, longitud, descripción)
+BASES = {
+    "resistencia": (-27.4514, -58.9867, "Resistencia"),
+    "saenz_pena": (-26.7852, -60.4388, "Presidencia Roque Sáenz Peña"),
+}
+RUTAS_WORKERS = int(os.getenv('RUTAS_WORKERS', str(os.cpu_count() or 1)))
+# Hasta cuántas paradas (sin contar la base) se prueban todos los órdenes: 7! = 5040
+RUTAS_EXACTO_MAX = int(os.getenv('RUTAS_EXACTO_MAX', '7'))
+
+# Mejora mínima (km) para aceptar un movimiento; evita ciclos por redondeo
+EPSILON_KM = 1e-9
+
+
+def matriz_haversine(lat, lon):
+    """Distancias en km entre todos los pares de puntos (vectorizado)"""
+    phi = np.radians(np.asarray(lat, dtype=np.float64))
+    lam = np.radians(np.asarray(lon, dtype=np.float64))
+    dphi = phi[:, None] - phi[None, :]
+    dlam = lam[:, None] - lam[None, :]
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi)[:, None] * np.cos(phi)[None, :] * np.sin(dlam / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def largo_recorrido(distancias, recorrido):
+    """Largo del circuito cerrado (vuelve al primer punto)"""
+    return float(distancias[recorrido, np.roll(recorrido, -1)].sum())
+
+def vecino_mas_cercano(distancias, inicio=0):
+    """Recorrido inicial: desde inicio, siempre al punto no visitado más cercano"""
+    n = distancias.shape[0]
+    visitado = np.zeros(n, dtype=bool)
+    recorrido = [inicio]
+    visitado[inicio] = True
+    actual = inicio
+    for _ in range(n - 1):
+        fila = np.where(visitado, np.inf, distancias[actual])
+        actual = int(np.argmin(fila))
+        visitado[actual] = True
+        recorrido.append(actual)
+    return np.array(recorrido, dtype=np.int64)
+
+def pasada_2opt(distancias, recorrido, limite):
+    """Una pasada de 2-opt; para cada i se evalúan todos los j de una vez
+
+    Invertir recorrido[i+1..j] reemplaza las aristas (a,b) y (c,d) por (a,c)
+    y (b,d). La posición 0 (la base) nunca se mueve. Devuelve si hubo mejora.
+    """
+    m = len(recorrido)
+    mejoro = False
+    for i in range(m - 2):
+        if time.perf_counter() > limite:
+            break
+        a, b = recorrido[i], recorrido[i + 1]
+        js = np.arange(i + 2, m if i > 0 else m - 1)
+        if not js.size:
+            continue
+        c = recorrido[js]
+        d = recorrido[(js + 1) % m]
+        delta = distancias[a, c] + distancias[b, d] - distancias[a, b] - distancias[c, d]
+        mejor = int(np.argmin(delta))
+        if delta[mejor] < -EPSILON_KM:
+            j = int(js[mejor])
+            recorrido[i + 1:j + 1] = recorrido[i + 1:j + 1][::-1].copy()
+            mejoro = True
+    return mejoro
+
+def pasada_or_opt(distancias, recorrido, limite, largo_maximo=3):
+    """Una pasada de Or-opt: mover tramos de 1 a largo_maximo paradas a otra posición
+
+    Para cada tramo se evalúan de una vez todas las aristas donde podría
+    insertarse, en el mismo sentido o invertido. Devuelve si hubo mejora.
+    """
+    mejoro = False
+    for largo in range(1, largo_maximo + 1):
+        i = 1
+        while i + largo <= len(recorrido):
+            if time.perf_counter() > limite:
+                return mejoro
+            m = len(recorrido)
+            tramo = recorrido[i:i + largo]
+            anterior, siguiente = recorrido[i - 1], recorrido[(i + largo) % m]
+            primero, ultimo = tramo[0], tramo[-1]
+            ganancia = (distancias[anterior, primero] + distancias[ultimo, siguiente]
+                        - distancias[anterior, siguiente])
+
+            resto = np.concatenate([recorrido[:i], recorrido[i + largo:]])
+            u = resto
+            v = np.roll(resto, -1)
+            directo = distancias[u, primero] + distancias[ultimo, v] - distancias[u, v]
+            invertido = distancias[u, ultimo] + distancias[primero, v] - distancias[u, v]
+            # La arista que deja el tramo al salir (anterior -> siguiente) no cuenta
+            directo[i - 1] = np.inf
+            invertido[i - 1] = np.inf
+            k_directo, k_invertido = int(np.argmin(directo)), int(np.argmin(invertido))
+            if directo[k_directo] <= invertido[k_invertido]:
+                k, costo, nuevo_tramo = k_directo, directo[k_directo], tramo
+            else:
+                k, costo, nuevo_tramo = k_invertido, invertido[k_invertido], tramo[::-1]
+            if costo - ganancia < -EPSILON_KM:
+                recorrido[:] = np.concatenate([resto[:k + 1], nuevo_tramo, resto[k + 1:]])
+                mejoro = True
+            i += 1
+    return mejoro
+
+def recorrido_exacto(distancias):
+    """Circuito óptimo probando todos los órdenes de las paradas (sólo para pocas)"""
+    n = distancias.shape[0]
+    if n <= 2:
+        return np.arange(n, dtype=np.int64)
+    ordenes = np.array(list(itertools.permutations(range(1, n))), dtype=np.int64)
+    largos = (distancias[0, ordenes[:, 0]] + distancias[ordenes[:, -1], 0]
+              + distancias[ordenes[:, :-1], ordenes[:, 1:]].sum(axis=1))
+    return np.concatenate([[0], ordenes[int(np.argmin(largos))]])
+
+def optimizar(distancias, tiempo_limite_s, exacto_max=RUTAS_EXACTO_MAX):
+    """Vecino más cercano y luego 2-opt + Or-opt hasta converger o agotar el tiempo
+
+    El índice 0 es la base. Con hasta exacto_max paradas se prueban todos los
+    órdenes: las búsquedas locales pueden quedarse en un óptimo local aun con
+    cinco puntos. Devuelve (recorrido, largo inicial, largo final, pasadas,
+    si convergió antes del límite).
+    """
+    inicio = time.perf_counter()
+    limite = inicio + tiempo_limite_s
+    recorrido = vecino_mas_cercano(distancias)
+    largo_inicial = largo_recorrido(distancias, recorrido)
+    if distancias.shape[0] - 1 <= exacto_max:
+        recorrido = recorrido_exacto(distancias)
+        return recorrido, largo_inicial, largo_recorrido(distancias, recorrido), 0, True
+    pasadas = 0
+    convergio = False
+    while time.perf_counter() < limite:
+        pasadas += 1
+        mejoro = pasada_2opt(distancias, recorrido, limite)
+        mejoro = pasada_or_opt(distancias, recorrido, limite) or mejoro
+        if not mejoro and time.perf_counter() < limite:
+            convergio = True
+            break
+    return recorrido, largo_inicial, largo_recorrido(distancias, recorrido), pasadas, convergio
+
+def planificar(lat, lon, tiempo_limite_s, regreso=True):
+    """Orden de visita para puntos cuyo índice 0 es la base (corre en el pool de procesos)"""
+    inicio = time.perf_counter()
+    distancias = matriz_haversine(lat, lon)
+    if not regreso:
+        # Volver a la base no cuesta nada: el circuito óptimo es el mejor camino abierto
+        distancias[:, 0] = 0.0
+    recorrido, largo_inicial, largo_final, pasadas, convergio = optimizar(distancias, tiempo_limite_s)
+    return {
+        "orden": recorrido.tolist(),
+        "tramos_km": distancias[recorrido[:-1], recorrido[1:]].tolist(),
+        "regreso_km": float(distancias[recorrido[-1], 0]),
+        "distancia_inicial_km": largo_inicial,
+        "distancia_km": largo_final,
+        "pasadas": pasadas,
+        "convergio": convergio,
+        "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 1),
+    }
+
+
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # spawn y no fork: el proceso ya tiene hilos que pueden tener locks tomados
+        _executor = ProcessPoolExecutor(
+            max_workers=RUTAS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+def iniciar_pool():
+    """Crear el pool de rutas al arrancar, no en el primer pedido"""
+    _get_executor()
+
+def shutdown_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def planificar_async(lat, lon, tiempo_limite_s, regreso=True):
+    """planificar en el pool de procesos, sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), planificar, lat, lon, tiempo_limite_s, regreso)
@@ -1,20 +1,49 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+import asyncio
+import json
 import os
 import logging
 from pathlib import Path
 from typing import List, Optional
-from datetime import datetime, timedelta
-import math
+from datetime import date, datetime, timedelta
 
 from models import *
-from database import execute_query, get_db
-from auth import verify_token, get_current_user, create_access_token, verify_password, get_password_hash
+from database import execute_query_async, execute_query_tuplas_async, run_in_db_thread, run_in_db_write_thread, run_with_db, get_pool_stats, get_sqlite_profile, prepare_database
+from geo import haversine_km, bbox_for_radius
+import analisis_cobertura
+import blobs
+import cambios
+import clusters
+import cobertura
+import consultas
+import consultas_lentas
+import estadisticas
+import eventos
+import exportacion
+import importacion
+import metricas
+import respuestas
+import rutas
+import vecinos
+import versiones
+from paginacion import seleccionar_campos, construir_consulta, preparar_pagina_tuplas
+from auth import (
+    verify_token, get_current_user, create_access_token,
+    verify_password_async, get_password_hash_async, iniciar_hash_pool, shutdown_hash_pool,
+    revoke_token, token_cache, security,
+)
+from fastapi.security import HTTPAuthorizationCredentials
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Tamaño máximo del archivo de una importación masiva de torres
+BULK_MAX_BYTES = int(os.environ.get('BULK_MAX_BYTES', str(50 * 1024 * 1024)))
+
 # Create the main app
 app = FastAPI(title="Sistema de Gestión de Torres", version="1.0.0")
 
@@ -28,8 +57,11 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+metricas.instalar(app)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -37,23 +69,73 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup():
+    """Aplicar migraciones pendientes y crear los pools de procesos antes de atender pedidos"""
+    await run_in_db_write_thread(prepare_database)
+    iniciar_hash_pool()
+    analisis_cobertura.iniciar_pool()
+    rutas.iniciar_pool()
+    respuestas.avisar_serializador()
+
+@app.on_event("shutdown")
+async def shutdown():
+    shutdown_hash_pool()
+    analisis_cobertura.shutdown_pool()
+    rutas.shutdown_pool()
+
+def _no_modificado(request: Request, response: Response, etag: str):
+    """Respuesta 304 si el cliente ya tiene la versión vigente; si no, agregar el ETag
+
+    El ETag se calcula antes de leer la base: si una escritura ocurre en el medio,
+    el cliente recibe datos más nuevos que el ETag y sólo repite una descarga.
+    """
+    headers = versiones.cabeceras(etag)
+    if versiones.coincide_none_match(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 # =================== RUTAS DE AUTENTICACIÓN ===================
 
+USUARIO_POR_DNI_QUERY = consultas.registrar("usuario_por_dni", """
+    SELECT id, nombre, apellido, norDni, cifrado FROM USUARIOTORRISTA
+    WHERE norDni = ? AND activo = 1
+""")
+ACTUALIZAR_HASH_QUERY = consultas.registrar("actualizar_hash",
+    "UPDATE USUARIOTORRISTA SET cifrado = ? WHERE id = ?")
+USUARIO_EXISTE_QUERY = consultas.registrar("usuario_existe",
+    "SELECT id FROM USUARIOTORRISTA WHERE norDni = ?")
+INSERTAR_USUARIO_QUERY = consultas.registrar("insertar_usuario", """
+    INSERT INTO USUARIOTORRISTA
+    (userCreaRepo, fechaAlta, nombre, apellido, norDni, tipoPersona,
+     sistema, rol, cifrado, activo)
+    VALUES (?, GETDATE(), ?, ?, ?, ?, ?, ?, ?, 1)
+""")
+
 @api_router.post("/auth/login", response_model=Token)
 async def login_for_access_token(user_data: UserLogin):
     """Autenticar usuario y generar token"""
     try:
         # Buscar usuario por DNI (como username)
-        query = "SELECT id, nombre, apellido, norDni, cifrado FROM USUARIOTORRISTA WHERE norDni = ? AND activo = 1"
-        user = execute_query(query, (int(user_data.username),), fetch_one=True)
+        user = await consultas.ejecutar_async(
+            USUARIO_POR_DNI_QUERY, (int(user_data.username),), fetch_one=True
+        )
         
-        if not user or not verify_password(user_data.password, user.get('cifrado', '')):
+        valid, new_hash = False, None
+        if user:
+            valid, new_hash = await verify_password_async(user_data.password, user.get('cifrado'))
+        if not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Credenciales incorrectas",
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
+        if new_hash:
+            # El costo de bcrypt cambió: guardar el hash regenerado
+            await consultas.ejecutar_async(ACTUALIZAR_HASH_QUERY, (new_hash, user['id']))
+        
         access_token_expires = timedelta(minutes=30)
         access_token = create_access_token(
             data={"sub": str(user['norDni']), "user_id": user['id']},
@@ -61,6 +143,8 @@ async def login_for_access_token(user_data: UserLogin):
         )
         return {"access_token": access_token, "token_type": "bearer"}
     
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -70,13 +154,22 @@ async def login_for_access_token(user_data: UserLogin):
         logger.error(f"Error en login: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@api_router.post("/auth/logout", response_model=MessageResponse)
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: str = Depends(get_current_user),
+):
+    """Revocar el token actual"""
+    revoke_token(credentials.credentials)
+    return MessageResponse(message="Sesión cerrada")
+
 @api_router.post("/auth/register", response_model=MessageResponse)
 async def register_user(user_data: UsuarioCreate):
     """Registrar nuevo usuario"""
     try:
         # Verificar si el usuario ya existe
-        existing_user = execute_query(
-            "SELECT id FROM USUARIOTORRISTA WHERE norDni = ?",
+        existing_user = await consultas.ejecutar_async(
+            USUARIO_EXISTE_QUERY,
             (user_data.norDni,), 
             fetch_one=True
         )
@@ -88,17 +181,10 @@ async def register_user(user_data: UsuarioCreate):
             )
         
         # Crear hash de la contraseña
-        hashed_password = get_password_hash(user_data.password)
+        hashed_password = await get_password_hash_async(user_data.password)
         
         # Insertar nuevo usuario
-        query = """
-            INSERT INTO USUARIOTORRISTA 
-            (userCreaRepo, fechaAlta, nombre, apellido, norDni, tipoPersona, 
-             sistema, rol, cifrado, activo)
-            VALUES (?, GETDATE(), ?, ?, ?, ?, ?, ?, ?, 1)
-        """
-        
-        result = execute_query(query, (
+        result = await consultas.ejecutar_async(INSERTAR_USUARIO_QUERY, (
             user_data.userCreaRepo,
             user_data.nombre,
             user_data.apellido,
@@ -114,47 +200,249 @@ async def register_user(user_data: UsuarioCreate):
         
         return MessageResponse(message="Usuario registrado exitosamente")
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error registrando usuario: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 # =================== RUTAS DE TORRES ===================
 
+# Columnas que pueden pedirse con fields= en los listados
+TORRE_CAMPOS = {
+    campo: campo for campo in (
+        'id', 'nombre', 'tipo', 'direccion', 'latitud', 'longitud', 'estado',
+        'alcance_km', 'fecha_ultimo_mantenimiento', 'frecuencia_mhz',
+        'notas', 'tipo_convenio', 'UsuarioCreadorID', 'UsuarioActualizadorID',
+        'fecha_creacion', 'fecha_actualizacion',
+    )
+}
+
 @api_router.get("/torres", response_model=List[dict])
-async def get_torres():
-    """Obtener todas las torres"""
+async def get_torres(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """Obtener torres; con limit/after pagina por id y con fields= proyecta columnas"""
+    campos = seleccionar_campos(fields, TORRE_CAMPOS, TORRE_CAMPOS)
+    orden = ['id']
+    no_modificado = _no_modificado(request, response, versiones.etag("Torres"))
+    if no_modificado:
+        return no_modificado
     try:
-        query = """
-            SELECT id, nombre, tipo, direccion, latitud, longitud, estado, 
-                   alcance_km, fecha_ultimo_mantenimiento, frecuencia_mhz, 
-                   notas, tipo_convenio, UsuarioCreadorID, UsuarioActualizadorID,
-                   fecha_creacion, fecha_actualizacion
-            FROM Torres
-            ORDER BY id
-        """
-        torres = execute_query(query, fetch_all=True)
-        return torres or []
+        query, params, extra = construir_consulta(
+            TORRE_CAMPOS, campos, "Torres", orden, limit=limit, after=after
+        )
+        resultado = await execute_query_tuplas_async(query, params)
+        if isinstance(resultado, dict):
+            raise HTTPException(status_code=500, detail=resultado['error'])
+        columnas, torres = resultado
+        columnas, siguiente = preparar_pagina_tuplas(columnas, torres, orden, extra, limit)
+        if siguiente:
+            response.headers["X-Next-Cursor"] = siguiente
+        return respuestas.respuesta_filas(response, columnas, torres)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo torres: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+# Consulta de torres dentro de un rectángulo usando el índice R*Tree
+TORRES_EN_BBOX_QUERY = consultas.registrar("torres_en_bbox", """
+    SELECT t.id, t.nombre, t.tipo, t.direccion, t.latitud, t.longitud, t.estado,
+           t.alcance_km, t.fecha_ultimo_mantenimiento, t.frecuencia_mhz,
+           t.notas, t.tipo_convenio, t.UsuarioCreadorID, t.UsuarioActualizadorID,
+           t.fecha_creacion, t.fecha_actualizacion
+    FROM Torres_rtree r
+    JOIN Torres t ON t.id = r.id
+    WHERE r.max_lat >= ? AND r.min_lat <= ?
+      AND r.max_lon >= ? AND r.min_lon <= ?
+""")
+TORRE_POR_ID_QUERY = consultas.registrar("torre_por_id", """
+    SELECT id, nombre, tipo, direccion, latitud, longitud, estado,
+           alcance_km, fecha_ultimo_mantenimiento, frecuencia_mhz,
+           notas, tipo_convenio, UsuarioCreadorID, UsuarioActualizadorID,
+           fecha_creacion, fecha_actualizacion
+    FROM Torres WHERE id = ?
+""")
+TORRE_EXISTE_QUERY = consultas.registrar("torre_existe", "SELECT id FROM Torres WHERE id = ?")
+INSERTAR_TORRE_QUERY = consultas.registrar("insertar_torre", """
+    INSERT INTO Torres
+    (nombre, tipo, direccion, latitud, longitud, estado, alcance_km,
+     fecha_ultimo_mantenimiento, frecuencia_mhz, notas, tipo_convenio,
+     UsuarioCreadorID, UsuarioActualizadorID, fecha_creacion, fecha_actualizacion)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, GETDATE(), GETDATE())
+""")
+ELIMINAR_TORRE_QUERY = consultas.registrar("eliminar_torre", "DELETE FROM Torres WHERE id = ?")
+
+def _ordenar_por_distancia(torres, lat, lon, radio_km=None):
+    """Agregar distancia_km a cada torre, filtrar por radio y ordenar"""
+    resultado = []
+    for torre in torres:
+        distancia = haversine_km(lat, lon, torre['latitud'], torre['longitud'])
+        if radio_km is None or distancia <= radio_km:
+            torre['distancia_km'] = round(distancia, 3)
+            resultado.append(torre)
+    resultado.sort(key=lambda torre: torre['distancia_km'])
+    return resultado
+
+@api_router.get("/torres/cercanas", response_model=List[dict])
+async def get_torres_cercanas(
+    request: Request,
+    response: Response,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radio_km: float = Query(10.0, gt=0, le=1000),
+):
+    """Obtener torres dentro de un radio, ordenadas por distancia"""
+    no_modificado = _no_modificado(request, response, versiones.etag("Torres"))
+    if no_modificado:
+        return no_modificado
+    try:
+        lat_min, lat_max, lon_min, lon_max = bbox_for_radius(lat, lon, radio_km)
+        torres = await consultas.ejecutar_async(
+            TORRES_EN_BBOX_QUERY, (lat_min, lat_max, lon_min, lon_max), fetch_all=True
+        )
+        if isinstance(torres, dict):
+            raise HTTPException(status_code=500, detail=torres['error'])
+        return _ordenar_por_distancia(torres, lat, lon, radio_km)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error obteniendo torres cercanas: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+@api_router.get("/torres/bbox", response_model=List[dict])
+async def get_torres_bbox(
+    request: Request,
+    response: Response,
+    lat_min: float = Query(..., ge=-90, le=90),
+    lat_max: float = Query(..., ge=-90, le=90),
+    lon_min: float = Query(..., ge=-180, le=180),
+    lon_max: float = Query(..., ge=-180, le=180),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+):
+    """Obtener torres dentro de un rectángulo, ordenadas por distancia a (lat, lon) o al centro"""
+    if lat_min > lat_max or lon_min > lon_max:
+        raise HTTPException(status_code=400, detail="Rectángulo inválido")
+    no_modificado = _no_modificado(request, response, versiones.etag("Torres"))
+    if no_modificado:
+        return no_modificado
+    try:
+        torres = await consultas.ejecutar_async(
+            TORRES_EN_BBOX_QUERY, (lat_min, lat_max, lon_min, lon_max), fetch_all=True
+        )
+        if isinstance(torres, dict):
+            raise HTTPException(status_code=500, detail=torres['error'])
+        centro_lat = lat if lat is not None else (lat_min + lat_max) / 2
+        centro_lon = lon if lon is not None else (lon_min + lon_max) / 2
+        return _ordenar_por_distancia(torres, centro_lat, centro_lon)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error obteniendo torres por rectángulo: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+def _parsear_bbox(bbox: str):
+    """bbox=oeste,sur,este,norte (orden GeoJSON: lon_min,lat_min,lon_max,lat_max)"""
+    try:
+        oeste, sur, este, norte = (float(valor) for valor in bbox.split(','))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox debe ser oeste,sur,este,norte")
+    if not (-180 <= oeste <= este <= 180 and -90 <= sur <= norte <= 90):
+        raise HTTPException(status_code=400, detail="Rectángulo inválido")
+    return oeste, sur, este, norte
+
+@api_router.get("/torres/clusters")
+async def get_torres_clusters(
+    request: Request,
+    response: Response,
+    bbox: str = Query(..., description="oeste,sur,este,norte"),
+    zoom: int = Query(..., ge=0, le=24),
+):
+    """Torres agrupadas para el mapa: un cluster por celda con conteos por estado y convenio
+
+    Por encima de CLUSTER_MAX_ZOOM se devuelven las torres individuales. Un
+    rectángulo de más de CLUSTER_MAX_CELDAS celdas en ese zoom responde 400.
+    """
+    oeste, sur, este, norte = _parsear_bbox(bbox)
+    no_modificado = _no_modificado(request, response, versiones.etag("Torres"))
+    if no_modificado:
+        return no_modificado
+    try:
+        # Fuera del event loop: con CLUSTER_MAX_CELDAS celdas una vista densa arma miles de clusters
+        resultado = await run_in_db_thread(clusters.clusters_en_bbox, oeste, sur, este, norte, zoom)
+        return {
+            "zoom": zoom,
+            "total": sum(cluster['cantidad'] for cluster in resultado),
+            "clusters": resultado,
+        }
+    except clusters.ClusterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error obteniendo clusters de torres: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+@api_router.get("/torres/knn")
+async def get_torres_knn(
+    request: Request,
+    response: Response,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(5, ge=1, le=100),
+    estado: Optional[str] = Query(None, description="Uno o varios estados separados por coma"),
+    tipo: Optional[str] = None,
+    max_km: Optional[float] = Query(None, gt=0),
+):
+    """Las k torres más cercanas a un punto, ordenadas por distancia (índice en memoria)"""
+    estados = {valor.strip() for valor in estado.split(',') if valor.strip()} if estado else None
+    no_modificado = _no_modificado(request, response, versiones.etag("Torres"))
+    if no_modificado:
+        return no_modificado
+    try:
+        # Aun con el índice cargado la búsqueda es Python puro: siempre fuera del event loop
+        return await run_in_db_thread(vecinos.torres_cercanas, lat, lon, k, estados, tipo, max_km)
+    except Exception as e:
+        logger.error(f"Error buscando torres más cercanas: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+@api_router.get("/torres/stream")
+async def stream_torres(request: Request, since: Optional[int] = Query(None, ge=0)):
+    """Feed de cambios de torres por Server-Sent Events
+
+    Cada evento trae seq; para reanudar sin recargar todo se reconecta con
+    since=<último seq> (EventSource lo envía solo en Last-Event-ID). Un evento
+    con accion "recarga" indica que hay que volver a pedir GET /torres.
+    """
+    if since is None and request.headers.get('last-event-id', '').isdigit():
+        since = int(request.headers['last-event-id'])
+    return StreamingResponse(
+        cambios.stream_sse(since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @api_router.get("/torres/{torre_id}")
-async def get_torre(torre_id: int):
+async def get_torre(torre_id: int, request: Request, response: Response):
     """Obtener una torre específica"""
+    no_modificado = _no_modificado(request, response, versiones.etag_fila("Torres", torre_id))
+    if no_modificado:
+        return no_modificado
     try:
-        query = """
-            SELECT id, nombre, tipo, direccion, latitud, longitud, estado, 
-                   alcance_km, fecha_ultimo_mantenimiento, frecuencia_mhz, 
-                   notas, tipo_convenio, UsuarioCreadorID, UsuarioActualizadorID,
-                   fecha_creacion, fecha_actualizacion
-            FROM Torres WHERE id = ?
-        """
-        torre = execute_query(query, (torre_id,), fetch_one=True)
+        torre = await consultas.ejecutar_async(TORRE_POR_ID_QUERY, (torre_id,), fetch_one=True)
         
         if not torre:
             raise HTTPException(status_code=404, detail="Torre no encontrada")
         
         return torre
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo torre {torre_id}: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
@@ -163,15 +451,7 @@ async def get_torre(torre_id: int):
 async def create_torre(torre: TorreCreate):
     """Crear nueva torre"""
     try:
-        query = """
-            INSERT INTO Torres 
-            (nombre, tipo, direccion, latitud, longitud, estado, alcance_km,
-             fecha_ultimo_mantenimiento, frecuencia_mhz, notas, tipo_convenio,
-             UsuarioCreadorID, UsuarioActualizadorID, fecha_creacion, fecha_actualizacion)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, GETDATE(), GETDATE())
-        """
-        
-        result = execute_query(query, (
+        result = await consultas.ejecutar_async(INSERTAR_TORRE_QUERY, (
             torre.nombre, torre.tipo, torre.direccion, torre.latitud, 
             torre.longitud, torre.estado, torre.alcance_km,
             torre.fecha_ultimo_mantenimiento, torre.frecuencia_mhz,
@@ -182,167 +462,447 @@ async def create_torre(torre: TorreCreate):
         if 'error' in result:
             raise HTTPException(status_code=500, detail=result['error'])
         
+        eventos.publicar("Torres", eventos.INSERT, result['lastrowid'],
+                         {"id": result['lastrowid'], **torre.dict()})
         return MessageResponse(message="Torre creada exitosamente")
     
     except Exception as e:
         logger.error(f"Error creando torre: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
-@api_router.put("/torres/{torre_id}", response_model=MessageResponse)
-async def update_torre(torre_id: int, torre: TorreUpdate):
-    """Actualizar torre existente"""
+@api_router.post("/torres/bulk")
+async def bulk_import_torres(request: Request, formato: Optional[str] = Query(None, pattern="^(csv|json|geojson)$")):
+    """Importar torres en lote desde CSV, array JSON o GeoJSON (FeatureCollection de puntos)"""
+    cuerpo = bytearray()
+    async for chunk in request.stream():
+        cuerpo.extend(chunk)
+        if len(cuerpo) > BULK_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Archivo demasiado grande")
+    cuerpo = bytes(cuerpo)
+    formato = formato or importacion.detectar_formato(request.headers.get('content-type'), cuerpo)
+    
     try:
-        # Verificar que la torre existe
-        existing_torre = execute_query(
-            "SELECT id FROM Torres WHERE id = ?", 
-            (torre_id,), 
-            fetch_one=True
+        resultado = await run_in_db_write_thread(importacion.importar_torres, cuerpo, formato)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Archivo inválido: {e}")
+    except Exception as e:
+        logger.error(f"Error importando torres: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+    
+    if resultado['insertadas']:
+        eventos.publicar("Torres", eventos.RECARGA)
+    return resultado
+
+# Serializa verificación de If-Match, escritura y publicación del cambio de versión
+_escritura_torres = asyncio.Lock()
+
+def _verificar_if_match(request: Request, torre_id: int):
+    """Concurrencia optimista: 412 si la torre cambió desde que el cliente la leyó"""
+    if not versiones.coincide_match(request.headers.get('if-match'),
+                                    versiones.etag_fila("Torres", torre_id)):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="La torre fue modificada por otro usuario"
         )
-        
-        if not existing_torre:
-            raise HTTPException(status_code=404, detail="Torre no encontrada")
-        
-        # Construir consulta dinámica solo con campos proporcionados
-        update_fields = []
-        params = []
-        
-        for field, value in torre.dict(exclude_unset=True).items():
-            if field != 'UsuarioActualizadorID':
-                update_fields.append(f"{field} = ?")
-                params.append(value)
-        
-        if update_fields:
-            update_fields.append("fecha_actualizacion = GETDATE()")
-            update_fields.append("UsuarioActualizadorID = ?")
-            params.append(torre.UsuarioActualizadorID)
-            params.append(torre_id)
+
+@api_router.put("/torres/{torre_id}", response_model=MessageResponse)
+async def update_torre(torre_id: int, torre: TorreUpdate, request: Request, response: Response):
+    """Actualizar torre existente (acepta If-Match con el ETag de GET /torres/{id})"""
+    try:
+        async with _escritura_torres:
+            # Verificar que la torre existe
+            existing_torre = await consultas.ejecutar_async(
+                TORRE_EXISTE_QUERY, 
+                (torre_id,), 
+                fetch_one=True
+            )
             
-            query = f"UPDATE Torres SET {', '.join(update_fields)} WHERE id = ?"
-            result = execute_query(query, params)
+            if not existing_torre:
+                raise HTTPException(status_code=404, detail="Torre no encontrada")
+            _verificar_if_match(request, torre_id)
             
-            if 'error' in result:
-                raise HTTPException(status_code=500, detail=result['error'])
-        
+            # Construir consulta dinámica solo con campos proporcionados
+            update_fields = []
+            params = []
+            
+            for field, value in torre.dict(exclude_unset=True).items():
+                if field != 'UsuarioActualizadorID':
+                    update_fields.append(f"{field} = ?")
+                    params.append(value)
+            
+            if update_fields:
+                update_fields.append("fecha_actualizacion = GETDATE()")
+                update_fields.append("UsuarioActualizadorID = ?")
+                params.append(torre.UsuarioActualizadorID)
+                params.append(torre_id)
+                
+                query = f"UPDATE Torres SET {', '.join(update_fields)} WHERE id = ?"
+                result = await execute_query_async(query, params)
+                
+                if 'error' in result:
+                    raise HTTPException(status_code=500, detail=result['error'])
+                
+                torre_actualizada = await consultas.ejecutar_async(
+                    TORRE_POR_ID_QUERY,
+                    (torre_id,),
+                    fetch_one=True
+                )
+                eventos.publicar("Torres", eventos.UPDATE, torre_id, torre_actualizada)
+            
+            response.headers["ETag"] = versiones.etag_fila("Torres", torre_id)
         return MessageResponse(message="Torre actualizada exitosamente")
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error actualizando torre {torre_id}: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 @api_router.delete("/torres/{torre_id}", response_model=MessageResponse)
-async def delete_torre(torre_id: int):
-    """Eliminar torre"""
+async def delete_torre(torre_id: int, request: Request):
+    """Eliminar torre (acepta If-Match)"""
     try:
-        # Verificar que la torre existe
-        existing_torre = execute_query(
-            "SELECT id FROM Torres WHERE id = ?", 
-            (torre_id,), 
-            fetch_one=True
-        )
-        
-        if not existing_torre:
-            raise HTTPException(status_code=404, detail="Torre no encontrada")
-        
-        # Eliminar torre (CASCADE eliminará mantenimientos relacionados)
-        query = "DELETE FROM Torres WHERE id = ?"
-        result = execute_query(query, (torre_id,))
-        
-        if 'error' in result:
-            raise HTTPException(status_code=500, detail=result['error'])
-        
+        async with _escritura_torres:
+            # Verificar que la torre existe
+            existing_torre = await consultas.ejecutar_async(
+                TORRE_EXISTE_QUERY, 
+                (torre_id,), 
+                fetch_one=True
+            )
+            
+            if not existing_torre:
+                raise HTTPException(status_code=404, detail="Torre no encontrada")
+            _verificar_if_match(request, torre_id)
+            
+            # Eliminar torre (CASCADE eliminará mantenimientos relacionados)
+            result = await consultas.ejecutar_async(ELIMINAR_TORRE_QUERY, (torre_id,))
+            
+            if 'error' in result:
+                raise HTTPException(status_code=500, detail=result['error'])
+            
+            eventos.publicar("Torres", eventos.DELETE, torre_id)
         return MessageResponse(message="Torre eliminada exitosamente")
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error eliminando torre {torre_id}: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
 # =================== RUTAS DE MANTENIMIENTOS ===================
 
+# Las imágenes están en MantenimientoImagenes/Blobs: el listado da sus URLs,
+# armadas por SQLite como arreglo JSON (las columnas base64 quedaron vacías)
+IMAGEN_CAMPOS = ('imagenes',)
+IMAGEN_BASE64_CAMPOS = blobs.IMAGEN_COLUMNAS
+
+MANTENIMIENTO_CAMPOS = {
+    **{campo: f"m.{campo}" for campo in (
+        'id', 'TorreID', 'UsuarioTorristaID', 'fecha_inicio_mantenimiento',
+        'fecha_fin_mantenimiento', 'tipo_mantenimiento', 'descripcion_trabajo',
+        'notas_mantenimiento', 'costo', 'fecha_registro',
+    )},
+    'torre_nombre': 't.nombre',
+    'imagenes': """(
+        SELECT json_group_array(json_object('posicion', i.posicion, 'url', '/api/blobs/' || i.sha256))
+        FROM (SELECT mi.posicion, mi.sha256 FROM MantenimientoImagenes mi
+              WHERE mi.MantenimientoID = m.id ORDER BY mi.posicion) i
+    )""",
+}
+
+def _decodificar_imagenes(columnas, filas):
+    """Reemplazar el texto JSON de la columna imagenes por la lista de imágenes"""
+    if 'imagenes' not in columnas:
+        return filas
+    posicion = columnas.index('imagenes')
+    return [
+        (*fila[:posicion], json.loads(fila[posicion]), *fila[posicion + 1:])
+        for fila in filas
+    ]
+
+INSERTAR_MANTENIMIENTO_QUERY = consultas.registrar("insertar_mantenimiento", """
+    INSERT INTO Mantenimientos
+    (TorreID, UsuarioTorristaID, fecha_inicio_mantenimiento,
+     fecha_fin_mantenimiento, tipo_mantenimiento, descripcion_trabajo,
+     notas_mantenimiento, costo, fecha_registro)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, GETDATE())
+""")
+MANTENIMIENTO_EXISTE_QUERY = consultas.registrar("mantenimiento_existe",
+    "SELECT id FROM Mantenimientos WHERE id = ?")
+IMAGENES_MANTENIMIENTO_QUERY = consultas.registrar("imagenes_mantenimiento", """
+    SELECT mi.posicion, b.sha256, b.tamano, b.tipo_mime
+    FROM MantenimientoImagenes mi
+    JOIN Blobs b ON b.sha256 = mi.sha256
+    WHERE mi.MantenimientoID = ?
+    ORDER BY mi.posicion
+""")
+
 @api_router.get("/mantenimientos")
-async def get_mantenimientos(torre_id: Optional[int] = None):
-    """Obtener mantenimientos, opcionalmente filtrados por torre"""
+async def get_mantenimientos(
+    request: Request,
+    response: Response,
+    torre_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    incluir_imagenes: bool = False,
+):
+    """Obtener mantenimientos, opcionalmente filtrados por torre
+
+    Las imágenes (posición y URL en /api/blobs) sólo se incluyen con
+    incluir_imagenes=true o pidiendo imagenes en fields=.
+    """
+    por_defecto = [
+        campo for campo in MANTENIMIENTO_CAMPOS
+        if incluir_imagenes or campo not in IMAGEN_CAMPOS
+    ]
+    if fields and any(campo.strip() in IMAGEN_BASE64_CAMPOS for campo in fields.split(',')):
+        raise HTTPException(
+            status_code=400,
+            detail="Las imágenes ya no se devuelven en base64: pida el campo imagenes (URLs en /api/blobs)"
+        )
+    campos = seleccionar_campos(fields, MANTENIMIENTO_CAMPOS, por_defecto)
+    orden = ['fecha_inicio_mantenimiento', 'id']
+    # Depende también de Torres por torre_nombre y por el borrado en cascada
+    no_modificado = _no_modificado(request, response, versiones.etag("Mantenimientos", "Torres"))
+    if no_modificado:
+        return no_modificado
     try:
+        condiciones, params = [], []
         if torre_id:
-            query = """
-                SELECT m.*, t.nombre as torre_nombre 
-                FROM Mantenimientos m
-                JOIN Torres t ON m.TorreID = t.id
-                WHERE m.TorreID = ?
-                ORDER BY m.fecha_inicio_mantenimiento DESC
-            """
-            mantenimientos = execute_query(query, (torre_id,), fetch_all=True)
-        else:
-            query = """
-                SELECT m.*, t.nombre as torre_nombre 
-                FROM Mantenimientos m
-                JOIN Torres t ON m.TorreID = t.id
-                ORDER BY m.fecha_inicio_mantenimiento DESC
-            """
-            mantenimientos = execute_query(query, fetch_all=True)
-        
-        return mantenimientos or []
+            condiciones.append("m.TorreID = ?")
+            params.append(torre_id)
+        query, params, extra = construir_consulta(
+            MANTENIMIENTO_CAMPOS, campos,
+            "Mantenimientos m JOIN Torres t ON m.TorreID = t.id",
+            orden, condiciones, params, descendente=True, limit=limit, after=after
+        )
+        resultado = await execute_query_tuplas_async(query, params)
+        if isinstance(resultado, dict):
+            raise HTTPException(status_code=500, detail=resultado['error'])
+        columnas, mantenimientos = resultado
+        columnas, siguiente = preparar_pagina_tuplas(columnas, mantenimientos, orden, extra, limit)
+        mantenimientos = _decodificar_imagenes(columnas, mantenimientos)
+        if siguiente:
+            response.headers["X-Next-Cursor"] = siguiente
+        return respuestas.respuesta_filas(response, columnas, mantenimientos)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo mantenimientos: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@api_router.get("/mantenimientos/export")
+async def export_mantenimientos(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    desde: Optional[date] = None,
+    hasta: Optional[date] = None,
+):
+    """Exportar el historial de mantenimientos en streaming (CSV o NDJSON)"""
+    _, media_type = exportacion.FORMATOS[format]
+    nombre = f"mantenimientos.{format}"
+    try:
+        bloques = exportacion.exportar_mantenimientos(format, desde, hasta)
+    except exportacion.ExportacionesAgotadas:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Demasiadas exportaciones en curso, intente nuevamente",
+            headers={"Retry-After": "5"},
+        )
+    return StreamingResponse(
+        bloques,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'},
+    )
+
+def _insertar_mantenimiento(conn, mantenimiento):
+    """Registrar el mantenimiento y sus imágenes en una sola transacción
+
+    Las imágenes base64 se decodifican acá, en el hilo de escritura, y se
+    guardan como blobs, no en las columnas de la tabla.
+    """
+    imagenes = {}
+    for posicion, columna in enumerate(blobs.IMAGEN_COLUMNAS, start=1):
+        valor = getattr(mantenimiento, columna)
+        if valor:
+            imagenes[posicion] = blobs.decodificar_base64(valor, blobs.BLOB_MAX_BYTES)
+    cursor = conn.execute(INSERTAR_MANTENIMIENTO_QUERY.sql, (
+        mantenimiento.TorreID, mantenimiento.UsuarioTorristaID,
+        mantenimiento.fecha_inicio_mantenimiento,
+        mantenimiento.fecha_fin_mantenimiento,
+        mantenimiento.tipo_mantenimiento, mantenimiento.descripcion_trabajo,
+        mantenimiento.notas_mantenimiento, mantenimiento.costo
+    ))
+    for posicion, (data, tipo_mime) in imagenes.items():
+        blob = blobs.guardar_bytes(conn, data, tipo_mime)
+        blobs.vincular_imagen(conn, cursor.lastrowid, posicion, blob['sha256'])
+    return cursor.lastrowid
+
 @api_router.post("/mantenimientos", response_model=MessageResponse)
 async def create_mantenimiento(mantenimiento: MantenimientoCreate):
     """Crear nuevo mantenimiento"""
     try:
-        query = """
-            INSERT INTO Mantenimientos 
-            (TorreID, UsuarioTorristaID, fecha_inicio_mantenimiento, 
-             fecha_fin_mantenimiento, tipo_mantenimiento, descripcion_trabajo,
-             notas_mantenimiento, costo, imagen1_base64, imagen2_base64,
-             imagen3_base64, imagen4_base64, fecha_registro)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, GETDATE())
-        """
-        
-        result = execute_query(query, (
-            mantenimiento.TorreID, mantenimiento.UsuarioTorristaID,
-            mantenimiento.fecha_inicio_mantenimiento, 
-            mantenimiento.fecha_fin_mantenimiento,
-            mantenimiento.tipo_mantenimiento, mantenimiento.descripcion_trabajo,
-            mantenimiento.notas_mantenimiento, mantenimiento.costo,
-            mantenimiento.imagen1_base64, mantenimiento.imagen2_base64,
-            mantenimiento.imagen3_base64, mantenimiento.imagen4_base64
-        ))
-        
-        if 'error' in result:
-            raise HTTPException(status_code=500, detail=result['error'])
+        # Si falla una imagen no queda el mantenimiento registrado sin ellas
+        try:
+            mantenimiento_id = await run_with_db(_insertar_mantenimiento, mantenimiento)
+        except blobs.BlobDemasiadoGrande as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except blobs.BlobError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
+        eventos.publicar("Mantenimientos", eventos.INSERT, mantenimiento_id)
         return MessageResponse(message="Mantenimiento registrado exitosamente")
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creando mantenimiento: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@api_router.get("/mantenimientos/{mantenimiento_id}/imagenes")
+async def get_imagenes_mantenimiento(mantenimiento_id: int):
+    """Listar las imágenes de un mantenimiento"""
+    imagenes = await consultas.ejecutar_async(
+        IMAGENES_MANTENIMIENTO_QUERY, (mantenimiento_id,), fetch_all=True
+    )
+    if isinstance(imagenes, dict):
+        raise HTTPException(status_code=500, detail=imagenes['error'])
+    for imagen in imagenes:
+        imagen['url'] = f"/api/blobs/{imagen['sha256']}"
+    return imagenes
+
+async def _recibir_blob(request: Request):
+    """Guardar en disco el cuerpo de la petición a medida que llega"""
+    escritor = await run_in_threadpool(blobs.EscritorBlob)
+    try:
+        async for chunk in request.stream():
+            if escritor.tamano + len(chunk) > blobs.BLOB_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Archivo demasiado grande")
+            await run_in_threadpool(escritor.write, chunk)
+    except BaseException:
+        escritor.abort()
+        raise
+    if escritor.tamano == 0:
+        escritor.abort()
+        raise HTTPException(status_code=400, detail="Archivo vacío")
+    return escritor
+
+@api_router.put("/mantenimientos/{mantenimiento_id}/imagenes/{posicion}")
+async def put_imagen_mantenimiento(mantenimiento_id: int, posicion: int, request: Request):
+    """Subir (o reemplazar) la imagen de una posición 1-4 enviando el archivo como cuerpo"""
+    if not 1 <= posicion <= 4:
+        raise HTTPException(status_code=400, detail="La posición debe estar entre 1 y 4")
+    existente = await consultas.ejecutar_async(
+        MANTENIMIENTO_EXISTE_QUERY, (mantenimiento_id,), fetch_one=True
+    )
+    if not existente:
+        raise HTTPException(status_code=404, detail="Mantenimiento no encontrado")
+    
+    escritor = await _recibir_blob(request)
+    
+    def _guardar(conn):
+        blob = escritor.commit(conn, request.headers.get('content-type'))
+        blobs.vincular_imagen(conn, mantenimiento_id, posicion, blob['sha256'])
+        return blob
+    
+    blob = await run_with_db(_guardar)
+    return {**blob, "posicion": posicion, "url": f"/api/blobs/{blob['sha256']}"}
+
+# =================== RUTAS DE BLOBS ===================
+
+@api_router.post("/blobs")
+async def upload_blob(request: Request):
+    """Subir un archivo en streaming; se identifica por su SHA-256 y se deduplica"""
+    escritor = await _recibir_blob(request)
+    blob = await run_with_db(escritor.commit, request.headers.get('content-type'))
+    return {**blob, "url": f"/api/blobs/{blob['sha256']}"}
+
+@api_router.get("/blobs/{sha256}")
+async def download_blob(sha256: str, request: Request):
+    """Descargar un blob; soporta Range (un solo rango) e If-None-Match"""
+    if not blobs.es_sha256(sha256):
+        raise HTTPException(status_code=400, detail="Identificador inválido")
+    blob = await run_in_db_thread(blobs.obtener_blob, sha256)
+    if not blob or not blobs.ruta_blob(sha256).exists():
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    
+    tamano = blob['tamano']
+    headers = {
+        "ETag": f'"{sha256}"',
+        "Accept-Ranges": "bytes",
+        # El contenido de un blob nunca cambia
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if request.headers.get('if-none-match') == f'"{sha256}"':
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        rango = blobs.parsear_range(request.headers.get('range'), tamano)
+    except blobs.BlobError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{tamano}"})
+    
+    if rango is None:
+        inicio, fin, codigo = 0, tamano - 1, 200
+    else:
+        (inicio, fin), codigo = rango, 206
+        headers["Content-Range"] = f"bytes {inicio}-{fin}/{tamano}"
+    headers["Content-Length"] = str(fin - inicio + 1)
+    return StreamingResponse(
+        blobs.leer_rango(sha256, inicio, fin),
+        status_code=codigo,
+        media_type=blob['tipo_mime'],
+        headers=headers,
+    )
+
 # =================== RUTAS DE TÉCNICOS ===================
 
+TECNICO_CAMPOS = {
+    **{campo: f"t.{campo}" for campo in (
+        'id', 'nombre', 'apellido', 'dni', 'TorreID', 'tipoPersona',
+        'idPersonalPolicial', 'idPersonalCivil', 'fechaAlta', 'usuarioAlta',
+        'fechaBaja', 'usuarioBaja', 'activo',
+    )},
+    'torre_nombre': 'tor.nombre',
+}
+
+INSERTAR_TECNICO_QUERY = consultas.registrar("insertar_tecnico", """
+    INSERT INTO TECNICOINTERVINIENTE
+    (nombre, apellido, dni, TorreID, tipoPersona, idPersonalPolicial,
+     idPersonalCivil, fechaAlta, usuarioAlta, activo)
+    VALUES (?, ?, ?, ?, ?, ?, ?, GETDATE(), ?, 1)
+""")
+
 @api_router.get("/tecnicos")
-async def get_tecnicos(torre_id: Optional[int] = None):
+async def get_tecnicos(
+    response: Response,
+    torre_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+):
     """Obtener técnicos intervinientes"""
+    campos = seleccionar_campos(fields, TECNICO_CAMPOS, TECNICO_CAMPOS)
+    orden = ['fechaAlta', 'id']
     try:
+        condiciones, params = ["t.activo = 1"], []
         if torre_id:
-            query = """
-                SELECT t.*, tor.nombre as torre_nombre 
-                FROM TECNICOINTERVINIENTE t
-                LEFT JOIN Torres tor ON t.TorreID = tor.id
-                WHERE t.TorreID = ? AND t.activo = 1
-                ORDER BY t.fechaAlta DESC
-            """
-            tecnicos = execute_query(query, (torre_id,), fetch_all=True)
-        else:
-            query = """
-                SELECT t.*, tor.nombre as torre_nombre 
-                FROM TECNICOINTERVINIENTE t
-                LEFT JOIN Torres tor ON t.TorreID = tor.id
-                WHERE t.activo = 1
-                ORDER BY t.fechaAlta DESC
-            """
-            tecnicos = execute_query(query, fetch_all=True)
-        
-        return tecnicos or []
+            condiciones.append("t.TorreID = ?")
+            params.append(torre_id)
+        query, params, extra = construir_consulta(
+            TECNICO_CAMPOS, campos,
+            "TECNICOINTERVINIENTE t LEFT JOIN Torres tor ON t.TorreID = tor.id",
+            orden, condiciones, params, descendente=True, limit=limit, after=after
+        )
+        resultado = await execute_query_tuplas_async(query, params)
+        if isinstance(resultado, dict):
+            raise HTTPException(status_code=500, detail=resultado['error'])
+        columnas, tecnicos = resultado
+        columnas, siguiente = preparar_pagina_tuplas(columnas, tecnicos, orden, extra, limit)
+        if siguiente:
+            response.headers["X-Next-Cursor"] = siguiente
+        return respuestas.respuesta_filas(response, columnas, tecnicos)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo técnicos: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
@@ -351,14 +911,7 @@ async def get_tecnicos(torre_id: Optional[int] = None):
 async def create_tecnico(tecnico: TecnicoIntervinienteCreate):
     """Crear nuevo técnico interviniente"""
     try:
-        query = """
-            INSERT INTO TECNICOINTERVINIENTE 
-            (nombre, apellido, dni, TorreID, tipoPersona, idPersonalPolicial,
-             idPersonalCivil, fechaAlta, usuarioAlta, activo)
-            VALUES (?, ?, ?, ?, ?, ?, ?, GETDATE(), ?, 1)
-        """
-        
-        result = execute_query(query, (
+        result = await consultas.ejecutar_async(INSERTAR_TECNICO_QUERY, (
             tecnico.nombre, tecnico.apellido, tecnico.dni, tecnico.TorreID,
             tecnico.tipoPersona, tecnico.idPersonalPolicial, 
             tecnico.idPersonalCivil, tecnico.usuarioAlta
@@ -378,63 +931,164 @@ async def create_tecnico(tecnico: TecnicoIntervinienteCreate):
         logger.error(f"Error creando técnico: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+# =================== PLANIFICACIÓN DE RUTAS ===================
+
+# Columnas de torre que necesita el planificador
+RUTA_COLUMNAS = "t.id, t.nombre, t.latitud, t.longitud, t.estado, t.fecha_ultimo_mantenimiento"
+# Ids por consulta al buscar torres pedidas explícitamente (límite de parámetros de SQLite)
+RUTA_IDS_POR_CONSULTA = 500
+
+async def _torres_por_ids(ids):
+    torres = []
+    for desde in range(0, len(ids), RUTA_IDS_POR_CONSULTA):
+        lote = ids[desde:desde + RUTA_IDS_POR_CONSULTA]
+        marcadores = ', '.join('?' for _ in lote)
+        filas = await execute_query_async(
+            f"SELECT {RUTA_COLUMNAS} FROM Torres t WHERE t.id IN ({marcadores})", lote, fetch_all=True
+        )
+        if isinstance(filas, dict):
+            raise HTTPException(status_code=500, detail=filas['error'])
+        torres.extend(filas)
+    return torres
+
+async def _torres_candidatas(pedido: RutaRequest, lat, lon):
+    """Torres a visitar alrededor de la base: por estado o sin mantenimiento reciente
+
+    Las torres sin fecha_ultimo_mantenimiento sólo entran por su estado.
+    """
+    condiciones, params = [], list(bbox_for_radius(lat, lon, pedido.radio_km))
+    if pedido.estados:
+        condiciones.append(f"t.estado IN ({', '.join('?' for _ in pedido.estados)})")
+        params.extend(pedido.estados)
+    if pedido.dias_sin_mantenimiento:
+        condiciones.append("t.fecha_ultimo_mantenimiento < ?")
+        params.append((date.today() - timedelta(days=pedido.dias_sin_mantenimiento)).isoformat())
+    if not condiciones:
+        return []
+    # El filtro va en SQL: en un radio grande el rectángulo trae decenas de miles de torres
+    torres = await execute_query_async(f"""
+        SELECT {RUTA_COLUMNAS}
+        FROM Torres_rtree r
+        JOIN Torres t ON t.id = r.id
+        WHERE r.max_lat >= ? AND r.min_lat <= ?
+          AND r.max_lon >= ? AND r.min_lon <= ?
+          AND ({' OR '.join(condiciones)})
+    """, params, fetch_all=True)
+    if isinstance(torres, dict):
+        raise HTTPException(status_code=500, detail=torres['error'])
+    # Las más cercanas a la base primero, hasta max_paradas
+    return _ordenar_por_distancia(torres, lat, lon, pedido.radio_km)[:pedido.max_paradas]
+
+@api_router.post("/rutas/planificar")
+async def planificar_ruta(pedido: RutaRequest):
+    """Orden de visita para una salida de mantenimiento desde una base
+
+    Distancias en línea recta (haversine). El recorrido inicial de vecino más
+    cercano se mejora con 2-opt y Or-opt hasta converger o agotar
+    tiempo_limite_ms; con pocas paradas se prueban todos los órdenes. El
+    cálculo corre en un pool de procesos.
+    """
+    if pedido.base:
+        if pedido.base not in rutas.BASES:
+            raise HTTPException(
+                status_code=400, detail=f"base debe ser una de: {', '.join(rutas.BASES)}"
+            )
+        lat, lon, nombre_base = rutas.BASES[pedido.base]
+    elif pedido.latitud is not None and pedido.longitud is not None:
+        lat, lon, nombre_base = pedido.latitud, pedido.longitud, "Base"
+    else:
+        raise HTTPException(status_code=400, detail="Indique base o latitud y longitud")
+    if pedido.torre_ids and len(pedido.torre_ids) > pedido.max_paradas:
+        raise HTTPException(status_code=400, detail=f"Demasiadas torres (máximo {pedido.max_paradas})")
+
+    try:
+        if pedido.torre_ids:
+            ids = list(dict.fromkeys(pedido.torre_ids))
+            torres = await _torres_por_ids(ids)
+            faltantes = set(ids) - {torre['id'] for torre in torres}
+            if faltantes:
+                raise HTTPException(
+                    status_code=404, detail=f"Torres inexistentes: {', '.join(map(str, sorted(faltantes)))}"
+                )
+            # Sin coordenadas válidas no hay forma de ubicarlas en el recorrido
+            omitidas = sorted(
+                torre['id'] for torre in torres
+                if torre['latitud'] is None or torre['longitud'] is None
+                or not (-90 <= torre['latitud'] <= 90 and -180 <= torre['longitud'] <= 180)
+            )
+            torres = [torre for torre in torres if torre['id'] not in omitidas]
+        else:
+            omitidas = []
+            torres = await _torres_candidatas(pedido, lat, lon)
+
+        base = {"nombre": nombre_base, "latitud": lat, "longitud": lon}
+        if not torres:
+            return {"base": base, "paradas": [], "omitidas": omitidas, "distancia_km": 0.0}
+
+        plan = await rutas.planificar_async(
+            [lat] + [torre['latitud'] for torre in torres],
+            [lon] + [torre['longitud'] for torre in torres],
+            pedido.tiempo_limite_ms / 1000, pedido.regreso,
+        )
+        paradas, acumulado = [], 0.0
+        for numero, (indice, tramo_km) in enumerate(zip(plan['orden'][1:], plan['tramos_km']), start=1):
+            torre = torres[indice - 1]
+            acumulado += tramo_km
+            paradas.append({
+                "orden": numero,
+                "id": torre['id'],
+                "nombre": torre['nombre'],
+                "latitud": torre['latitud'],
+                "longitud": torre['longitud'],
+                "estado": torre['estado'],
+                "fecha_ultimo_mantenimiento": torre['fecha_ultimo_mantenimiento'],
+                "tramo_km": round(tramo_km, 3),
+                "acumulado_km": round(acumulado, 3),
+            })
+        return {
+            "base": base,
+            "paradas": paradas,
+            "omitidas": omitidas,
+            "distancia_km": round(plan['distancia_km'], 3),
+            "regreso_km": round(plan['regreso_km'], 3) if pedido.regreso else None,
+            "distancia_vecino_mas_cercano_km": round(plan['distancia_inicial_km'], 3),
+            "pasadas": plan['pasadas'],
+            "convergio": plan['convergio'],
+            "tiempo_ms": plan['tiempo_ms'],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error planificando ruta: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
 # =================== RUTAS DE ESTADÍSTICAS ===================
 
+CONTADORES_QUERY = consultas.registrar("contadores",
+    "SELECT clave, valor FROM EstadisticasResumen")
+
 @api_router.get("/estadisticas", response_model=EstadisticasResponse)
-async def get_estadisticas():
+async def get_estadisticas(request: Request, response: Response):
     """Obtener estadísticas del sistema"""
+    no_modificado = _no_modificado(request, response, versiones.etag("Torres", "Mantenimientos"))
+    if no_modificado:
+        return no_modificado
     try:
-        # Total de torres
-        total_torres = execute_query(
-            "SELECT COUNT(*) as total FROM Torres", 
-            fetch_one=True
-        )
-        total_torres = total_torres.get('total', 0) if total_torres else 0
-        
-        # Torres por tipo de convenio
-        torres_por_convenio = execute_query("""
-            SELECT tipo_convenio, COUNT(*) as count 
-            FROM Torres 
-            GROUP BY tipo_convenio
-        """, fetch_all=True)
-        
-        torres_ecom = 0
-        torres_policia = 0
-        torres_terceros = 0
-        
-        if torres_por_convenio:
-            for row in torres_por_convenio:
-                if row['tipo_convenio'] == 'Ecom':
-                    torres_ecom = row['count']
-                elif row['tipo_convenio'] == 'Policia':
-                    torres_policia = row['count']
-                elif row['tipo_convenio'] == 'De tercero':
-                    torres_terceros = row['count']
-        
-        # Torres con mantenimientos (visitadas)
-        torres_visitadas = execute_query(
-            "SELECT COUNT(DISTINCT TorreID) as visitadas FROM Mantenimientos",
-            fetch_one=True
-        )
-        torres_visitadas = torres_visitadas.get('visitadas', 0) if torres_visitadas else 0
-        
-        # Cobertura total (suma de áreas de cobertura)
-        alcances = execute_query(
-            "SELECT alcance_km FROM Torres WHERE alcance_km IS NOT NULL AND alcance_km > 0",
-            fetch_all=True
-        )
+        # Contadores materializados, mantenidos por triggers (ver init_stats_tables)
+        contadores = await consultas.ejecutar_async(CONTADORES_QUERY, fetch_all=True)
+        if isinstance(contadores, dict):
+            raise HTTPException(status_code=500, detail=contadores['error'])
+        contadores = {row['clave']: row['valor'] for row in contadores}
         
-        cobertura_km2 = 0.0
-        if alcances:
-            for torre in alcances:
-                cobertura_km2 += math.pi * (torre['alcance_km'] ** 2)
+        # Cobertura total: área de la unión de los discos (sin contar solapamientos)
+        cobertura_km2 = await run_in_db_thread(cobertura.area_cubierta_km2)
         
         return EstadisticasResponse(
-            total_torres=total_torres,
-            torres_ecom=torres_ecom,
-            torres_policia=torres_policia,
-            torres_de_terceros=torres_terceros,
-            torres_visitadas=torres_visitadas,
+            total_torres=contadores.get('total_torres', 0),
+            torres_ecom=contadores.get('convenio:Ecom', 0),
+            torres_policia=contadores.get('convenio:Policia', 0),
+            torres_de_terceros=contadores.get('convenio:De tercero', 0),
+            torres_visitadas=contadores.get('torres_visitadas', 0),
             cobertura_km2=round(cobertura_km2, 2)
         )
     
@@ -442,6 +1096,88 @@ async def get_estadisticas():
         logger.error(f"Error obteniendo estadísticas: {e}")
         raise HTTPException(status_code=500, detail="Error interno del servidor")
 
+@api_router.get("/cobertura/analisis")
+async def get_analisis_cobertura(
+    request: Request,
+    response: Response,
+    lat_min: Optional[float] = Query(None, ge=-90, le=90),
+    lat_max: Optional[float] = Query(None, ge=-90, le=90),
+    lon_min: Optional[float] = Query(None, ge=-180, le=180),
+    lon_max: Optional[float] = Query(None, ge=-180, le=180),
+    celda_km: float = Query(1.0, ge=0.1, le=50),
+    formato: str = Query("resumen", pattern="^(resumen|raster|brechas)$"),
+):
+    """Análisis de cobertura sobre una grilla: áreas, zonas sin cobertura y redundancia
+
+    Sin rectángulo se analiza toda la región (ANALISIS_REGION). formato=raster
+    agrega el mapa de redundancia (torres que cubren cada celda) y
+    formato=brechas las zonas sin cobertura como GeoJSON.
+    """
+    region = analisis_cobertura.ANALISIS_REGION
+    lat_min = region[0] if lat_min is None else lat_min
+    lat_max = region[1] if lat_max is None else lat_max
+    lon_min = region[2] if lon_min is None else lon_min
+    lon_max = region[3] if lon_max is None else lon_max
+    if lat_min > lat_max or lon_min > lon_max:
+        raise HTTPException(status_code=400, detail="Rectángulo inválido")
+    no_modificado = _no_modificado(request, response, versiones.etag("Torres"))
+    if no_modificado:
+        return no_modificado
+    try:
+        grilla, conteo = await analisis_cobertura.analizar(lat_min, lat_max, lon_min, lon_max, celda_km)
+        # Áreas, raster y brechas recorren todas las celdas: fuera del event loop
+        informe = await run_in_threadpool(analisis_cobertura.informe, grilla, conteo, formato)
+        return {"celda_km": celda_km, **informe}
+    except analisis_cobertura.AnalisisError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error en análisis de cobertura: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+# =================== RUTAS DE ADMINISTRACIÓN ===================
+
+@api_router.post("/admin/estadisticas/reconstruir")
+async def reconstruir_estadisticas(current_user: str = Depends(get_current_user)):
+    """Recalcular los contadores de estadísticas y reportar la deriva encontrada"""
+    try:
+        resultado = await run_with_db(estadisticas.reconstruir_contadores)
+        if resultado['deriva']:
+            logger.warning(f"Deriva en estadísticas materializadas: {resultado['deriva']}")
+        return resultado
+    except Exception as e:
+        logger.error(f"Error reconstruyendo estadísticas: {e}")
+        raise HTTPException(status_code=500, detail="Error interno del servidor")
+
+@api_router.get("/admin/cache-tokens")
+async def get_cache_tokens(current_user: str = Depends(get_current_user)):
+    """Métricas del cache de tokens verificados"""
+    return token_cache.stats()
+
+@api_router.get("/admin/consultas")
+async def get_estadisticas_consultas(current_user: str = Depends(get_current_user)):
+    """Llamadas y tiempo acumulado por sentencia registrada"""
+    return consultas.estadisticas_consultas()
+
+ORDENES_LENTAS = ("tiempo_total_ms", "tiempo_max_ms", "ocurrencias", "filas_max")
+
+@api_router.get("/admin/consultas-lentas")
+async def get_consultas_lentas(
+    limit: int = Query(20, ge=1, le=500),
+    orden: str = Query("tiempo_total_ms"),
+    current_user: str = Depends(get_current_user)
+):
+    """Consultas que superaron CONSULTA_LENTA_MS, con su plan de ejecución"""
+    if orden not in ORDENES_LENTAS:
+        raise HTTPException(status_code=400, detail=f"orden debe ser uno de: {', '.join(ORDENES_LENTAS)}")
+    registro = consultas_lentas.get_registro_lentas()
+    return {
+        "umbral_ms": registro.umbral_ms,
+        "descartadas": registro.descartadas,
+        "consultas": registro.top(orden, limit),
+    }
+
 # =================== RUTAS GENERALES ===================
 
 @api_router.get("/")
@@ -449,19 +1185,40 @@ async def root():
     """Endpoint de salud"""
     return {"message": "Sistema de Gestión de Torres - API funcionando correctamente"}
 
+SALUD_QUERY = consultas.registrar("salud", "SELECT 1 as test")
+
 @api_router.get("/health")
 async def health_check():
     """Check de salud del sistema"""
     try:
         # Probar conexión a la base de datos
-        result = execute_query("SELECT 1 as test", fetch_one=True)
+        result = await consultas.ejecutar_async(SALUD_QUERY, fetch_one=True)
         if result and result.get('test') == 1:
-            return {"status": "healthy", "database": "connected"}
+            return {
+                "status": "healthy",
+                "database": "connected",
+                "pool": get_pool_stats(),
+                "sqlite": await run_in_db_thread(get_sqlite_profile),
+                "cambios": cambios.get_hub().stats(),
+                "analisis_cobertura": analisis_cobertura.stats(),
+            }
         else:
             return {"status": "unhealthy", "database": "disconnected"}
     except Exception as e:
         return {"status": "unhealthy", "error": str(e)}
 
+# =================== MÉTRICAS ===================
+
+# Si se define, /metrics exige "Authorization: Bearer <METRICAS_TOKEN>"
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN')
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metricas(request: Request):
+    """Métricas en formato de texto de Prometheus"""
+    if METRICAS_TOKEN and request.headers.get('authorization') != f"Bearer {METRICAS_TOKEN}":
+        raise HTTPException(status_code=401, detail="No autorizado")
+    return Response(content=metricas.exponer(), media_type=metricas.CONTENT_TYPE)
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -0,0 +1,286 @@
+import heapq
+import math
+import os
+import threading
+
+import numpy as np
+
+import eventos
+from database import execute_query
+from geo import EARTH_RADIUS_KM
+
+# Cambios acumulados (altas, bajas, ediciones) que disparan la reconstrucción de los árboles
+KNN_UMBRAL_CAMBIOS = int(os.getenv('KNN_UMBRAL_CAMBIOS', '512'))
+# Puntos por hoja del KD-tree
+KNN_HOJA = 16
+
+
+def unitario(lat, lon):
+    """Punto de la esfera unidad; la distancia euclídea (cuerda) crece con la geodésica"""
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+def cuerda_a_km(cuerda2):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(cuerda2) / 2))
+
+def km_a_cuerda(km):
+    return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+class KDTree:
+    """KD-tree estático sobre puntos 3D de la esfera unidad
+
+    Se construye con NumPy (partición por la mediana del eje más extendido) y
+    se recorre en Python puro: los nodos son listas [eje, corte, izq, der, caja]
+    y las hojas [-1, [(x, y, z, id), ...], caja], lo más barato de recorrer
+    sin extensiones nativas. La caja (mínimos y máximos por eje) poda mucho
+    mejor que el plano de corte cuando la consulta cae lejos de los puntos.
+    """
+
+    def __init__(self, puntos, ids, hoja=KNN_HOJA):
+        self.hoja = hoja
+        self._puntos = np.asarray(puntos, dtype=np.float64).reshape(-1, 3)
+        self._ids = list(ids)
+        self.raiz = self._construir(np.arange(len(self._ids))) if self._ids else None
+        del self._puntos, self._ids
+
+    def _construir(self, indices):
+        sub = self._puntos[indices]
+        minimos, maximos = sub.min(axis=0), sub.max(axis=0)
+        caja = (*minimos.tolist(), *maximos.tolist())
+        if indices.size <= self.hoja:
+            return [-1, [(*self._puntos[i].tolist(), self._ids[i]) for i in indices.tolist()], caja]
+        eje = int(np.argmax(maximos - minimos))
+        medio = indices.size // 2
+        particion = np.argpartition(sub[:, eje], medio)
+        corte = float(sub[particion[medio], eje])
+        return [eje, corte, self._construir(indices[particion[:medio]]),
+                self._construir(indices[particion[medio:]]), caja]
+
+    def vecinos(self, q, k, mejores, acepta=None, cota2=math.inf):
+        """Agregar a mejores (heap de (-cuerda², id), a lo sumo k) los puntos más cercanos a q
+
+        El heap puede venir con candidatos de otros árboles: se usa su peor
+        distancia para podar desde el principio.
+        """
+        if self.raiz is None:
+            return mejores
+        qx, qy, qz = q
+
+        def lejos_de(caja):
+            """Cuerda² de q a la caja comparada con la peor aceptable: True si no puede aportar"""
+            x0, y0, z0, x1, y1, z1 = caja
+            dx = x0 - qx if qx < x0 else (qx - x1 if qx > x1 else 0.0)
+            dy = y0 - qy if qy < y0 else (qy - y1 if qy > y1 else 0.0)
+            dz = z0 - qz if qz < z0 else (qz - z1 if qz > z1 else 0.0)
+            d2 = dx * dx + dy * dy + dz * dz
+            return d2 > cota2 or (len(mejores) >= k and d2 >= -mejores[0][0])
+
+        def visitar(nodo):
+            if lejos_de(nodo[-1]):
+                return
+            if nodo[0] < 0:
+                for x, y, z, punto_id in nodo[1]:
+                    d2 = (x - qx) ** 2 + (y - qy) ** 2 + (z - qz) ** 2
+                    if d2 > cota2 or (acepta is not None and not acepta(punto_id)):
+                        continue
+                    if len(mejores) < k:
+                        heapq.heappush(mejores, (-d2, punto_id))
+                    elif d2 < -mejores[0][0]:
+                        heapq.heapreplace(mejores, (-d2, punto_id))
+                return
+            eje, corte, izq, der, _ = nodo
+            if q[eje] <= corte:
+                visitar(izq)
+                visitar(der)
+            else:
+                visitar(der)
+                visitar(izq)
+
+        visitar(self.raiz)
+        return mejores
+
+
+class IndiceVecinos:
+    """k vecinos más cercanos entre las torres, con un KD-tree general y uno por (estado, tipo)
+
+    Las escrituras no tocan los árboles: la torre se marca como tapada (su
+    entrada vieja se ignora) y su versión nueva queda en una lista chica que
+    se recorre en cada consulta. Al juntar KNN_UMBRAL_CAMBIOS cambios los
+    árboles se reconstruyen en un hilo aparte y se reemplazan de una vez.
+    """
+
+    def __init__(self, umbral_cambios=KNN_UMBRAL_CAMBIOS):
+        self.umbral_cambios = umbral_cambios
+        self._lock = threading.Lock()
+        # id -> (x, y, z, latitud, longitud, nombre, estado, tipo, tipo_convenio)
+        self._torres = {}
+        self._arbol_todas = None
+        self._arboles = {}
+        self._extra = {}
+        self._tapadas = set()
+        # Ids cambiados durante una reconstrucción en curso (None si no hay ninguna)
+        self._cambios_reconstruccion = None
+        self.reconstrucciones = 0
+
+    @staticmethod
+    def _registro(lat, lon, nombre, estado, tipo, convenio):
+        if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None
+        lat, lon = float(lat), float(lon)
+        return (*unitario(lat, lon), lat, lon, nombre, estado, tipo, convenio)
+
+    @staticmethod
+    def _construir_arboles(torres):
+        """(árbol con todas las torres, {(estado, tipo): árbol}); sin filtro se recorre uno solo
+
+        Con filtros se recorren sólo los árboles que los cumplen: un tipo o
+        estado inexistente no obliga a descartar torre por torre todo el índice.
+        """
+        por_clase = {}
+        for torre_id, registro in torres.items():
+            por_clase.setdefault((registro[6], registro[7]), []).append(torre_id)
+        todas = KDTree([registro[:3] for registro in torres.values()], torres.keys())
+        return todas, {
+            clase: KDTree([torres[torre_id][:3] for torre_id in ids], ids)
+            for clase, ids in por_clase.items()
+        }
+
+    def build(self, torres):
+        """Reconstruir desde (id, latitud, longitud, nombre, estado, tipo, tipo_convenio)"""
+        registros = {}
+        for torre_id, lat, lon, nombre, estado, tipo, convenio in torres:
+            registro = self._registro(lat, lon, nombre, estado, tipo, convenio)
+            if registro is not None:
+                registros[torre_id] = registro
+        todas, arboles = self._construir_arboles(registros)
+        with self._lock:
+            self._torres = registros
+            self._arbol_todas = todas
+            self._arboles = arboles
+            self._extra = {}
+            self._tapadas = set()
+            self._cambios_reconstruccion = None
+
+    def _reconstruir(self):
+        with self._lock:
+            foto = dict(self._torres)
+        todas, arboles = self._construir_arboles(foto)
+        with self._lock:
+            # Lo cambiado mientras se construía sigue tapado en los árboles nuevos
+            cambiadas = self._cambios_reconstruccion
+            if cambiadas is None:
+                # Hubo un build completo en el medio: estos árboles ya son viejos
+                return
+            self._arbol_todas = todas
+            self._arboles = arboles
+            self._tapadas = set(cambiadas)
+            self._extra = {torre_id: self._torres[torre_id] for torre_id in cambiadas if torre_id in self._torres}
+            self._cambios_reconstruccion = None
+            self.reconstrucciones += 1
+
+    def upsert(self, torre_id, lat, lon, nombre, estado, tipo, convenio):
+        registro = self._registro(lat, lon, nombre, estado, tipo, convenio)
+        with self._lock:
+            if registro is None:
+                self._torres.pop(torre_id, None)
+                self._extra.pop(torre_id, None)
+            else:
+                self._torres[torre_id] = registro
+                self._extra[torre_id] = registro
+            self._tapadas.add(torre_id)
+            if self._cambios_reconstruccion is not None:
+                self._cambios_reconstruccion.add(torre_id)
+            elif len(self._tapadas) >= self.umbral_cambios:
+                self._cambios_reconstruccion = set()
+                threading.Thread(target=self._reconstruir, daemon=True).start()
+
+    def remove(self, torre_id):
+        self.upsert(torre_id, None, None, None, None, None, None)
+
+    def knn(self, lat, lon, k, estados=None, tipo=None, max_km=None):
+        """Las k torres más cercanas a (lat, lon), opcionalmente filtradas y dentro de max_km"""
+        q = unitario(lat, lon)
+        cota2 = km_a_cuerda(max_km) ** 2 if max_km is not None else math.inf
+        mejores = []
+        with self._lock:
+            torres, tapadas = self._torres, self._tapadas
+            # Los filtros ya los resuelve la elección de árboles; sólo falta ignorar lo tapado
+            if not tapadas:
+                acepta = None
+            else:
+                def acepta(torre_id):
+                    return torre_id not in tapadas
+            if estados is None and tipo is None:
+                arboles = [self._arbol_todas] if self._arbol_todas is not None else []
+            else:
+                arboles = [
+                    arbol for (estado, tipo_arbol), arbol in self._arboles.items()
+                    if (estados is None or estado in estados) and (tipo is None or tipo_arbol == tipo)
+                ]
+            for arbol in arboles:
+                arbol.vecinos(q, k, mejores, acepta, cota2)
+            for torre_id, registro in self._extra.items():
+                if (estados is not None and registro[6] not in estados) or (tipo is not None and registro[7] != tipo):
+                    continue
+                d2 = (registro[0] - q[0]) ** 2 + (registro[1] - q[1]) ** 2 + (registro[2] - q[2]) ** 2
+                if d2 > cota2:
+                    continue
+                if len(mejores) < k:
+                    heapq.heappush(mejores, (-d2, torre_id))
+                elif d2 < -mejores[0][0]:
+                    heapq.heapreplace(mejores, (-d2, torre_id))
+            resultado = []
+            for menos_d2, torre_id in sorted(mejores, reverse=True):
+                _, _, _, torre_lat, torre_lon, nombre, estado, tipo_torre, convenio = torres[torre_id]
+                resultado.append({
+                    "id": torre_id, "nombre": nombre, "latitud": torre_lat, "longitud": torre_lon,
+                    "estado": estado, "tipo": tipo_torre, "tipo_convenio": convenio,
+                    "distancia_km": round(cuerda_a_km(-menos_d2), 3),
+                })
+        return resultado
+
+    def stats(self):
+        with self._lock:
+            return {
+                "torres": len(self._torres),
+                "pendientes": len(self._tapadas),
+                "reconstrucciones": self.reconstrucciones,
+            }
+
+    def __len__(self):
+        return len(self._torres)
+
+
+# =================== ÍNDICE COMPARTIDO ===================
+
+_indice = IndiceVecinos()
+
+def _leer_torres():
+    torres = execute_query(
+        "SELECT id, latitud, longitud, nombre, estado, tipo, tipo_convenio FROM Torres",
+        fetch_all=True
+    )
+    if isinstance(torres, dict):
+        raise Exception(torres['error'])
+    return [
+        (t['id'], t['latitud'], t['longitud'], t['nombre'], t['estado'], t['tipo'], t['tipo_convenio'])
+        for t in torres
+    ]
+
+def _aplicar(accion, torre_id, datos):
+    if accion == eventos.DELETE:
+        _indice.remove(torre_id)
+    elif datos:
+        _indice.upsert(torre_id, datos.get('latitud'), datos.get('longitud'), datos.get('nombre'),
+                       datos.get('estado'), datos.get('tipo'), datos.get('tipo_convenio'))
+
+_sincronizado = eventos.IndiceSincronizado("Torres", _leer_torres, _indice.build, _aplicar)
+
+def get_indice_vecinos():
+    """Índice cargado desde la base (bloqueante: usar fuera del event loop)"""
+    _sincronizado.cargar()
+    return _indice
+
+def torres_cercanas(lat, lon, k, estados=None, tipo=None, max_km=None):
+    return get_indice_vecinos().knn(lat, lon, k, estados, tipo, max_km)
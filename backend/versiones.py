@@ -0,0 +1,105 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import eventos
+
+# Identifica la vida del proceso: al reiniciar cambian todos los ETags, porque
+# los contadores en memoria vuelven a cero (con varios workers cada uno tiene
+# su propia época y sus propios contadores)
+EPOCA = uuid.uuid4().hex[:8]
+# Filas con versión propia por tabla; las más viejas pasan a usar la versión piso
+VERSIONES_MAX_FILAS = int(os.getenv('VERSIONES_MAX_FILAS', '100000'))
+
+
+class Versiones:
+    """Contadores de versión por tabla y por fila, incrementados en cada escritura
+
+    Se recuerda la versión de a lo sumo max_filas filas por tabla. Al pasar el
+    tope se olvida la escrita hace más tiempo (la de menor versión) y el piso
+    sube hasta ella: toda fila sin versión propia informa el piso. Así una
+    fila olvidada nunca vuelve a un ETag que tuvo antes de su última
+    escritura; a lo sumo cambia el ETag de filas que no cambiaron.
+    """
+
+    def __init__(self, epoca=EPOCA, max_filas=VERSIONES_MAX_FILAS):
+        self.epoca = epoca
+        self.max_filas = max_filas
+        self._lock = threading.Lock()
+        self._tablas = {}
+        # tabla -> OrderedDict(id -> versión), en orden de escritura
+        self._filas = {}
+        # Versión de las filas sin versión propia (no escritas u olvidadas)
+        self._base = {}
+
+    def incrementar(self, tabla, registro_id=None, recarga=False):
+        with self._lock:
+            version = self._tablas.get(tabla, 0) + 1
+            self._tablas[tabla] = version
+            if recarga:
+                self._base[tabla] = version
+                self._filas.pop(tabla, None)
+            elif registro_id is not None:
+                filas = self._filas.setdefault(tabla, OrderedDict())
+                filas.pop(registro_id, None)
+                filas[registro_id] = version
+                if len(filas) > self.max_filas:
+                    _, self._base[tabla] = filas.popitem(last=False)
+            return version
+
+    def version(self, tabla):
+        return self._tablas.get(tabla, 0)
+
+    def version_fila(self, tabla, registro_id):
+        with self._lock:
+            return self._filas.get(tabla, {}).get(registro_id, self._base.get(tabla, 0))
+
+    def etag(self, *tablas):
+        """ETag fuerte de un recurso que depende de las tablas indicadas"""
+        partes = '.'.join(f"{self.version(tabla)}" for tabla in tablas)
+        return f'"{self.epoca}-{partes}"'
+
+    def etag_fila(self, tabla, registro_id):
+        return f'"{self.epoca}-{tabla}-{registro_id}-{self.version_fila(tabla, registro_id)}"'
+
+
+_versiones = Versiones()
+
+def etag(*tablas):
+    return _versiones.etag(*tablas)
+
+def etag_fila(tabla, registro_id):
+    return _versiones.etag_fila(tabla, registro_id)
+
+def _suscriptor(tabla):
+    def _on_escritura(accion, registro_id, datos):
+        _versiones.incrementar(tabla, registro_id, recarga=accion == eventos.RECARGA)
+    return _on_escritura
+
+for _tabla in ("Torres", "Mantenimientos"):
+    eventos.suscribir(_tabla, _suscriptor(_tabla))
+
+
+def _etags(cabecera):
+    return [valor.strip() for valor in cabecera.split(',') if valor.strip()]
+
+def coincide_none_match(cabecera, etag):
+    """If-None-Match: comparación débil (ignora el prefijo W/)"""
+    if not cabecera:
+        return False
+    if cabecera.strip() == '*':
+        return True
+    return any(candidato.removeprefix('W/') == etag for candidato in _etags(cabecera))
+
+def coincide_match(cabecera, etag):
+    """If-Match: comparación fuerte; sin cabecera siempre coincide"""
+    if cabecera is None:
+        return True
+    if cabecera.strip() == '*':
+        return True
+    return any(candidato == etag for candidato in _etags(cabecera))
+
+def cabeceras(etag):
+    # no-cache: el navegador puede guardar la respuesta pero debe revalidarla
+    return {"ETag": etag, "Cache-Control": "no-cache"}
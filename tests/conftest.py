@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Base y almacén de imágenes temporales: se fijan antes de importar database/blobs
+_DIRECTORIO = tempfile.mkdtemp(prefix="torres-tests-")
+os.environ.setdefault('SQLITE_DB_PATH', str(Path(_DIRECTORIO) / "torres.db"))
+os.environ.setdefault('BLOB_DIR', str(Path(_DIRECTORIO) / "blobs"))
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+@pytest.fixture(scope="session")
+def cliente():
+    """Cliente de la API sobre la base temporal (con los datos de ejemplo)"""
+    from fastapi.testclient import TestClient
+
+    import server
+    with TestClient(server.app) as cliente:
+        yield cliente
+
+
+@pytest.fixture(scope="session")
+def autorizacion():
+    """Encabezado Authorization con un token válido para las rutas protegidas"""
+    from datetime import timedelta
+
+    from auth import create_access_token
+    token = create_access_token({"sub": "12345678", "user_id": 1}, expires_delta=timedelta(hours=1))
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,82 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from analisis_cobertura import AnalisisCobertura
+from cobertura import Grilla
+
+RECTANGULO = (-28.0, -25.0, -62.0, -58.0)
+
+
+@pytest.fixture(scope="module")
+def executor():
+    with ThreadPoolExecutor(2) as pool:
+        yield pool
+
+
+def _torre(rnd):
+    return rnd.uniform(-28.5, -24.5), rnd.uniform(-62.5, -57.5), rnd.uniform(1, 30)
+
+
+def _directo(grilla, torres):
+    lat, lon, alcance = (np.array(v, dtype=np.float64) for v in zip(*torres.values()))
+    referencia = Grilla.alineada(grilla.lat_min, grilla.lon_min, grilla.dlat, grilla.dlon, grilla.filas, grilla.columnas)
+    return referencia.rasterizar(lat, lon, alcance)
+
+
+def test_mosaico_coincide_con_calculo_directo_tras_cambios(executor):
+    rnd = random.Random(7)
+    torres = {i: _torre(rnd) for i in range(200)}
+    analisis = AnalisisCobertura()
+    analisis.build([(i, *t) for i, t in torres.items()])
+
+    async def escenario():
+        for paso in range(4):
+            grilla, conteo = await analisis.raster(*RECTANGULO, 4.0, executor)
+            assert np.array_equal(conteo, _directo(grilla, torres))
+            for _ in range(20):
+                torre_id = rnd.randrange(250)
+                if rnd.random() < 0.3 and torre_id in torres:
+                    del torres[torre_id]
+                    analisis.remove(torre_id)
+                else:
+                    torres[torre_id] = _torre(rnd)
+                    analisis.upsert(torre_id, *torres[torre_id])
+
+    asyncio.run(escenario())
+    # Sólo se recalculan las teselas que tocaron las torres cambiadas
+    assert analisis.aciertos > 0
+
+
+def test_pedidos_simultaneos_comparten_las_teselas(executor):
+    analisis = AnalisisCobertura()
+    analisis.build([(1, -26.5, -60.0, 25.0), (2, -27.0, -59.0, 10.0)])
+
+    async def escenario():
+        primero, segundo = await asyncio.gather(
+            analisis.raster(*RECTANGULO, 4.0, executor),
+            analisis.raster(*RECTANGULO, 4.0, executor),
+        )
+        assert np.array_equal(primero[1], segundo[1])
+
+    asyncio.run(escenario())
+    assert analisis.stats()["calculadas"] == analisis.stats()["teselas_en_cache"]
+
+
+def test_cancelar_un_pedido_no_afecta_a_los_demas(executor):
+    analisis = AnalisisCobertura()
+    analisis.build([(1, -26.5, -60.0, 25.0)])
+
+    async def escenario():
+        cancelado = asyncio.ensure_future(analisis.raster(*RECTANGULO, 4.0, executor))
+        otro = asyncio.ensure_future(analisis.raster(*RECTANGULO, 4.0, executor))
+        await asyncio.sleep(0)
+        cancelado.cancel()
+        grilla, conteo = await otro
+        assert conteo.max() == 1
+        assert cancelado.cancelled()
+
+    asyncio.run(escenario())
@@ -0,0 +1,99 @@
+import time
+from datetime import timedelta
+
+import pytest
+from passlib.hash import bcrypt
+
+import auth
+from database import execute_query
+
+DNI = 30111222
+CLAVE = "clave-de-prueba"
+
+
+def _login(cliente, clave=CLAVE):
+    return cliente.post("/api/auth/login", json={"username": str(DNI), "password": clave})
+
+
+def _hash_guardado():
+    return execute_query("SELECT cifrado FROM USUARIOTORRISTA WHERE norDni = ?", (DNI,), fetch_one=True)["cifrado"]
+
+
+@pytest.fixture(scope="module")
+def usuario(cliente):
+    respuesta = cliente.post("/api/auth/register", json={
+        "nombre": "Ana", "apellido": "Prueba", "norDni": DNI, "password": CLAVE,
+    })
+    assert respuesta.status_code == 200
+    return DNI
+
+
+def test_registro_y_rehash_al_iniciar_sesion(cliente, usuario):
+    assert auth.pwd_context.identify(_hash_guardado()) == "bcrypt"
+    assert _login(cliente, "otra clave").status_code == 401
+
+    # Hash con otro costo (por ejemplo, de antes de subir BCRYPT_ROUNDS): se regenera al entrar
+    viejo = bcrypt.using(rounds=auth.BCRYPT_ROUNDS + 1).hash(CLAVE)
+    execute_query("UPDATE USUARIOTORRISTA SET cifrado = ? WHERE norDni = ?", (viejo, DNI))
+    assert _login(cliente).status_code == 200
+    nuevo = _hash_guardado()
+    assert nuevo != viejo and auth.pwd_context.verify(CLAVE, nuevo)
+    assert not auth.pwd_context.needs_update(nuevo)
+
+    # Con el costo vigente no se vuelve a escribir
+    assert _login(cliente).status_code == 200
+    assert _hash_guardado() == nuevo
+
+
+def test_cola_de_bcrypt_llena_da_503(cliente, usuario, monkeypatch):
+    monkeypatch.setattr(auth, "_hash_pending", auth.HASH_QUEUE_LIMIT)
+    respuesta = _login(cliente)
+    assert respuesta.status_code == 503
+    assert respuesta.headers["Retry-After"]
+    # La operación rechazada no quedó contada como pendiente
+    assert auth.get_hash_queue_depth() == auth.HASH_QUEUE_LIMIT
+    monkeypatch.undo()
+    assert _login(cliente).status_code == 200
+
+
+def _token(**datos):
+    return auth.create_access_token({"sub": str(DNI), "user_id": 1, **datos}, expires_delta=timedelta(minutes=5))
+
+
+def test_cache_de_tokens_vence_y_desaloja():
+    cache = auth.TokenCache(max_size=2)
+    ahora = time.time()
+    cache.put("a", {"sub": "1", "exp": ahora + 60})
+    cache.put("b", {"sub": "2", "exp": ahora - 1})
+    # Una entrada vencida no se devuelve aunque esté en el cache
+    assert cache.get("a") == {"sub": "1", "exp": ahora + 60}
+    assert cache.get("b") is None and cache.stats()["expirados"] == 1
+    cache.put("c", {"sub": "3", "exp": ahora + 60})
+    cache.put("d", {"sub": "4", "exp": ahora + 60})
+    assert cache.get("a") is None and cache.stats()["desalojados"] == 1
+    # Sin exp no se guarda: no habría cuándo olvidarlo
+    cache.put("e", {"sub": "5"})
+    assert cache.get("e") is None
+
+
+def test_token_verificado_sale_del_cache(cliente):
+    token = _token()
+    encabezado = {"Authorization": f"Bearer {token}"}
+    antes = cliente.get("/api/admin/cache-tokens", headers=encabezado).json()
+    despues = cliente.get("/api/admin/cache-tokens", headers=encabezado).json()
+    assert despues["hits"] == antes["hits"] + 1 and despues["misses"] == antes["misses"]
+
+    # Firma inválida o vencido: 401 aunque el cache tenga otros tokens
+    falsificado = token[:-2] + ("AA" if not token.endswith("AA") else "BB")
+    assert cliente.get("/api/admin/cache-tokens", headers={"Authorization": f"Bearer {falsificado}"}).status_code == 401
+    vencido = auth.create_access_token({"sub": str(DNI)}, expires_delta=timedelta(seconds=-1))
+    respuesta = cliente.get("/api/admin/cache-tokens", headers={"Authorization": f"Bearer {vencido}"})
+    assert respuesta.status_code == 401 and respuesta.json()["detail"] == "Token expirado"
+
+
+def test_logout_revoca_el_token_cacheado(cliente):
+    encabezado = {"Authorization": f"Bearer {_token(jti='logout')}"}
+    assert cliente.get("/api/admin/cache-tokens", headers=encabezado).status_code == 200
+    assert cliente.post("/api/auth/logout", headers=encabezado).status_code == 200
+    respuesta = cliente.get("/api/admin/cache-tokens", headers=encabezado)
+    assert respuesta.status_code == 401 and respuesta.json()["detail"] == "Token revocado"
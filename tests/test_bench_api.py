@@ -0,0 +1,69 @@
+import asyncio
+import random
+
+import httpx
+from starlette.routing import Match
+
+import bench_api
+import cambios
+import eventos
+
+
+def _contexto():
+    return {
+        "rnd": random.Random(1), "torres": 4, "dni": 40000000, "dni_usuario": bench_api.DNI_USUARIO,
+        "auth": {}, "etag_torres": '"x"', "cursor_mantenimientos": "c", "blob": "a" * 64,
+        "mantenimiento": 1, "hub": cambios.CambiosHub(),
+    }
+
+
+def test_hay_un_escenario_por_ruta(cliente):
+    import server
+
+    ctx = _contexto()
+    cubiertas = set()
+    for nombre, _, armar in bench_api.ESCENARIOS:
+        peticion = armar(ctx, 0)
+        scope = {"type": "http", "path": peticion["url"].split("?")[0], "method": peticion["method"], "root_path": ""}
+        rutas = [ruta for ruta in server.app.routes if ruta.matches(scope)[0] == Match.FULL]
+        assert rutas, f"El escenario {nombre} no llega a ninguna ruta"
+        cubiertas.add((peticion["method"], rutas[0].path))
+
+    faltan = {
+        (metodo, ruta.path)
+        for ruta in server.app.routes if getattr(ruta, "include_in_schema", False) or ruta.path == "/metrics"
+        for metodo in getattr(ruta, "methods", ()) if metodo != "HEAD"
+    } - cubiertas
+    assert not faltan
+
+
+def test_percentiles_y_comparacion():
+    assert bench_api._percentil([], 50) is None
+    assert bench_api._percentil(list(range(1, 101)), 95) == 95
+    assert bench_api._percentil([7], 99) == 7
+    anterior = {"escenarios": {"a": {"p95_ms": 10.0}, "b": {"p95_ms": 10.0}}}
+    actual = {"escenarios": {"a": {"p95_ms": 11.0}, "b": {"p95_ms": 13.0}, "nuevo": {"p95_ms": 1.0}}}
+    assert bench_api.comparar(actual, anterior, 0.2) == ["b"]
+
+
+def test_correr_escenarios_contra_la_app(cliente, monkeypatch):
+    import server
+
+    monkeypatch.setattr(cambios, "_hub", cambios.CambiosHub())
+
+    async def escenario():
+        cambios._hub.publicar(eventos.INSERT, 1, {"nombre": "T"})
+        ctx = {**_contexto(), "app": server.app, "hub": cambios._hub}
+        transporte = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench") as http:
+            lectura = await bench_api.correr_escenario(
+                http, ctx, lambda ctx, i: {"method": "GET", "url": "/api/torres?limit=2"}, 6, 3)
+            stream = await bench_api.correr_escenario(http, ctx, bench_api._stream, 3, 2)
+        return lectura, stream
+
+    lectura, stream = asyncio.run(escenario())
+    assert lectura["codigos"] == {"200": 6} and lectura["concurrencia"] == 3
+    assert lectura["p50_ms"] <= lectura["p95_ms"] <= lectura["max_ms"]
+    # El stream no termina: se mide hasta el primer evento y se desconecta
+    assert stream["codigos"] == {"200": 3} and stream["errores"] == 0
+    assert cambios._hub.stats()["suscriptores"] == 0
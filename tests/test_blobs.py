@@ -0,0 +1,123 @@
+import base64
+
+import pytest
+
+import blobs
+from database import execute_query
+
+
+def _antiguedad(sha256, horas):
+    execute_query(
+        "UPDATE Blobs SET fecha_creacion = datetime('now', ?) WHERE sha256 = ?",
+        (f"-{horas} hours", sha256)
+    )
+
+
+def _subir(cliente, contenido):
+    respuesta = cliente.post("/api/blobs", content=contenido, headers={"Content-Type": "image/png"})
+    assert respuesta.status_code == 200
+    return respuesta.json()["sha256"]
+
+
+def test_purga_respeta_subidas_recientes_y_vinculadas(cliente):
+    reciente = _subir(cliente, b"blob reciente sin vincular")
+    viejo = _subir(cliente, b"blob viejo sin vincular")
+    _antiguedad(viejo, 48)
+
+    assert blobs.purgar_blobs_huerfanos(gracia_horas=24) == 1
+    assert blobs.obtener_blob(reciente) and blobs.ruta_blob(reciente).exists()
+    assert blobs.obtener_blob(viejo) is None and not blobs.ruta_blob(viejo).exists()
+
+
+def test_purga_no_toca_blobs_vinculados(cliente):
+    imagen = base64.b64encode(b"\x89PNG\r\n\x1a\nimagen de mantenimiento").decode()
+    respuesta = cliente.post("/api/mantenimientos", json={
+        "TorreID": 1, "UsuarioTorristaID": 1, "fecha_inicio_mantenimiento": "2025-01-01T10:00:00",
+        "tipo_mantenimiento": "preventivo", "descripcion_trabajo": "Prueba", "imagen1_base64": imagen,
+    })
+    assert respuesta.status_code == 200
+    vinculado = execute_query(
+        "SELECT sha256 FROM MantenimientoImagenes ORDER BY rowid DESC LIMIT 1", fetch_one=True
+    )["sha256"]
+    _antiguedad(vinculado, 48)
+    blobs.purgar_blobs_huerfanos(gracia_horas=24)
+    assert blobs.obtener_blob(vinculado) and blobs.ruta_blob(vinculado).exists()
+
+
+def test_subir_de_nuevo_renueva_la_gracia_y_el_archivo(cliente):
+    contenido = b"blob que se vuelve a subir"
+    sha256 = _subir(cliente, contenido)
+    _antiguedad(sha256, 48)
+    # La misma subida deduplicada lo vuelve reciente: la purga ya no lo elimina
+    _subir(cliente, contenido)
+    blobs.purgar_blobs_huerfanos(gracia_horas=24)
+    assert blobs.obtener_blob(sha256) and blobs.ruta_blob(sha256).exists()
+
+    # Purgado y subido otra vez: fila y archivo vuelven juntos
+    _antiguedad(sha256, 48)
+    assert blobs.purgar_blobs_huerfanos(gracia_horas=24) == 1
+    _subir(cliente, contenido)
+    assert blobs.obtener_blob(sha256) and blobs.ruta_blob(sha256).read_bytes() == contenido
+
+
+def test_mantenimiento_sin_imagenes_guardadas_no_se_registra(cliente, monkeypatch):
+    def falla(conn, data, tipo_mime=None):
+        raise OSError("disco lleno")
+
+    antes = execute_query("SELECT COUNT(*) AS n FROM Mantenimientos", fetch_one=True)["n"]
+    monkeypatch.setattr(blobs, "guardar_bytes", falla)
+    respuesta = cliente.post("/api/mantenimientos", json={
+        "TorreID": 1, "UsuarioTorristaID": 1, "fecha_inicio_mantenimiento": "2025-01-01T10:00:00",
+        "tipo_mantenimiento": "correctivo", "descripcion_trabajo": "Prueba",
+        "imagen1_base64": base64.b64encode(b"imagen").decode(),
+    })
+    assert respuesta.status_code == 500
+    assert execute_query("SELECT COUNT(*) AS n FROM Mantenimientos", fetch_one=True)["n"] == antes
+
+
+def test_listado_devuelve_urls_de_imagenes(cliente):
+    contenido = b"\x89PNG\r\n\x1a\nimagen listada"
+    respuesta = cliente.post("/api/mantenimientos", json={
+        "TorreID": 2, "UsuarioTorristaID": 1, "fecha_inicio_mantenimiento": "2031-01-01T10:00:00",
+        "tipo_mantenimiento": "preventivo", "descripcion_trabajo": "Con imagen",
+        "imagen2_base64": base64.b64encode(contenido).decode(),
+    })
+    assert respuesta.status_code == 200
+    ultimo = cliente.get("/api/mantenimientos", params={"torre_id": 2, "limit": 1, "incluir_imagenes": True}).json()[0]
+    assert [imagen["posicion"] for imagen in ultimo["imagenes"]] == [2]
+    assert cliente.get(ultimo["imagenes"][0]["url"]).content == contenido
+
+    pedido = cliente.get("/api/mantenimientos", params={"torre_id": 2, "limit": 1, "fields": "id,imagenes"}).json()
+    assert pedido == [{"id": ultimo["id"], "imagenes": ultimo["imagenes"]}]
+    assert "imagenes" not in cliente.get("/api/mantenimientos", params={"limit": 1}).json()[0]
+    respuesta = cliente.get("/api/mantenimientos", params={"fields": "id,imagen1_base64"})
+    assert respuesta.status_code == 400
+
+
+def test_base64_invalido_o_grande_se_rechaza():
+    datos = bytes(range(256)) * 4
+    codificado = base64.b64encode(datos).decode()
+    # Saltos de línea (base64 MIME) se aceptan
+    partido = "\n".join(codificado[i:i + 76] for i in range(0, len(codificado), 76))
+    assert blobs.decodificar_base64(partido) == (datos, None)
+    assert blobs.decodificar_base64("data:image/png;base64," + codificado) == (datos, "image/png")
+    with pytest.raises(blobs.BlobError):
+        blobs.decodificar_base64(codificado[:100] + "*" + codificado[100:])
+    with pytest.raises(blobs.BlobDemasiadoGrande):
+        blobs.decodificar_base64(codificado, max_bytes=len(datos) - 1)
+    assert blobs.decodificar_base64(codificado, max_bytes=len(datos))[0] == datos
+
+
+def test_mantenimiento_con_imagen_invalida_no_se_registra(cliente, monkeypatch):
+    antes = execute_query("SELECT COUNT(*) AS n FROM Mantenimientos", fetch_one=True)["n"]
+    pedido = {
+        "TorreID": 1, "UsuarioTorristaID": 1, "fecha_inicio_mantenimiento": "2025-01-01T10:00:00",
+        "tipo_mantenimiento": "correctivo", "descripcion_trabajo": "Prueba",
+        "imagen1_base64": base64.b64encode(b"imagen valida").decode(),
+        "imagen2_base64": "aW1hZ2Vu#ZW4=",
+    }
+    assert cliente.post("/api/mantenimientos", json=pedido).status_code == 400
+    monkeypatch.setattr(blobs, "BLOB_MAX_BYTES", 8)
+    pedido["imagen2_base64"] = base64.b64encode(b"imagen demasiado grande").decode()
+    assert cliente.post("/api/mantenimientos", json=pedido).status_code == 413
+    assert execute_query("SELECT COUNT(*) AS n FROM Mantenimientos", fetch_one=True)["n"] == antes
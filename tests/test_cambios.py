@@ -0,0 +1,89 @@
+import asyncio
+import json
+import threading
+
+import cambios
+import eventos
+
+
+def _torre(**cambios_torre):
+    return {"nombre": "T", "estado": "operativa", "latitud": -27.0, "longitud": -59.0, **cambios_torre}
+
+
+def _leer(texto):
+    """Evento de un bloque SSE (id + data)"""
+    lineas = dict(linea.split(": ", 1) for linea in texto.strip().split("\n"))
+    evento = json.loads(lineas["data"])
+    assert int(lineas["id"]) == evento["seq"]
+    return evento
+
+
+def test_solo_viajan_los_campos_que_cambiaron():
+    async def escenario():
+        hub = cambios.CambiosHub()
+        suscripcion, _ = hub.suscribir()
+        hub.publicar(eventos.INSERT, 1, _torre())
+        hub.publicar(eventos.UPDATE, 1, _torre(estado="mantenimiento", notas="no viaja"))
+        # Sin cambios en los campos del feed no se emite nada
+        hub.publicar(eventos.UPDATE, 1, _torre(estado="mantenimiento"))
+        hub.publicar(eventos.DELETE, 1)
+        return [suscripcion.cola.get_nowait() for _ in range(suscripcion.cola.qsize())]
+
+    alta, cambio, baja = asyncio.run(escenario())
+    assert alta["cambios"] == _torre()
+    assert cambio == {"seq": 2, "accion": eventos.UPDATE, "id": 1, "cambios": {"estado": "mantenimiento"}}
+    assert baja == {"seq": 3, "accion": eventos.DELETE, "id": 1}
+
+
+def test_reanudar_con_since():
+    async def escenario():
+        hub = cambios.CambiosHub(historial=3)
+        for torre_id in range(1, 6):
+            hub.publicar(eventos.INSERT, torre_id, _torre())
+        _, desde_tres = hub.suscribir(since=3)
+        _, al_dia = hub.suscribir(since=5)
+        # Fuera del historial (o de otro proceso): se pide recargar
+        _, vieja = hub.suscribir(since=1)
+        _, futura = hub.suscribir(since=9)
+        return desde_tres, al_dia, vieja, futura
+
+    desde_tres, al_dia, vieja, futura = asyncio.run(escenario())
+    assert [evento["seq"] for evento in desde_tres] == [4, 5]
+    assert al_dia == []
+    assert [evento["accion"] for evento in vieja + futura] == [eventos.RECARGA] * 2
+
+
+def test_cliente_lento_recibe_una_recarga():
+    async def escenario():
+        hub = cambios.CambiosHub(max_pendientes=2)
+        lenta, _ = hub.suscribir()
+        for torre_id in range(1, 5):
+            hub.publicar(eventos.INSERT, torre_id, _torre())
+        return [lenta.cola.get_nowait() for _ in range(lenta.cola.qsize())], lenta.desbordes
+
+    pendientes, desbordes = asyncio.run(escenario())
+    # La cola no crece más allá del máximo: lo acumulado se reemplaza por una recarga
+    assert pendientes[0] == {"seq": 3, "accion": eventos.RECARGA}
+    assert [evento["seq"] for evento in pendientes] == [3, 4] and desbordes == 1
+
+
+def test_stream_sse_con_escrituras_desde_otro_hilo(monkeypatch):
+    monkeypatch.setattr(cambios, "_hub", cambios.CambiosHub())
+
+    async def escenario():
+        cambios._hub.publicar(eventos.INSERT, 7, _torre())
+        stream = cambios.stream_sse(since=0, heartbeat=0.05)
+        reenviado = await stream.__anext__()
+        assert await stream.__anext__() == ": ping\n\n"
+        # Los handlers publican desde el executor de la base: el hub se actualiza en el loop
+        hilo = threading.Thread(target=cambios._on_torre, args=(eventos.UPDATE, 7, _torre(estado="inactiva")))
+        hilo.start()
+        hilo.join()
+        nuevo = await asyncio.wait_for(stream.__anext__(), 1.0)
+        await stream.aclose()
+        return reenviado, nuevo
+
+    reenviado, nuevo = asyncio.run(escenario())
+    assert _leer(reenviado)["id"] == 7
+    assert _leer(nuevo) == {"seq": 2, "accion": eventos.UPDATE, "id": 7, "cambios": {"estado": "inactiva"}}
+    assert cambios._hub.stats()["suscriptores"] == 0
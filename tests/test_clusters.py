@@ -0,0 +1,97 @@
+import math
+import random
+
+import pytest
+
+from clusters import ClusterError, ClusterIndex
+
+ESTADOS = ["operativa", "mantenimiento", "limitada"]
+CONVENIOS = ["Policia", "Ecom"]
+
+
+def _torre(rnd):
+    # Zona chica para que haya celdas con varias torres en todos los niveles
+    return (rnd.uniform(-27.6, -27.3), rnd.uniform(-59.1, -58.8), rnd.choice(ESTADOS), rnd.choice(CONVENIOS))
+
+
+def _assert_mismo_indice(incremental, reconstruido):
+    assert incremental._torres == reconstruido._torres
+    for zoom, (nivel, esperado) in enumerate(zip(incremental._niveles, reconstruido._niveles)):
+        assert nivel.keys() == esperado.keys(), f"zoom {zoom}"
+        for clave, celda in nivel.items():
+            otra = esperado[clave]
+            assert isinstance(celda, list) == isinstance(otra, list), f"zoom {zoom}, celda {clave}"
+            if not isinstance(celda, list):
+                assert celda == otra
+                continue
+            assert celda[0] == otra[0] and celda[3] == otra[3] and celda[4] == otra[4]
+            assert celda[1] == pytest.approx(otra[1]) and celda[2] == pytest.approx(otra[2])
+            assert celda[5:] == otra[5:]
+
+
+def test_upsert_y_remove_coinciden_con_build():
+    rnd = random.Random(7)
+    torres = {i: _torre(rnd) for i in range(800)}
+    indice = ClusterIndex(max_zoom=14)
+    indice.build([(i, *t) for i, t in torres.items()])
+    for _ in range(3000):
+        torre_id = rnd.randrange(1000)
+        operacion = rnd.random()
+        if operacion < 0.3:
+            indice.remove(torre_id)
+            torres.pop(torre_id, None)
+        elif operacion < 0.4 and torre_id in torres:
+            # Sólo cambia el estado: misma celda, otros conteos
+            lat, lon, _, convenio = torres[torre_id]
+            torres[torre_id] = (lat, lon, rnd.choice(ESTADOS), convenio)
+            indice.upsert(torre_id, *torres[torre_id])
+        else:
+            torres[torre_id] = _torre(rnd)
+            indice.upsert(torre_id, *torres[torre_id])
+    reconstruido = ClusterIndex(max_zoom=14)
+    reconstruido.build([(i, *t) for i, t in torres.items()])
+    _assert_mismo_indice(indice, reconstruido)
+
+
+def test_totales_y_conteos_por_zoom():
+    rnd = random.Random(3)
+    torres = {i: _torre(rnd) for i in range(500)}
+    indice = ClusterIndex(max_zoom=14, max_celdas=10 ** 6)
+    indice.build([(i, *t) for i, t in torres.items()])
+    for zoom in range(0, 16):
+        resultado = indice.clusters(-59.1, -27.6, -58.8, -27.3, zoom)
+        assert sum(cluster["cantidad"] for cluster in resultado) == len(torres)
+        for estado in ESTADOS:
+            assert sum(cluster["estados"].get(estado, 0) for cluster in resultado) == sum(
+                1 for t in torres.values() if t[2] == estado
+            )
+
+
+def test_zoom_mayor_al_maximo_devuelve_las_torres_del_rectangulo():
+    rnd = random.Random(5)
+    torres = {i: _torre(rnd) for i in range(500)}
+    indice = ClusterIndex(max_zoom=12)
+    indice.build([(i, *t) for i, t in torres.items()])
+    oeste, sur, este, norte = -59.0, -27.5, -58.95, -27.45
+    ids = {punto["id"] for punto in indice.clusters(oeste, sur, este, norte, 15)}
+    adentro = {i for i, (lat, lon, _, _) in torres.items() if sur <= lat <= norte and oeste <= lon <= este}
+    # Se devuelven las celdas que tocan el rectángulo: todas las de adentro y algunas vecinas
+    assert adentro <= ids
+    assert all(
+        math.isclose(p["lat"], torres[p["id"]][0]) for p in indice.clusters(oeste, sur, este, norte, 15)
+    )
+
+
+def test_rectangulo_con_demasiadas_celdas():
+    indice = ClusterIndex(max_celdas=4096)
+    indice.build([(1, -27.4, -59.0, "operativa", "Ecom")])
+    assert indice.clusters(-180, -85, 180, 85, 3)
+    with pytest.raises(ClusterError):
+        indice.clusters(-180, -85, 180, 85, 17)
+
+
+def test_endpoint_rechaza_vistas_enormes(cliente):
+    assert cliente.get("/api/torres/clusters?bbox=-180,-85,180,85&zoom=17").status_code == 400
+    respuesta = cliente.get("/api/torres/clusters?bbox=-61,-28,-58,-27&zoom=8")
+    assert respuesta.status_code == 200
+    assert respuesta.json()["total"] >= 4
@@ -0,0 +1,86 @@
+import random
+import threading
+import time
+
+import pytest
+
+from cobertura import CoverageEngine
+
+
+def _torre(rnd, lat=(-28.0, -24.0), lon=(-63.0, -58.0)):
+    return rnd.uniform(*lat), rnd.uniform(*lon), rnd.uniform(1, 40)
+
+
+def test_escrituras_incrementales_coinciden_con_build():
+    rnd = random.Random(4)
+    torres = {i: _torre(rnd) for i in range(300)}
+    motor = CoverageEngine(celda_km=1.0)
+    motor.build([(i, *t) for i, t in torres.items()])
+    for paso in range(400):
+        torre_id = rnd.randrange(400)
+        if rnd.random() < 0.3:
+            motor.remove(torre_id)
+            torres.pop(torre_id, None)
+        else:
+            # Algunas caen fuera de la grilla actual y dejan el raster pendiente
+            torres[torre_id] = _torre(rnd, lon=(-66.0, -55.0)) if paso % 50 == 0 else _torre(rnd)
+            motor.upsert(torre_id, *torres[torre_id])
+        if paso % 40 == 0:
+            nuevo = CoverageEngine(celda_km=1.0)
+            nuevo.build([(i, *t) for i, t in torres.items()])
+            assert motor.area_km2() == pytest.approx(nuevo.area_km2(), rel=2e-3)
+
+
+def test_torre_fuera_de_la_grilla_no_rehace_el_raster_al_escribir():
+    motor = CoverageEngine(celda_km=1.0)
+    motor.build([(1, -27.4, -59.0, 10)])
+    conteo = motor.conteo
+    motor.upsert(2, -25.0, -62.0, 10)
+    assert motor.conteo is conteo
+    area = motor.area_km2()
+    assert motor.conteo is not conteo
+    assert area == pytest.approx(2 * 3.14159 * 100, rel=0.05)
+
+
+def test_union_de_discos_superpuestos():
+    motor = CoverageEngine(celda_km=0.25)
+    motor.build([(1, -27.4, -59.0, 10), (2, -27.4, -59.0, 10), (3, -27.4, -59.0, 5)])
+    assert motor.area_km2() == pytest.approx(3.14159 * 100, rel=0.02)
+    motor.remove(1)
+    motor.remove(2)
+    assert motor.area_km2() == pytest.approx(3.14159 * 25, rel=0.03)
+
+
+def test_escrituras_no_esperan_al_rasterizado():
+    rnd = random.Random(9)
+    torres = {i: _torre(rnd) for i in range(200)}
+    motor = CoverageEngine(celda_km=1.0)
+    motor.build([(i, *t) for i, t in torres.items()])
+    rasterizar = motor._rasterizar
+    empezo = threading.Event()
+
+    def rasterizar_lento(foto):
+        empezo.set()
+        time.sleep(0.3)
+        return rasterizar(foto)
+
+    motor._rasterizar = rasterizar_lento
+    # Fuera de la grilla: el raster queda pendiente hasta la próxima consulta
+    torres[1000] = _torre(rnd, lon=(-70.0, -69.0))
+    motor.upsert(1000, *torres[1000])
+    consulta = threading.Thread(target=motor.area_km2)
+    consulta.start()
+    empezo.wait()
+    inicio = time.perf_counter()
+    for torre_id in range(5):
+        torres[torre_id] = _torre(rnd)
+        motor.upsert(torre_id, *torres[torre_id])
+    motor.remove(6)
+    del torres[6]
+    assert time.perf_counter() - inicio < 0.1
+    consulta.join()
+
+    motor._rasterizar = rasterizar
+    nuevo = CoverageEngine(celda_km=1.0)
+    nuevo.build([(i, *t) for i, t in torres.items()])
+    assert motor.area_km2() == pytest.approx(nuevo.area_km2(), rel=2e-3)
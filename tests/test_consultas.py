@@ -0,0 +1,41 @@
+import pytest
+
+import consultas
+import database
+
+TORRE_PRUEBA = consultas.registrar("prueba_torre_por_id", "SELECT id, nombre FROM Torres WHERE id = ?")
+FALLA_PRUEBA = consultas.registrar("prueba_falla", "SELECT columna_inexistente FROM Torres")
+
+
+def test_se_traduce_una_vez_al_registrar():
+    consulta = consultas.registrar("prueba_traduccion", "UPDATE Torres SET fecha_actualizacion = GETDATE() WHERE id = ?")
+    assert consulta.sql == "UPDATE Torres SET fecha_actualizacion = datetime('now') WHERE id = ?"
+    assert consultas.nombre_consulta(consulta.sql) == "prueba_traduccion"
+    with pytest.raises(ValueError):
+        consultas.registrar("prueba_traduccion", "SELECT 1")
+
+
+def test_texto_libre_se_traduce_desde_el_cache():
+    query = "SELECT id FROM Torres WHERE fecha_creacion < GETDATE() AND id = ?"
+    database.translate_query(query)
+    aciertos = database.translate_query.cache_info().hits
+    assert database.translate_query(query) == "SELECT id FROM Torres WHERE fecha_creacion < datetime('now') AND id = ?"
+    assert database.translate_query.cache_info().hits == aciertos + 1
+
+
+def test_estadisticas_por_sentencia(cliente, autorizacion):
+    assert consultas.ejecutar(TORRE_PRUEBA, (1,), fetch_one=True)["id"] == 1
+    assert consultas.ejecutar(TORRE_PRUEBA, (-1,), fetch_one=True) is None
+    assert "error" in consultas.ejecutar(FALLA_PRUEBA, fetch_all=True)
+
+    assert cliente.get("/api/admin/consultas").status_code in (401, 403)
+    respuesta = cliente.get("/api/admin/consultas", headers=autorizacion)
+    assert respuesta.status_code == 200
+    por_nombre = {stats["nombre"]: stats for stats in respuesta.json()}
+    torre, falla = por_nombre["prueba_torre_por_id"], por_nombre["prueba_falla"]
+    assert (torre["llamadas"], torre["filas"], torre["errores"]) == (2, 1, 0)
+    assert (falla["llamadas"], falla["errores"]) == (1, 1)
+    assert torre["tiempo_max_ms"] >= torre["tiempo_medio_ms"] > 0
+    # Las sentencias que usa la API quedan registradas por nombre
+    assert "torre_por_id" in por_nombre
+
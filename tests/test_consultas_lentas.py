@@ -0,0 +1,66 @@
+import json
+import logging
+
+import consultas_lentas
+from consultas_lentas import RegistroLentas, normalizar_sql
+from database import execute_query
+
+QUERY = "SELECT id, nombre FROM Torres WHERE tipo_convenio = ? AND id IN (?, ?, ?)"
+
+
+def test_normalizar_agrupa_literales_y_listas():
+    assert normalizar_sql("SELECT *  FROM Torres\n WHERE id IN (1, 2, 3) AND nombre = 'O''Higgins'") == \
+        "SELECT * FROM Torres WHERE id IN (?, ...) AND nombre = ?"
+    assert normalizar_sql(QUERY) == "SELECT id, nombre FROM Torres WHERE tipo_convenio = ? AND id IN (?, ...)"
+
+
+def test_umbral_y_plan_capturado_una_vez(cliente, caplog, monkeypatch):
+    registro = RegistroLentas(umbral_ms=50)
+    planes = []
+    plan_real = consultas_lentas.plan_de_consulta
+    monkeypatch.setattr(consultas_lentas, "plan_de_consulta", lambda sql, params: planes.append(sql) or plan_real(sql, params))
+
+    with caplog.at_level(logging.WARNING, logger="consultas_lentas"):
+        registro.observar(QUERY, ("Ecom", 1, 2, 3), 0.049, 3, None)
+        assert registro.top() == []
+        registro.observar(QUERY, ("Ecom", 1, 2, 3), 0.2, 3, None)
+        registro.observar(QUERY, ("Policia", 4, 5, 6), 0.1, 1, "falla")
+
+    entrada, = registro.top()
+    assert (entrada["ocurrencias"], entrada["errores"], entrada["filas_max"]) == (2, 1, 3)
+    assert entrada["tiempo_max_ms"] == 200.0 and entrada["tiempo_medio_ms"] == 150.0
+    assert len(planes) == 1
+    assert any("USING INDEX" in linea or "USING INTEGER PRIMARY KEY" in linea for linea in entrada["plan"])
+    # Sólo los tipos de los parámetros: nunca los valores
+    assert entrada["parametros"] == ["str", "int", "int", "int"]
+
+    eventos = [json.loads(mensaje) for mensaje in caplog.messages]
+    assert [evento["duracion_ms"] for evento in eventos] == [200.0, 100.0]
+    assert eventos[0]["plan"] == entrada["plan"] and eventos[1]["plan"] is None
+    assert "Ecom" not in caplog.text and "Policia" not in caplog.text
+
+
+def test_consultas_distintas_acotadas():
+    registro = RegistroLentas(umbral_ms=0, maximo=2)
+    for tabla in ("Torres", "Mantenimientos", "Blobs"):
+        registro.observar(f"SELECT COUNT(*) FROM {tabla}", None, 0.01, 1, None)
+    assert len(registro.top()) == 2 and registro.descartadas == 1
+    # Las ya registradas siguen acumulando
+    registro.observar("SELECT COUNT(*) FROM Torres", None, 0.01, 1, None)
+    assert registro.top("ocurrencias")[0]["ocurrencias"] == 2
+
+
+def test_endpoint_de_consultas_lentas(cliente, autorizacion, monkeypatch):
+    registro = consultas_lentas.get_registro_lentas()
+    monkeypatch.setattr(registro, "umbral_ms", 0.0)
+    registro.reiniciar()
+    execute_query("SELECT nombre FROM Torres WHERE id = 3", fetch_one=True)
+    monkeypatch.undo()
+
+    assert cliente.get("/api/admin/consultas-lentas").status_code in (401, 403)
+    respuesta = cliente.get("/api/admin/consultas-lentas", params={"orden": "ocurrencias"}, headers=autorizacion)
+    assert respuesta.status_code == 200
+    lentas = {consulta["sql"]: consulta for consulta in respuesta.json()["consultas"]}
+    assert lentas["SELECT nombre FROM Torres WHERE id = ?"]["plan"]
+    respuesta = cliente.get("/api/admin/consultas-lentas", params={"orden": "sql"}, headers=autorizacion)
+    assert respuesta.status_code == 400
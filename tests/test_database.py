@@ -0,0 +1,145 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import database
+
+
+def test_lecturas_no_esperan_detras_de_escrituras(cliente):
+    def escritura_lenta(conn):
+        conn.execute("UPDATE Torres SET notas = notas WHERE id = 1")
+        time.sleep(0.15)
+
+    async def medir():
+        escrituras = [asyncio.ensure_future(database.run_with_db(escritura_lenta)) for _ in range(8)]
+        await asyncio.sleep(0.05)
+        inicio = time.perf_counter()
+        fila = await database.execute_query_async("SELECT COUNT(*) AS n FROM Torres", fetch_one=True)
+        espera = time.perf_counter() - inicio
+        await asyncio.gather(*escrituras)
+        return fila, espera
+
+    fila, espera = asyncio.run(medir())
+    assert fila["n"] > 0
+    # Con un executor compartido la lectura esperaba detrás de las escrituras en cola (8 x 0.15 s)
+    assert espera < 0.25
+
+
+def test_escrituras_van_al_executor_de_escrituras(cliente):
+    async def hilo(query):
+        return await database.run_query_in_db_thread(query, lambda: __import__("threading").current_thread().name)
+
+    async def nombres():
+        return (await hilo("SELECT 1"), await hilo("UPDATE Torres SET notas = notas WHERE id = 0"))
+
+    lectura, escritura = asyncio.run(nombres())
+    assert lectura.startswith("db_") and escritura.startswith("db-escritura")
+
+
+def test_consultas_no_bloquean_el_event_loop(cliente):
+    def lectura_lenta():
+        time.sleep(0.2)
+        return database.execute_query("SELECT COUNT(*) AS n FROM Torres", fetch_one=True)
+
+    async def medir():
+        latidos = 0
+
+        async def latir():
+            nonlocal latidos
+            while True:
+                await asyncio.sleep(0.01)
+                latidos += 1
+
+        latido = asyncio.ensure_future(latir())
+        fila = await database.run_in_db_thread(lectura_lenta)
+        latido.cancel()
+        return fila, latidos
+
+    fila, latidos = asyncio.run(medir())
+    assert fila["n"] > 0
+    # Con la consulta en el event loop no habría ni un latido en 0.2 s
+    assert latidos >= 5
+
+
+def test_variantes_async_equivalen_a_las_sincronicas(cliente):
+    query = "SELECT id, nombre FROM Torres ORDER BY id"
+    assert asyncio.run(database.execute_query_async(query, fetch_all=True)) == database.execute_query(query, fetch_all=True)
+
+    def falla(conn):
+        conn.execute("UPDATE Torres SET notas = 'no queda' WHERE id = 2")
+        raise ValueError("falla")
+
+    with pytest.raises(ValueError):
+        asyncio.run(database.run_with_db(falla))
+    # run_with_db deshace la transacción si func falla
+    assert database.execute_query("SELECT notas FROM Torres WHERE id = 2", fetch_one=True)["notas"] != 'no queda'
+
+
+def _pool(**opciones):
+    creadas = []
+
+    def fabrica():
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        creadas.append(conn)
+        return conn
+
+    return database.ConnectionPool(fabrica, **opciones), creadas
+
+
+def test_pool_agotado_espera_y_vence():
+    pool, creadas = _pool(max_size=2, timeout=0.1)
+    primera, segunda = pool.acquire(), pool.acquire()
+    inicio = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    assert time.perf_counter() - inicio >= 0.1
+    assert pool.stats()["esperas"] >= 1
+
+    # Al devolver una conexión, quien espera la recibe en lugar de abrir otra
+    threading.Timer(0.02, pool.release, (primera,)).start()
+    pool._timeout = 1.0
+    assert pool.acquire() is primera
+    assert len(creadas) == 2
+    pool.release(segunda)
+
+
+def test_pool_descarta_conexiones_rotas():
+    pool, creadas = _pool(max_size=1, timeout=0.1)
+    conn = pool.acquire()
+    pool.release(conn, broken=True)
+    assert pool.stats()["descartadas"] == 1 and pool.stats()["abiertas"] == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    # El lugar liberado permite abrir una nueva
+    nueva = pool.acquire()
+    assert nueva is not conn and len(creadas) == 2
+    pool.release(nueva)
+
+
+def test_pool_revisa_conexiones_ociosas():
+    pool, creadas = _pool(max_size=1, max_idle=0.0)
+    conn = pool.acquire()
+    pool.release(conn)
+    # Una conexión sana se reutiliza tras el SELECT 1 de control
+    assert pool.acquire() is conn
+    conn.close()
+    pool.release(conn)
+    # Cerrada por fuera: falla el control, se descarta y se abre otra
+    nueva = pool.acquire()
+    assert nueva is not conn
+    assert pool.stats()["descartadas"] == 1 and pool.stats()["reutilizadas"] == 1
+    pool.release(nueva)
+
+
+def test_checkout_hace_rollback_y_devuelve_la_conexion(cliente):
+    antes = database.get_pool_stats()["escritura"]["ociosas"]
+    with pytest.raises(RuntimeError):
+        with database.get_db() as conn:
+            conn.execute("UPDATE Torres SET notas = 'no queda' WHERE id = 1")
+            raise RuntimeError("falla a mitad de la transacción")
+    fila = database.execute_query("SELECT notas FROM Torres WHERE id = 1", fetch_one=True)
+    assert fila["notas"] != 'no queda'
+    assert database.get_pool_stats()["escritura"]["ociosas"] == max(antes, 1)
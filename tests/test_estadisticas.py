@@ -0,0 +1,67 @@
+from database import execute_query
+
+TORRE = {
+    "nombre": "Torre estadísticas", "tipo": "torre", "direccion": "Ruta 11 km 1000",
+    "latitud": -27.3, "longitud": -58.9, "estado": "operativa", "alcance_km": 5.0,
+    "tipo_convenio": "Ecom",
+}
+
+
+def _reales():
+    """Los mismos valores calculados con COUNT sobre las tablas base"""
+    def contar(query):
+        return execute_query(query, fetch_one=True)["n"]
+
+    def convenio(tipo):
+        return contar(f"SELECT COUNT(*) AS n FROM Torres WHERE tipo_convenio = '{tipo}'")
+
+    return {
+        "total_torres": contar("SELECT COUNT(*) AS n FROM Torres"),
+        "torres_ecom": convenio("Ecom"),
+        "torres_policia": convenio("Policia"),
+        "torres_de_terceros": convenio("De tercero"),
+        "torres_visitadas": contar("SELECT COUNT(DISTINCT TorreID) AS n FROM Mantenimientos"),
+    }
+
+
+def _materializadas(cliente):
+    respuesta = cliente.get("/api/estadisticas")
+    assert respuesta.status_code == 200
+    estadisticas = respuesta.json()
+    del estadisticas["cobertura_km2"]
+    return estadisticas
+
+
+def test_contadores_siguen_altas_cambios_y_bajas(cliente):
+    assert _materializadas(cliente) == _reales()
+
+    assert cliente.post("/api/torres", json=TORRE).status_code == 200
+    torre_id = execute_query("SELECT MAX(id) AS id FROM Torres", fetch_one=True)["id"]
+    assert _materializadas(cliente) == _reales()
+
+    for _ in range(2):
+        respuesta = cliente.post("/api/mantenimientos", json={
+            "TorreID": torre_id, "fecha_inicio_mantenimiento": "2025-02-01T09:00:00",
+            "descripcion_trabajo": "Visita",
+        })
+        assert respuesta.status_code == 200
+    assert _materializadas(cliente) == _reales()
+
+    assert cliente.put(f"/api/torres/{torre_id}", json={"tipo_convenio": "Policia"}).status_code == 200
+    assert _materializadas(cliente) == _reales()
+
+    # El borrado en cascada de los mantenimientos también descuenta la visita
+    assert cliente.delete(f"/api/torres/{torre_id}").status_code == 200
+    assert _materializadas(cliente) == _reales()
+
+
+def test_reconstruir_corrige_la_deriva(cliente, autorizacion):
+    assert cliente.post("/api/admin/estadisticas/reconstruir").status_code in (401, 403)
+    execute_query("UPDATE EstadisticasResumen SET valor = valor + 7 WHERE clave = 'total_torres'")
+
+    respuesta = cliente.post("/api/admin/estadisticas/reconstruir", headers=autorizacion)
+    assert respuesta.status_code == 200
+    deriva = respuesta.json()["deriva"]["total_torres"]
+    assert deriva["materializado"] == deriva["real"] + 7
+    assert _materializadas(cliente) == _reales()
+    assert cliente.post("/api/admin/estadisticas/reconstruir", headers=autorizacion).json()["deriva"] == {}
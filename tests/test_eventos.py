@@ -0,0 +1,61 @@
+import threading
+import time
+
+import eventos
+
+
+def _indice(tabla, filas, demora=0.0):
+    """IndiceSincronizado sobre una lista: cuenta lecturas y guarda lo aplicado"""
+    estado = {"lecturas": 0, "construido": None, "aplicadas": []}
+
+    def leer():
+        estado["lecturas"] += 1
+        time.sleep(demora)
+        return list(filas)
+
+    def construir(leidas):
+        estado["construido"] = leidas
+
+    def aplicar(accion, registro_id, datos):
+        estado["aplicadas"].append((accion, registro_id))
+
+    return eventos.IndiceSincronizado(tabla, leer, construir, aplicar), estado
+
+
+def test_carga_concurrente_lee_la_tabla_una_vez():
+    indice, estado = _indice("PruebaConcurrente", [1, 2, 3], demora=0.05)
+    hilos = [threading.Thread(target=indice.cargar) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert indice.cargado()
+    assert estado["lecturas"] == 1
+    assert estado["construido"] == [1, 2, 3]
+
+
+def test_escritura_durante_la_lectura_obliga_a_releer():
+    filas = [1]
+    indice, estado = _indice("PruebaRelectura", filas, demora=0.1)
+    hilo = threading.Thread(target=indice.cargar)
+    hilo.start()
+    time.sleep(0.03)
+    filas.append(2)
+    eventos.publicar("PruebaRelectura", eventos.INSERT, 2, {})
+    hilo.join()
+    assert estado["lecturas"] == 2
+    assert estado["construido"] == [1, 2]
+    # Lo publicado antes de terminar la carga ya está en la relectura
+    assert estado["aplicadas"] == []
+
+
+def test_escrituras_y_recarga_con_indice_cargado():
+    indice, estado = _indice("PruebaEscrituras", [1])
+    indice.cargar()
+    eventos.publicar("PruebaEscrituras", eventos.UPDATE, 1, {})
+    eventos.publicar("PruebaEscrituras", eventos.DELETE, 1)
+    assert estado["aplicadas"] == [(eventos.UPDATE, 1), (eventos.DELETE, 1)]
+    eventos.publicar("PruebaEscrituras", eventos.RECARGA)
+    assert not indice.cargado()
+    indice.cargar()
+    assert estado["lecturas"] == 2
@@ -0,0 +1,53 @@
+import csv
+import io
+import json
+
+import database
+import exportacion
+
+
+def test_csv_sin_filas_trae_el_encabezado(cliente):
+    respuesta = cliente.get("/api/mantenimientos/export?format=csv&desde=1990-01-01&hasta=1990-01-02")
+    assert respuesta.status_code == 200
+    filas = list(csv.reader(io.StringIO(respuesta.text)))
+    assert len(filas) == 1
+    assert filas[0][:3] == ["id", "TorreID", "torre_nombre"]
+
+
+def test_ndjson_sin_filas_queda_vacio(cliente):
+    respuesta = cliente.get("/api/mantenimientos/export?format=ndjson&desde=1990-01-01&hasta=1990-01-02")
+    assert respuesta.status_code == 200
+    assert respuesta.content == b""
+
+
+def test_csv_y_ndjson_traen_las_mismas_filas(cliente):
+    filas_csv = list(csv.DictReader(io.StringIO(cliente.get("/api/mantenimientos/export?format=csv").text)))
+    filas_ndjson = [
+        json.loads(linea) for linea in cliente.get("/api/mantenimientos/export?format=ndjson").text.splitlines()
+    ]
+    assert [int(fila["id"]) for fila in filas_csv] == [fila["id"] for fila in filas_ndjson]
+
+
+def test_exportacion_no_retiene_conexiones_del_pool(cliente):
+    bloques = exportacion.exportar_mantenimientos("csv")
+    next(bloques)
+    # A mitad de la descarga el pool de lectura queda libre para el resto
+    assert database._read_pool.stats()["en_uso"] == 0
+    bloques.close()
+
+
+def test_exportaciones_simultaneas_acotadas(cliente):
+    abiertas = [exportacion.exportar_mantenimientos("csv") for _ in range(exportacion.EXPORTACION_MAX_CONCURRENTES)]
+    next(abiertas[0])
+    respuesta = cliente.get("/api/mantenimientos/export?format=csv")
+    assert respuesta.status_code == 503
+    assert respuesta.headers["Retry-After"]
+    # Terminada, con error o descartada sin empezar, cada una devuelve su lugar
+    abiertas[0].close()
+    del abiertas[1]
+    assert cliente.get("/api/mantenimientos/export?format=csv").status_code == 200
+    for bloques in abiertas[1:]:
+        bloques.close()
+    otras = [exportacion.exportar_mantenimientos("csv") for _ in range(exportacion.EXPORTACION_MAX_CONCURRENTES)]
+    for bloques in otras:
+        bloques.close()
@@ -0,0 +1,44 @@
+import math
+import random
+
+import pytest
+
+from geo import EARTH_RADIUS_KM, KM_PER_DEGREE_LAT, bbox_for_radius, haversine_km
+
+
+def _destino(lat, lon, rumbo, km):
+    """Punto a km de (lat, lon) con el rumbo dado (radianes)"""
+    d = km / EARTH_RADIUS_KM
+    phi, lam = math.radians(lat), math.radians(lon)
+    phi2 = math.asin(math.sin(phi) * math.cos(d) + math.cos(phi) * math.sin(d) * math.cos(rumbo))
+    lam2 = lam + math.atan2(math.sin(rumbo) * math.sin(d) * math.cos(phi),
+                            math.cos(d) - math.sin(phi) * math.sin(phi2))
+    return math.degrees(phi2), math.degrees(lam2)
+
+
+def test_grado_de_latitud_coincide_con_haversine():
+    assert haversine_km(0, 0, 1, 0) == pytest.approx(KM_PER_DEGREE_LAT, rel=1e-9)
+
+
+def test_bbox_contiene_el_circulo():
+    rnd = random.Random(0)
+    for _ in range(20000):
+        lat, lon = rnd.uniform(-85, 85), rnd.uniform(-170, 170)
+        radio = rnd.uniform(0.1, 2000)
+        lat_min, lat_max, lon_min, lon_max = bbox_for_radius(lat, lon, radio)
+        punto_lat, punto_lon = _destino(lat, lon, rnd.uniform(0, 2 * math.pi), radio * (1 - 1e-9))
+        assert lat_min <= punto_lat <= lat_max
+        assert any(lon_min <= punto_lon + vuelta <= lon_max for vuelta in (-360, 0, 360))
+
+
+def test_bbox_no_pierde_torres_en_el_borde_del_radio():
+    # Torre a 9.995 km de la consulta, justo al norte
+    lat_torre = -27.45 + 9.995 / KM_PER_DEGREE_LAT
+    assert haversine_km(-27.45, -58.98, lat_torre, -58.98) <= 10
+    lat_min, lat_max, _, _ = bbox_for_radius(-27.45, -58.98, 10)
+    assert lat_min <= lat_torre <= lat_max
+
+
+def test_bbox_con_polo_toma_todas_las_longitudes():
+    _, lat_max, lon_min, lon_max = bbox_for_radius(89.5, 10, 100)
+    assert lat_max == 90.0 and lon_max - lon_min == 360.0
@@ -0,0 +1,74 @@
+import json
+
+import importacion
+from database import execute_query
+
+
+def _torre(nombre, **cambios):
+    return {
+        "nombre": nombre, "tipo": "torre", "direccion": "Ruta 16 km 200",
+        "latitud": -27.0, "longitud": -59.5, "estado": "operativa", "alcance_km": 8.0,
+        "tipo_convenio": "Policia", **cambios,
+    }
+
+
+def _importadas(prefijo):
+    filas = execute_query("SELECT nombre FROM Torres WHERE nombre LIKE ? ORDER BY id", (f"{prefijo}%",), fetch_all=True)
+    return [fila["nombre"] for fila in filas]
+
+
+def test_filas_invalidas_se_informan_y_no_frenan_el_resto(cliente):
+    filas = [
+        _torre("validacion 1"),
+        _torre("validacion 2", latitud="no es un número"),
+        {"nombre": "validacion 3"},
+        "no es un objeto",
+        _torre("validacion 5"),
+    ]
+    respuesta = cliente.post("/api/torres/bulk", json=filas)
+    assert respuesta.status_code == 200
+    resultado = respuesta.json()
+    assert (resultado["total"], resultado["insertadas"], resultado["con_errores"]) == (5, 2, 3)
+    assert [error["fila"] for error in resultado["errores"]] == [2, 3, 4]
+    assert any(mensaje.startswith("latitud") for mensaje in resultado["errores"][0]["errores"])
+    assert _importadas("validacion") == ["validacion 1", "validacion 5"]
+
+
+def test_lote_que_falla_se_reintenta_fila_por_fila(cliente, monkeypatch):
+    monkeypatch.setattr(importacion, "LOTE_IMPORTACION", 3)
+    # Pasa la validación pero viola la clave foránea al insertar: el lote 4-6 falla
+    filas = [_torre(f"lote {i}") for i in range(1, 8)]
+    filas[4]["UsuarioCreadorID"] = 999999
+    resultado = importacion.importar_torres(json.dumps(filas).encode(), "json")
+    assert (resultado["insertadas"], resultado["con_errores"]) == (6, 1)
+    assert resultado["errores"][0]["fila"] == 5
+    assert "FOREIGN KEY" in resultado["errores"][0]["errores"][0]
+    assert _importadas("lote") == [f"lote {i}" for i in (1, 2, 3, 4, 6, 7)]
+
+
+def test_formatos_csv_y_geojson(cliente):
+    csv = (
+        "nombre,tipo,direccion,latitud,longitud,estado,alcance_km,tipo_convenio,notas\n"
+        "csv 1,torre,Calle 1,-27.1,-59.1,operativa,3,Ecom,\n"
+    )
+    respuesta = cliente.post("/api/torres/bulk", content=csv, headers={"Content-Type": "text/csv"})
+    assert respuesta.json()["insertadas"] == 1
+    # Celda vacía: campo no informado
+    assert execute_query("SELECT notas FROM Torres WHERE nombre = 'csv 1'", fetch_one=True)["notas"] is None
+
+    propiedades = _torre("geojson 1")
+    del propiedades["latitud"], propiedades["longitud"]
+    coleccion = {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-59.25, -27.75]},
+         "properties": propiedades},
+    ]}
+    respuesta = cliente.post("/api/torres/bulk", content=json.dumps(coleccion))
+    assert respuesta.json()["insertadas"] == 1
+    torre = execute_query("SELECT latitud, longitud FROM Torres WHERE nombre = 'geojson 1'", fetch_one=True)
+    assert (torre["latitud"], torre["longitud"]) == (-27.75, -59.25)
+
+
+def test_archivo_ilegible_da_400(cliente):
+    assert cliente.post("/api/torres/bulk", content=b"{no es json").status_code == 400
+    respuesta = cliente.post("/api/torres/bulk", params={"formato": "geojson"}, json=[_torre("x")])
+    assert respuesta.status_code == 400
@@ -0,0 +1,56 @@
+import sqlite3
+
+import pytest
+
+import database
+
+
+def _tablas(conn):
+    return {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")}
+
+
+def test_sentencias_sql_respeta_triggers():
+    script = """
+        CREATE TABLE A (x INTEGER); -- comentario
+        CREATE TRIGGER A_ins AFTER INSERT ON A
+        BEGIN
+            UPDATE A SET x = x + 1 WHERE x = new.x;
+            SELECT ';';
+        END;
+        INSERT INTO A VALUES (1);
+    """
+    sentencias = list(database.sentencias_sql(script))
+    assert len(sentencias) == 3
+    assert "SELECT ';'" in sentencias[1]
+
+
+def test_base_nueva_aplica_todas_las_migraciones(tmp_path):
+    ruta = tmp_path / "nueva.db"
+    database.init_sqlite_db(ruta)
+    conn = sqlite3.connect(ruta)
+    assert database.apply_migrations(conn) == [version for version, _, _ in database.MIGRACIONES]
+    assert {"Torres_rtree", "EstadisticasResumen", "Blobs", "Torres_rtree_insert"} <= _tablas(conn)
+    assert database.apply_migrations(conn) == []
+    conn.close()
+
+
+def test_migracion_fallida_no_deja_nada_aplicado(tmp_path, monkeypatch):
+    ruta = tmp_path / "fallida.db"
+    database.init_sqlite_db(ruta)
+    conn = sqlite3.connect(ruta)
+    database.apply_migrations(conn)
+
+    def migracion_rota(cursor):
+        database.ejecutar_script(cursor, """
+            CREATE TABLE MigracionParcial (id INTEGER);
+            CREATE INDEX IX_MigracionParcial ON MigracionParcial(id);
+            INSERT INTO TablaQueNoExiste VALUES (1);
+        """)
+
+    version = max(version for version, _, _ in database.MIGRACIONES) + 1
+    monkeypatch.setattr(database, "MIGRACIONES", database.MIGRACIONES + [(version, "Rota", migracion_rota)])
+    with pytest.raises(sqlite3.OperationalError):
+        database.apply_migrations(conn)
+    assert "MigracionParcial" not in _tablas(conn)
+    assert version not in database.get_schema_version(conn)
+    conn.close()
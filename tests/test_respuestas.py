@@ -0,0 +1,60 @@
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import respuestas
+from database import execute_query
+
+COLUMNAS = ("id", "nombre", "latitud", "alcance_km", "notas", "costo", "fecha")
+FILAS = [
+    (1, "Torre Ñandú \"norte\"", -27.451234, 15.0, None, Decimal("1250.50"), datetime(2024, 3, 1, 10, 30)),
+    (2, "Repetidor 🚀", -26.0, 0.5, "línea 1\nlínea 2", Decimal("3"), date(2024, 3, 2)),
+    (3, "", 0.0, 2.25, "", None, None),
+]
+
+
+def _camino_dict(columnas, filas):
+    """Lo que hacía FastAPI con response_model=List[dict]: un dict por fila y JSONResponse"""
+    return JSONResponse(jsonable_encoder([dict(zip(columnas, fila)) for fila in filas])).body
+
+
+@pytest.fixture(params=["orjson", "json"])
+def serializador(request, monkeypatch):
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(respuestas, "orjson", None)
+    return request.param
+
+
+def test_tuplas_igual_que_dicts(serializador):
+    assert json.loads(respuestas.codificar_filas(COLUMNAS, FILAS)) == json.loads(_camino_dict(COLUMNAS, FILAS))
+    # Sin tipos especiales el cuerpo es idéntico byte a byte
+    simples = [fila[:5] for fila in FILAS]
+    assert respuestas.codificar_filas(COLUMNAS[:5], simples) == _camino_dict(COLUMNAS[:5], simples)
+
+
+def test_columnas_extra_de_paginacion_se_descartan(serializador):
+    filas = [(*fila, "cursor", 99) for fila in FILAS]
+    assert respuestas.codificar_filas(COLUMNAS, filas) == respuestas.codificar_filas(COLUMNAS, FILAS)
+    assert respuestas.codificar_filas(COLUMNAS, []) == b"[]"
+
+
+def test_listado_igual_al_de_execute_query(cliente):
+    respuesta = cliente.get("/api/torres")
+    assert respuesta.headers["content-type"] == "application/json"
+    assert respuesta.headers["etag"]
+    filas = execute_query("SELECT * FROM Torres ORDER BY id", fetch_all=True)
+    assert respuesta.json() == json.loads(JSONResponse(jsonable_encoder(filas)).body)
+
+
+def test_aviso_sin_orjson(monkeypatch, caplog):
+    monkeypatch.setattr(respuestas, "orjson", None)
+    with caplog.at_level(logging.WARNING, logger="respuestas"):
+        respuestas.avisar_serializador()
+    assert "orjson" in caplog.text
@@ -0,0 +1,89 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import rutas
+
+
+def _puntos(semilla, n):
+    rnd = np.random.default_rng(semilla)
+    return rnd.uniform(-28.0, -24.0, n), rnd.uniform(-63.0, -58.0, n)
+
+
+def _distancias(semilla, n, regreso=True):
+    distancias = rutas.matriz_haversine(*_puntos(semilla, n))
+    if not regreso:
+        distancias[:, 0] = 0.0
+    return distancias
+
+
+def _optimo(distancias):
+    n = distancias.shape[0]
+    return min(
+        rutas.largo_recorrido(distancias, np.array((0, *orden)))
+        for orden in itertools.permutations(range(1, n))
+    )
+
+
+def _es_recorrido(recorrido, n):
+    return recorrido[0] == 0 and sorted(recorrido.tolist()) == list(range(n))
+
+
+@pytest.mark.parametrize("regreso", [True, False])
+@pytest.mark.parametrize("n", range(1, rutas.RUTAS_EXACTO_MAX + 2))
+def test_pocas_paradas_dan_el_optimo(n, regreso):
+    for semilla in range(20):
+        distancias = _distancias(semilla, n, regreso)
+        recorrido, _, largo, _, convergio = rutas.optimizar(distancias, 5.0)
+        assert _es_recorrido(recorrido, n)
+        assert convergio
+        assert largo == pytest.approx(_optimo(distancias))
+
+
+@pytest.mark.parametrize("regreso", [True, False])
+@pytest.mark.parametrize("n", [3, 4])
+def test_busqueda_local_optima_con_cuatro_puntos(n, regreso):
+    # Con hasta cuatro puntos todo circuito está a un 2-opt de cualquier otro
+    for semilla in range(50):
+        distancias = _distancias(semilla, n, regreso)
+        _, _, largo, _, _ = rutas.optimizar(distancias, 5.0, exacto_max=0)
+        assert largo == pytest.approx(_optimo(distancias))
+
+
+@pytest.mark.parametrize("semilla", range(10))
+def test_busqueda_local_nunca_empeora(semilla):
+    distancias = _distancias(semilla, 60)
+    recorrido, largo_inicial, largo, _, _ = rutas.optimizar(distancias, 5.0, exacto_max=0)
+    assert _es_recorrido(recorrido, 60)
+    assert largo == pytest.approx(rutas.largo_recorrido(distancias, recorrido))
+    assert largo <= largo_inicial + rutas.EPSILON_KM
+
+    for pasada in (rutas.pasada_2opt, rutas.pasada_or_opt):
+        recorrido = rutas.vecino_mas_cercano(distancias)
+        antes = rutas.largo_recorrido(distancias, recorrido)
+        pasada(distancias, recorrido, float("inf"))
+        assert _es_recorrido(recorrido, 60)
+        assert rutas.largo_recorrido(distancias, recorrido) <= antes + rutas.EPSILON_KM
+
+
+def test_planificar_sin_regreso():
+    lat, lon = _puntos(3, 7)
+    plan = rutas.planificar(lat, lon, 1.0, regreso=False)
+    assert plan["orden"][0] == 0
+    # Sin regreso el largo es la suma de los tramos
+    assert plan["distancia_km"] == pytest.approx(sum(plan["tramos_km"]))
+    assert plan["regreso_km"] == 0.0
+
+
+def test_endpoint_planificar(cliente):
+    respuesta = cliente.post("/api/rutas/planificar", json={
+        "base": "resistencia", "torre_ids": [1, 2, 3, 4], "tiempo_limite_ms": 500,
+    })
+    assert respuesta.status_code == 200
+    plan = respuesta.json()
+    assert sorted(parada["id"] for parada in plan["paradas"]) == [1, 2, 3, 4]
+    assert plan["distancia_km"] <= plan["distancia_vecino_mas_cercano_km"] + 1e-3
+
+    respuesta = cliente.post("/api/rutas/planificar", json={"base": "desconocida"})
+    assert respuesta.status_code == 400
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from geo import haversine_km
+from vecinos import IndiceVecinos
+
+ESTADOS = ["activa", "inactiva", "mantenimiento"]
+TIPOS = ["monoposte", "autosoportada", "arriostrada"]
+
+
+def _torre(rnd):
+    return (rnd.uniform(-28.0, -24.0), rnd.uniform(-63.0, -58.0), "t",
+            rnd.choice(ESTADOS), rnd.choice(TIPOS), None)
+
+
+def _fuerza_bruta(torres, lat, lon, k, estados=None, tipo=None, max_km=None):
+    distancias = sorted(
+        (haversine_km(lat, lon, t[0], t[1]), torre_id)
+        for torre_id, t in torres.items()
+        if (estados is None or t[3] in estados) and (tipo is None or t[4] == tipo)
+    )
+    if max_km is not None:
+        distancias = [(d, torre_id) for d, torre_id in distancias if d <= max_km]
+    return distancias[:k]
+
+
+def _comparar(indice, torres, lat, lon, k, **filtros):
+    esperado = _fuerza_bruta(torres, lat, lon, k, **filtros)
+    obtenido = indice.knn(lat, lon, k, **filtros)
+    assert len(obtenido) == len(esperado)
+    for vecino, (distancia, _) in zip(obtenido, esperado):
+        # Los empates pueden salir en otro orden: se comparan distancias
+        assert vecino["distancia_km"] == pytest.approx(distancia, abs=2e-3)
+
+
+@pytest.mark.parametrize("semilla", [1, 2])
+def test_knn_coincide_con_fuerza_bruta_con_cambios(semilla):
+    rnd = random.Random(semilla)
+    torres = {i: _torre(rnd) for i in range(600)}
+    indice = IndiceVecinos(umbral_cambios=40)
+    indice.build([(i, *t) for i, t in torres.items()])
+    consultas = [
+        {}, {"estados": {"activa"}}, {"tipo": "monoposte"},
+        {"estados": {"activa", "inactiva"}, "tipo": "arriostrada"}, {"max_km": 30.0},
+        {"tipo": "inexistente"}, {"estados": {"desconocido"}},
+    ]
+    for paso in range(300):
+        torre_id = rnd.randrange(700)
+        if rnd.random() < 0.3:
+            torres.pop(torre_id, None)
+            indice.remove(torre_id)
+        else:
+            torres[torre_id] = _torre(rnd)
+            indice.upsert(torre_id, *torres[torre_id])
+        if paso % 20 == 0:
+            lat, lon = rnd.uniform(-29.0, -23.0), rnd.uniform(-64.0, -57.0)
+            for filtros in consultas:
+                _comparar(indice, torres, lat, lon, rnd.randint(1, 12), **filtros)
+
+
+@pytest.mark.parametrize("lat, lon", [(-26.0, -50.0), (60.0, 0.0), (26.0, 120.0), (-90.0, 0.0)])
+def test_knn_lejos_de_los_datos(lat, lon):
+    rnd = random.Random(5)
+    torres = {i: _torre(rnd) for i in range(500)}
+    indice = IndiceVecinos()
+    indice.build([(i, *t) for i, t in torres.items()])
+    _comparar(indice, torres, lat, lon, 5)
+    _comparar(indice, torres, lat, lon, 5, tipo="monoposte")
+
+
+def test_endpoint_knn(cliente):
+    respuesta = cliente.get("/api/torres/knn", params={"lat": -27.45, "lon": -58.98, "k": 2})
+    assert respuesta.status_code == 200
+    vecinos = respuesta.json()
+    assert len(vecinos) == 2
+    assert vecinos[0]["distancia_km"] <= vecinos[1]["distancia_km"]
+    respuesta = cliente.get("/api/torres/knn", params={"lat": -27.45, "lon": -58.98, "tipo": "inexistente"})
+    assert respuesta.status_code == 200
+    assert respuesta.json() == []
@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from versiones import Versiones, coincide_match, coincide_none_match
+
+TORRE = "/api/torres/3"
+
+
+def test_versiones_por_fila_y_recarga():
+    versiones = Versiones(epoca="e")
+    inicial = versiones.etag_fila("Torres", 1)
+    versiones.incrementar("Torres", 2)
+    assert versiones.etag_fila("Torres", 1) == inicial
+    versiones.incrementar("Torres", 1)
+    assert versiones.etag_fila("Torres", 1) != inicial
+    # Una recarga cambia la versión de todas las filas
+    otra = versiones.etag_fila("Torres", 3)
+    versiones.incrementar("Torres", recarga=True)
+    assert versiones.etag_fila("Torres", 3) != otra
+    assert versiones.etag("Torres") == '"e-3"'
+
+
+def test_comparacion_de_cabeceras():
+    assert coincide_none_match('W/"a-1", "b-2"', '"a-1"')
+    assert coincide_none_match('*', '"a-1"')
+    assert not coincide_none_match(None, '"a-1"')
+    # If-Match es fuerte: un ETag débil no alcanza
+    assert not coincide_match('W/"a-1"', '"a-1"')
+    assert coincide_match(None, '"a-1"')
+    assert coincide_match('"x", "a-1"', '"a-1"')
+
+
+def test_get_condicional_responde_304(cliente):
+    for ruta in (TORRE, "/api/torres"):
+        respuesta = cliente.get(ruta)
+        etag = respuesta.headers["ETag"]
+        assert cliente.get(ruta, headers={"If-None-Match": etag}).status_code == 304
+
+    etag = cliente.get(TORRE).headers["ETag"]
+    cliente.put(TORRE, json={"notas": "revisada"})
+    respuesta = cliente.get(TORRE, headers={"If-None-Match": etag})
+    assert respuesta.status_code == 200
+    assert respuesta.headers["ETag"] != etag
+
+
+def test_if_match_vencido_da_412(cliente):
+    etag = cliente.get(TORRE).headers["ETag"]
+    respuesta = cliente.put(TORRE, json={"notas": "primera"}, headers={"If-Match": etag})
+    assert respuesta.status_code == 200
+    nuevo = respuesta.headers["ETag"]
+    assert nuevo != etag
+
+    respuesta = cliente.put(TORRE, json={"notas": "pisada"}, headers={"If-Match": etag})
+    assert respuesta.status_code == 412
+    assert cliente.get(TORRE).json()["notas"] == "primera"
+    assert cliente.delete(TORRE, headers={"If-Match": etag}).status_code == 412
+    assert cliente.put(TORRE, json={"notas": "segunda"}, headers={"If-Match": nuevo}).status_code == 200
+
+
+def test_escrituras_simultaneas_con_el_mismo_etag(cliente):
+    etag = cliente.get(TORRE).headers["ETag"]
+
+    def actualizar(numero):
+        return cliente.put(TORRE, json={"notas": f"cuadrilla {numero}"}, headers={"If-Match": etag})
+
+    with ThreadPoolExecutor(8) as pool:
+        respuestas = list(pool.map(actualizar, range(8)))
+    codigos = sorted(respuesta.status_code for respuesta in respuestas)
+    # Sólo una gana; las demás leyeron la versión que ésa reemplazó
+    assert codigos == [200] + [412] * 7
+    ganadora = next(respuesta for respuesta in respuestas if respuesta.status_code == 200)
+    assert cliente.get(TORRE).headers["ETag"] == ganadora.headers["ETag"]
+
+
+
+def test_filas_acotadas_sin_reusar_etags():
+    versiones = Versiones(epoca="e", max_filas=3)
+    vistos = {}
+    for paso in range(40):
+        torre_id = paso * 7 % 10
+        antes = versiones.etag_fila("Torres", torre_id)
+        versiones.incrementar("Torres", torre_id)
+        vistos.setdefault(torre_id, set()).add(antes)
+        # Un ETag de antes de cualquier escritura de la fila ya no coincide
+        for fila, viejos in vistos.items():
+            assert versiones.etag_fila("Torres", fila) not in viejos
+    assert len(versiones._filas["Torres"]) == 3